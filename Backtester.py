@@ -0,0 +1,209 @@
+import numpy as np
+import pandas as pd
+from RuleCompiler import RuleCompiler
+import Metrics
+
+'''Vectorized backtest engine: runs threshold trading rules over an aligned price matrix'''
+
+class Backtester:
+    def __init__(self, tickers, trading_rules):
+        """Compile trading rules against a fixed ticker universe.
+        Args:
+            tickers: Ordered list of tickers (columns of the price matrices)
+            trading_rules: {ticker: [{'action', 'condition', 'threshold', 'shares', ...}]} as built by app.py (see RuleCompiler)"""
+
+        self.tickers = list(tickers)
+        self.column = {ticker: j for j, ticker in enumerate(self.tickers)}
+        # validated rules in evaluation order, skipping tickers we have no prices for
+        self.compiler = RuleCompiler(self.tickers, trading_rules)
+        self.rules = self.compiler.rules
+
+    def prepare(self, times, data, prices):
+        """Precompute indicator / percent-change inputs when the rules use them (see RuleCompiler.prepare)."""
+        if self.compiler.needs_features:
+            self.compiler.prepare(times, data, prices)
+
+    @staticmethod
+    def price_matrix(frames, times, tickers):
+        """Align mid prices ((High + Low) / 2) of each ticker's frame onto times.
+        Args:
+            frames: {ticker: DataFrame} with High/Low columns
+            times: Sequence of timestamps (one row per simulation step)
+            tickers: Column order
+        Returns:
+            numpy.ndarray: len(times) x len(tickers) float64 matrix, NaN where there is no bar"""
+
+        index = pd.DatetimeIndex(times)
+        matrix = np.full((len(index), len(tickers)), np.nan)
+        for j, ticker in enumerate(tickers):
+            frame = frames.get(ticker)
+            if frame is None or frame.empty:
+                continue
+            frame = frame[~frame.index.duplicated()]
+            mid = (frame['High'].to_numpy(dtype='float64') + frame['Low'].to_numpy(dtype='float64')) / 2
+            matrix[:, j] = pd.Series(mid, index=frame.index).reindex(index).to_numpy()
+        return matrix
+
+    def trigger_masks(self, prices):
+        """Boolean matrix (steps x rules): True where a rule's condition holds."""
+        return self.compiler.masks(prices)
+
+    @Metrics.timed('backtester_run_seconds', 'Vectorized engine runs')
+    def run(self, times, prices, value_prices, portfolio):
+        """Run the rules over every step and bring portfolio up to date.
+        Args:
+            times: Step timestamps
+            prices: Step x ticker matrix of prices the rules see (NaN = no bar)
+            value_prices: Step x ticker matrix of prices the portfolio fills and marks at
+            portfolio: Portfolio holding the starting cash/positions; updated in place
+        Returns:
+            dict: Per-step arrays ('cash', 'positions', 'held', 'value') and 'trades' {step: [messages]}"""
+
+        n, k = prices.shape
+        # portfolio positions as arrays; held marks tickers present as keys in portfolio.positions
+        key_order = list(portfolio.positions.keys())
+        cash = float(portfolio.cash)
+        shares = np.zeros(k, dtype=np.int64)
+        held = np.zeros(k, dtype=bool)
+        for ticker in key_order:
+            if ticker in self.column:
+                shares[self.column[ticker]] = portfolio.positions[ticker]
+                held[self.column[ticker]] = True
+
+        # only steps where some rule fires can change state
+        masks = self.trigger_masks(prices)
+        event_rows = np.flatnonzero(masks.any(axis=1))
+
+        event_cash = np.empty(len(event_rows))
+        event_shares = np.empty((len(event_rows), k), dtype=np.int64)
+        event_held = np.empty((len(event_rows), k), dtype=bool)
+        fills = ([], [], [], [], [])  # actions, tickers, prices, shares, timestamps for Portfolio.apply_fills
+        trades = {}
+        for e, i in enumerate(event_rows):
+            messages = []
+            for r in np.flatnonzero(masks[i]):
+                j, ticker, action, condition, threshold, qty = self.rules[r]
+                price = prices[i, j]
+                market_price = value_prices[i, j]
+                if action == 'sell':
+                    if shares[j] >= qty:
+                        # Portfolio.sell: fills at the market price unless it is below the limit
+                        if not np.isnan(market_price) and market_price >= price:
+                            fill = max(price, market_price)
+                            shares[j] -= qty
+                            cash += fill * qty
+                            self._fill(fills, 'SELL', ticker, fill, qty, times[i])
+                        messages.append(f"Sold {qty} {ticker} @ ${price:.2f}")
+                elif action == 'buy':
+                    if cash >= price * qty:
+                        # Portfolio.buy with a limit of price + 1
+                        limit = price + 1
+                        if not np.isnan(market_price) and market_price <= limit:
+                            fill = min(limit, market_price)
+                            if cash >= fill * qty:
+                                cash -= fill * qty
+                                shares[j] += qty
+                                if not held[j]:
+                                    held[j] = True
+                                    key_order.append(ticker)
+                                self._fill(fills, 'BUY', ticker, fill, qty, times[i])
+                        messages.append(f"Bought {qty} {ticker} @ ${price:.2f}")
+            trades[int(i)] = messages
+            event_cash[e] = cash
+            event_shares[e] = shares
+            event_held[e] = held
+
+        # forward-fill state from the last event at or before each step
+        last_event = np.searchsorted(event_rows, np.arange(n), side='right') - 1
+        before_first = last_event < 0
+        last_event = np.maximum(last_event, 0)
+        if len(event_rows):
+            cash_path = np.where(before_first, float(portfolio.cash), event_cash[last_event])
+            shares_path = np.where(before_first[:, None], self._initial(portfolio, np.int64), event_shares[last_event])
+            held_path = np.where(before_first[:, None], self._initial(portfolio, bool), event_held[last_event])
+        else:
+            cash_path = np.full(n, float(portfolio.cash))
+            shares_path = np.tile(self._initial(portfolio, np.int64), (n, 1))
+            held_path = np.tile(self._initial(portfolio, bool), (n, 1))
+
+        # mark to market in position key order, then add cash (same summation order as Portfolio.get_value);
+        # any held ticker without a price means the market is closed and the last value carries forward
+        positions_value = np.zeros(n)
+        closed = np.zeros(n, dtype=bool)
+        for ticker in key_order:
+            j = self.column.get(ticker)
+            if j is None:
+                closed[:] = True
+                continue
+            missing = np.isnan(value_prices[:, j])
+            closed |= held_path[:, j] & missing
+            positions_value += np.where(held_path[:, j] & ~missing, value_prices[:, j] * shares_path[:, j], 0.0)
+        value = cash_path + positions_value
+
+        fallback = portfolio.change_over_time.last_value if portfolio.change_over_time else np.nan
+        value[closed] = np.nan
+        filled = pd.Series(value).ffill().to_numpy()
+        # closed before any value was recorded: Portfolio.get_value falls back to cash
+        filled = np.where(np.isnan(filled), fallback, filled)
+        filled = np.where(np.isnan(filled), cash_path, filled)
+
+        # bring the portfolio up to date
+        portfolio.apply_fills(fills, {ticker: int(shares[self.column[ticker]]) if ticker in self.column else portfolio.positions[ticker]
+                                      for ticker in key_order}, cash, times, filled)
+
+        return {
+            'cash': cash_path,
+            'positions': shares_path,
+            'held': held_path,
+            'key_order': key_order,
+            'final_positions': dict(portfolio.positions),
+            'value': filled,
+            'trades': trades
+        }
+
+    @staticmethod
+    def _fill(fills, *fill):
+        for column, value in zip(fills, fill):
+            column.append(value)
+
+    def _initial(self, portfolio, dtype):
+        row = np.zeros(len(self.tickers), dtype=dtype)
+        for ticker, qty in portfolio.positions.items():
+            if ticker in self.column:
+                row[self.column[ticker]] = qty if dtype is not bool else True
+        return row
+
+    def results(self, times, prices, run, original_value, labels, dates):
+        """Build the per-step result records SimulationManager publishes.
+        Args:
+            times: Step timestamps
+            prices: Step x ticker matrix of prices the rules saw
+            run: Output of run()
+            original_value: Starting portfolio value for P&L
+            labels: Interval label per step
+            dates: Formatted date string per step
+        Returns:
+            list: One dict per step"""
+
+        records = []
+        key_order = run['key_order']
+        columns = [self.column.get(ticker) for ticker in key_order]
+        for i in range(len(times)):
+            row = prices[i]
+            current_prices = {ticker: float(row[j]) for j, ticker in enumerate(self.tickers) if not np.isnan(row[j])}
+            held = run['held'][i]
+            positions = {ticker: int(run['positions'][i, j]) if j is not None else run['final_positions'][ticker]
+                         for ticker, j in zip(key_order, columns) if j is None or held[j]}
+            value = float(run['value'][i])
+            records.append({
+                'day': i + 1,
+                'interval_label': labels[i],
+                'date': dates[i],
+                'prices': current_prices,
+                'portfolio_value': value,
+                'trades': run['trades'].get(i, []),
+                'positions': positions,
+                'cash': float(run['cash'][i]),
+                'pnl': value - original_value
+            })
+        return records
@@ -0,0 +1,195 @@
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+'''Persistent on-disk store of OHLCV bars, one memory-mappable NumPy file per column'''
+
+class BarStore:
+    def __init__(self, root, offline=False, mmap=True):
+        """Columnar bar store laid out as <root>/<TICKER>/<interval>/<column>.npy.
+        Args:
+            root: Directory holding the store (created if missing)
+            offline: If True never download; serve whatever is already stored
+            mmap: Memory-map column files on read instead of loading them into RAM"""
+
+        self.root = root
+        self.offline = offline
+        self.mmap = mmap
+        self._lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, ticker, interval):
+        return os.path.join(self.root, ticker.upper(), interval)
+
+    def _read_meta(self, ticker, interval):
+        path = os.path.join(self._dir(ticker, interval), 'meta.json')
+        if not os.path.exists(path):
+            return {'columns': [], 'coverage': []}
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _merge_ranges(ranges):
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def coverage(self, ticker, interval):
+        """Date ranges ([start, end) as 'YYYY-MM-DD' strings) already fetched for a ticker/interval."""
+        return [tuple(r) for r in self._read_meta(ticker, interval)['coverage']]
+
+    def missing_ranges(self, ticker, start, end, interval='1d'):
+        """Return the (start, end) gaps of [start, end) that are not stored yet."""
+        start, end = str(start)[:10], str(end)[:10]
+        gaps = []
+        cursor = start
+        for covered_start, covered_end in self.coverage(ticker, interval):
+            if covered_end <= cursor:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start))
+            cursor = max(cursor, covered_end)
+            if cursor >= end:
+                break
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def read(self, ticker, interval='1d', start=None, end=None):
+        """Read stored bars in [start, end) as a DataFrame indexed by tz-naive timestamps.
+        With mmap, the frame's columns are read-only views of the memory-mapped files (pages are only
+        read when touched); without it, the column files are loaded into memory."""
+        directory = self._dir(ticker, interval)
+        with self._lock:
+            meta = self._read_meta(ticker, interval)
+            index_path = os.path.join(directory, 'index.npy')
+            if not meta['columns'] or not os.path.exists(index_path):
+                return pd.DataFrame()
+
+            mmap_mode = 'r' if self.mmap else None
+            index = np.load(index_path, mmap_mode=mmap_mode)
+            lo = 0 if start is None else int(np.searchsorted(index, pd.Timestamp(start).value, side='left'))
+            hi = len(index) if end is None else int(np.searchsorted(index, pd.Timestamp(end).value, side='left'))
+
+            columns = {}
+            for column in meta['columns']:
+                columns[column] = np.load(os.path.join(directory, f'{column}.npy'), mmap_mode=mmap_mode)[lo:hi]
+        # copy=False keeps one block per column file instead of copying them into a consolidated block
+        return pd.DataFrame(columns, index=pd.DatetimeIndex(np.asarray(index[lo:hi]).astype('datetime64[ns]')), copy=False)
+
+    def write(self, ticker, interval, frame, start, end):
+        """Merge bars fetched for [start, end) into the store (see write_many)."""
+        self.write_many(ticker, interval, [(frame, start, end)])
+
+    def write_many(self, ticker, interval, fetched):
+        """Merge several downloads into the store with one rewrite of the column files.
+        A range is recorded as covered only if bars were written for it or the provider confirmed
+        there are none (DataProvider.no_bars); failed or empty downloads are retried next time.
+        Args:
+            fetched: [(frame, start, end)] with frame None or empty when nothing came back"""
+        # never mark today or later as covered - those bars are still changing
+        today = datetime.now().strftime('%Y-%m-%d')
+        frames = []
+        covered = []
+        for frame, start, end in fetched:
+            start, end = str(start)[:10], str(end)[:10]
+            has_bars = frame is not None and not frame.empty
+            if has_bars:
+                frame = frame.select_dtypes(include='number')
+                if frame.index.tz is not None:
+                    frame = frame.tz_localize(None)
+                frames.append(frame)
+            if (has_bars or (frame is not None and frame.attrs.get('no_bars'))) and start < min(end, today):
+                covered.append([start, min(end, today)])
+        if not frames and not covered:
+            return
+
+        with self._lock:
+            directory = self._dir(ticker, interval)
+            os.makedirs(directory, exist_ok=True)
+            meta = self._read_meta(ticker, interval)
+
+            if frames:
+                frame = pd.concat(frames) if len(frames) > 1 else frames[0]
+                frame = frame[~frame.index.duplicated(keep='last')]
+                existing = self.read(ticker, interval)
+                if not existing.empty:
+                    # rows from the new download win over previously stored ones
+                    frame = pd.concat([existing[~existing.index.isin(frame.index)], frame])
+                frame = frame.sort_index()
+                self._save(directory, 'index', frame.index.values.astype('datetime64[ns]').view('int64'))
+                for column in frame.columns:
+                    self._save(directory, str(column), frame[column].to_numpy())
+                meta['columns'] = [str(c) for c in frame.columns]
+
+            meta['coverage'] = self._merge_ranges(meta['coverage'] + covered)
+            self._save_meta(directory, meta)
+
+    def fetch(self, ticker, start, end, interval, download):
+        """Return stored bars for [start, end), downloading only the missing date gaps.
+        Args:
+            ticker: Stock ticker symbol
+            start: Start date in 'YYYY-MM-DD' format
+            end: End date in 'YYYY-MM-DD' format
+            interval: Bar interval (e.g. '1d', '30m')
+            download: Callable (start, end) -> DataFrame used to fill gaps
+        Returns:
+            pandas.DataFrame: Stored bars for the range"""
+
+        gaps = self.missing_ranges(ticker, start, end, interval)
+        if gaps and self.offline:
+            print(f"${ticker}: bar store is offline, {len(gaps)} date range(s) not available locally")
+        elif gaps:
+            fetched = []
+            try:
+                for gap_start, gap_end in gaps:
+                    fetched.append((download(gap_start, gap_end), gap_start, gap_end))
+            finally:
+                # keep whatever arrived even if a later gap failed, in a single write
+                self.write_many(ticker, interval, fetched)
+        return self.read(ticker, interval, start, end)
+
+    @staticmethod
+    def _save(directory, name, array):
+        # write then rename so readers never see a half-written file
+        path = os.path.join(directory, f'{name}.npy')
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _save_meta(directory, meta):
+        path = os.path.join(directory, 'meta.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+
+def main():
+    # Pre-populate the store so later runs can be fully offline:
+    #   python BarStore.py <store_dir> <start> <end> <interval> TICKER [TICKER ...]
+    if len(sys.argv) < 6:
+        print("Usage: python BarStore.py <store_dir> <start YYYY-MM-DD> <end YYYY-MM-DD> <interval> TICKER [TICKER ...]")
+        return
+    from StockData import StockData
+    root, start, end, interval = sys.argv[1:5]
+    StockData.bar_store = BarStore(root)
+    for ticker in sys.argv[5:]:
+        # only the requested interval: StockData(ticker, start, end) would also fetch and store daily bars
+        sd = StockData.from_frame(ticker.upper(), pd.DataFrame())
+        sd.get_stock_data(ticker.upper(), start, end, interval)
+        print(f"{ticker.upper()} {interval}: {len(sd.stock_data)} bars stored, coverage {StockData.bar_store.coverage(ticker, interval)}")
+
+if __name__ == "__main__":
+    main()
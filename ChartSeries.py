@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from EquityCurve import EquityCurve
+import Downsample
+
+'''Array-backed per-step simulation output (equity and per-ticker prices) for constant-size chart payloads'''
+
+class ChartSeries:
+    def __init__(self, tickers, original_value):
+        """Step timestamps, portfolio values and the step x ticker price matrix of one simulation.
+        Args:
+            tickers: Ordered list of tickers (price columns)
+            original_value: Starting portfolio value P&L is measured against"""
+
+        self.tickers = list(tickers)
+        self.original_value = original_value
+        self.equity = EquityCurve()
+        self._prices = np.empty((EquityCurve.chunk_size, len(self.tickers)))
+
+    def __len__(self):
+        return len(self.equity)
+
+    def extend(self, timestamps, values, prices):
+        """Append steps (timestamps in time order, one value and one price row per step; NaN = no price)."""
+        prices = np.asarray(prices, dtype=np.float64).reshape(-1, len(self.tickers))
+        n = len(self.equity)
+        if n + len(prices) > len(self._prices):
+            grown = np.empty((max(2 * len(self._prices), n + len(prices)), len(self.tickers)))
+            grown[:n] = self._prices[:n]
+            self._prices = grown
+        self._prices[n:n + len(prices)] = prices
+        self.equity.extend(timestamps, values)
+
+    def rows(self, start=0, stop=None):
+        """(timestamps as int64 ns, values, prices) of steps [start, stop), as views."""
+        stop = len(self.equity) if stop is None else stop
+        return (self.equity.timestamps[start:stop].view('int64'), self.equity.portfolio_values[start:stop],
+                self._prices[start:stop])
+
+    def _window(self, start, end):
+        times = self.equity.timestamps
+        lo = int(np.searchsorted(times, np.datetime64(pd.Timestamp(start), 'ns'), side='left')) if start is not None else 0
+        hi = int(np.searchsorted(times, np.datetime64(pd.Timestamp(end), 'ns'), side='right')) if end is not None else len(times)
+        return lo, max(hi, lo)
+
+    def snapshot(self, start=None, end=None):
+        """Copies of (timestamps, values, prices) with start <= timestamp <= end."""
+        lo, hi = self._window(start, end)
+        return (self.equity.timestamps[lo:hi].copy(), self.equity.portfolio_values[lo:hi].copy(),
+                self._prices[lo:hi].copy())
+
+    @staticmethod
+    def _iso(timestamps):
+        return [str(t) for t in pd.DatetimeIndex(timestamps).strftime('%Y-%m-%dT%H:%M:%S')]
+
+    @staticmethod
+    def _floats(values):
+        return [None if np.isnan(v) else round(float(v), 4) for v in values]
+
+    def chart(self, points=500, start=None, end=None, method='lttb', price_method='ohlc', tickers=None, snapshot=None):
+        """Equity, P&L and price series over [start, end], each reduced to about `points` points.
+        Args:
+            points: Target points per series
+            start, end: Optional window bounds (anything pd.Timestamp accepts)
+            method: 'lttb' or 'minmax' for the equity and P&L lines
+            price_method: 'ohlc' (one bar per bucket) or 'lttb' / 'minmax' (a line of closes)
+            tickers: Subset of tickers to include (default all)
+            snapshot: (timestamps, values, prices) from snapshot(), if already taken under a lock
+        Returns:
+            dict: JSON-ready chart payload"""
+        if tickers is None:
+            tickers = self.tickers
+        timestamps, values, prices = snapshot if snapshot is not None else self.snapshot(start, end)
+        keep = Downsample.indices(timestamps, values, points, method)
+        payload = {
+            'total_points': len(values),
+            'start': self._iso(timestamps[:1])[0] if len(values) else None,
+            'end': self._iso(timestamps[-1:])[0] if len(values) else None,
+            'equity': {'timestamps': self._iso(timestamps[keep]), 'values': self._floats(values[keep])},
+            'pnl': {'timestamps': self._iso(timestamps[keep]), 'values': self._floats(values[keep] - self.original_value)},
+            'prices': {}
+        }
+        for ticker in tickers:
+            column = prices[:, self.tickers.index(ticker)]
+            if price_method == 'ohlc':
+                starts, open_, high, low, close = Downsample.ohlc(column, points)
+                payload['prices'][ticker] = {'timestamps': self._iso(timestamps[starts]), 'open': self._floats(open_),
+                                             'high': self._floats(high), 'low': self._floats(low), 'close': self._floats(close)}
+            else:
+                present = np.flatnonzero(~np.isnan(column))
+                kept = present[Downsample.indices(timestamps[present], column[present], points, price_method)]
+                payload['prices'][ticker] = {'timestamps': self._iso(timestamps[kept]), 'values': self._floats(column[kept])}
+        return payload
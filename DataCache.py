@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+'''Process-wide cache for downloaded market data frames'''
+
+class DataCache:
+    def __init__(self, max_entries=256, max_bytes=512 * 1024 * 1024, ttl=15 * 60):
+        """Thread-safe LRU cache with size-based eviction and expiry.
+        Args:
+            max_entries: Maximum number of frames kept in the cache
+            max_bytes: Maximum total memory of cached frames (None for no limit)
+            ttl: Seconds before an entry expires (None to never expire)"""
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {key: (frame, nbytes, expires_at)}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(ticker, start=None, end=None, interval='1d', period=None, source='yfinance'):
+        """Build a cache key. Period requests (e.g. '60d') are keyed by the period in place of the start date,
+        and source keeps frames from different data providers apart."""
+        if period is not None:
+            start = f"period={period}"
+            end = None
+        return (ticker.upper(), str(start) if start is not None else None,
+                str(end) if end is not None else None, interval, source)
+
+    @staticmethod
+    def _frame_size(frame):
+        try:
+            return int(frame.memory_usage(index=True, deep=False).sum())
+        except (AttributeError, TypeError):
+            return 0
+
+    def get(self, key):
+        """Return the cached frame for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            frame, nbytes, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key, frame):
+        """Store a frame, evicting least recently used entries when over the limits."""
+        nbytes = self._frame_size(frame)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (frame, nbytes, expires_at)
+            self._bytes += nbytes
+            self._evict()
+
+    def get_or_load(self, key, loader):
+        """Return the cached frame for key, calling loader() and caching its result on a miss.
+        Empty frames are not cached so a failed download is retried next time."""
+
+        frame = self.get(key)
+        if frame is not None:
+            return frame
+        frame = loader()
+        if frame is not None and not frame.empty:
+            self.put(key, frame)
+        return frame
+
+    def invalidate(self, ticker=None):
+        """Drop every entry (or only the entries for one ticker)."""
+        with self._lock:
+            if ticker is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in [k for k in self._entries if k[0] == ticker.upper()]:
+                self._remove(key)
+
+    def stats(self):
+        """Hit/miss counters and current size, for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+    def _remove(self, key):
+        frame, nbytes, expires_at = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 (self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1)):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Whether key has a live entry. Unlike get(), counts neither a hit nor a miss and keeps the LRU order."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[2] is None or entry[2] > time.monotonic())
+
+
+# Shared by every StockData and Portfolio in the process
+shared_cache = DataCache()
@@ -0,0 +1,118 @@
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+'''Concurrent fetch layer: bounded concurrency, coalescing of identical requests and retry with backoff'''
+
+class RateLimitError(Exception):
+    """Raised by providers when the remote side answers 429 / Too Many Requests."""
+    pass
+
+
+# "HTTP 429" / "HTTP Error 429" / "status 429" as a whole word, not any message containing those digits
+_HTTP_429 = re.compile(r'\b(?:HTTP(?: Error)?|status(?: code)?)[ :]*429\b', re.IGNORECASE)
+
+
+def is_rate_limited(error):
+    """True for errors that mean 'slow down' (ours, yfinance's YFRateLimitError, HTTP 429)."""
+    if isinstance(error, RateLimitError) or 'RateLimit' in type(error).__name__:
+        return True
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        return True
+    message = str(error)
+    return 'Too Many Requests' in message or _HTTP_429.search(message) is not None
+
+
+class DataFetcher:
+    def __init__(self, max_concurrency=8, max_retries=4, backoff=0.5, max_backoff=30.0):
+        """Run fetches with at most max_concurrency in flight at once.
+        Args:
+            max_concurrency: Maximum simultaneous fetches (also the thread pool size)
+            max_retries: Retries after a rate-limited attempt before giving up
+            backoff: Initial backoff in seconds, doubled after each rate-limited attempt
+            max_backoff: Upper bound on a single backoff sleep"""
+
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._in_flight = {}  # {key: Future} for requests currently running
+        self._lock = threading.Lock()
+        self._pool = None
+        self.requests = 0
+        self.coalesced = 0
+        self.retries = 0
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='fetch')
+            return self._pool
+
+    def call(self, key, fn):
+        """Run fn() in the calling thread, or wait for an identical in-flight request and share its result."""
+        with self._lock:
+            pending = self._in_flight.get(key)
+            if pending is None:
+                pending = Future()
+                self._in_flight[key] = pending
+                owner = True
+                self.requests += 1
+            else:
+                owner = False
+                self.coalesced += 1
+        if not owner:
+            return pending.result()
+
+        try:
+            result = self._with_retry(fn)
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        else:
+            pending.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def submit(self, key, fn):
+        """Schedule call(key, fn) on the fetch pool and return a Future."""
+        return self._executor().submit(self.call, key, fn)
+
+    def fetch_many(self, requests):
+        """Run {key: fn} concurrently and return {key: result}."""
+        futures = {key: self.submit(key, fn) for key, fn in requests.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    def _with_retry(self, fn):
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            with self._slots:
+                try:
+                    return fn()
+                except Exception as e:
+                    if not is_rate_limited(e) or attempt == self.max_retries:
+                        raise
+            # back off outside the slot so other requests can proceed
+            self.retries += 1
+            time.sleep(min(delay, self.max_backoff) * (0.5 + random.random()))
+            delay *= 2
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'coalesced': self.coalesced,
+                'retries': self.retries,
+                'in_flight': len(self._in_flight),
+                'max_concurrency': self.max_concurrency
+            }
+
+
+# Shared by every StockData in the process
+shared_fetcher = DataFetcher()
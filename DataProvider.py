@@ -0,0 +1,355 @@
+import io
+import os
+import zlib
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from DataFetcher import RateLimitError
+
+'''Market data providers: where StockData gets its price history from'''
+
+def no_bars():
+    """Empty OHLCV frame meaning 'the source has no bars in this range' (e.g. a holiday week), as opposed
+    to a plain empty DataFrame from a failed or inconclusive request. The bar store records such ranges
+    as covered; plain empty results are retried on the next fetch."""
+    frame = pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Volume'], index=pd.DatetimeIndex([]))
+    frame.attrs['no_bars'] = True
+    return frame
+
+
+class DataProvider:
+    """Base class for price history backends.
+    Subclasses return OHLCV DataFrames indexed by tz-naive timestamps (empty if nothing is found;
+    no_bars() when the source confirms the range has no bars)."""
+
+    name = 'base'
+    persistent = False # True if results are worth keeping in the on-disk bar store
+    supports_bulk = False # True if history_many fetches all tickers in one request
+
+    @property
+    def key(self):
+        """Identifies this provider's data in cache keys."""
+        return self.name
+
+    @property
+    def spec(self):
+        """get_provider() spec that rebuilds this provider (None if it can't be rebuilt from a string)."""
+        return None
+
+    def history(self, ticker, start, end, interval='1d'):
+        """Bars for ticker in [start, end), dates in 'YYYY-MM-DD' format."""
+        raise NotImplementedError
+
+    def history_period(self, ticker, period, interval='1d'):
+        """Bars for the trailing period (e.g. '5d', '60d') ending now."""
+        raise NotImplementedError
+
+    def history_many(self, tickers, start, end, interval='1d'):
+        """{ticker: bars} for several tickers over the same range."""
+        return {ticker: self.history(ticker, start, end, interval) for ticker in tickers}
+
+    @staticmethod
+    def _period_to_days(period):
+        units = {'d': 1, 'wk': 7, 'mo': 30, 'y': 365}
+        for unit, days in units.items():
+            if period.endswith(unit) and period[:-len(unit)].isdigit():
+                return int(period[:-len(unit)]) * days
+        raise ValueError(f"Unsupported period '{period}'")
+
+
+class YFinanceProvider(DataProvider):
+    name = 'yfinance'
+    persistent = True
+    supports_bulk = True
+
+    def __init__(self, session=None):
+        # yfinance already shares one pooled session across threads; pass a curl_cffi/requests
+        # session only to override it (e.g. for proxies)
+        self.session = session
+
+    @property
+    def spec(self):
+        return 'yfinance' if self.session is None else None
+
+    def _ticker(self, ticker):
+        if self.session is not None:
+            return yf.Ticker(ticker, session=self.session)
+        return yf.Ticker(ticker)
+
+    @staticmethod
+    def _normalize(frame):
+        if not frame.empty:
+            frame.index = frame.index.tz_localize(None)
+        return frame
+
+    def history(self, ticker, start, end, interval='1d'):
+        return self._normalize(self._ticker(ticker).history(start=start, end=end, interval=interval))
+
+    def history_period(self, ticker, period, interval='1d'):
+        return self._normalize(self._ticker(ticker).history(period=period, interval=interval))
+
+    def history_many(self, tickers, start, end, interval='1d'):
+        kwargs = {'session': self.session} if self.session is not None else {}
+        frame = yf.download(list(tickers), start=start, end=end, interval=interval, group_by='ticker',
+                            auto_adjust=True, actions=True, progress=False, threads=True, **kwargs)
+        frames = {}
+        for ticker in tickers:
+            if frame is None or frame.empty:
+                frames[ticker] = pd.DataFrame()
+                continue
+            if isinstance(frame.columns, pd.MultiIndex):
+                if ticker not in frame.columns.get_level_values(0):
+                    frames[ticker] = pd.DataFrame()
+                    continue
+                bars = frame[ticker]
+            else:
+                bars = frame
+            # rows come from the union of all tickers' calendars
+            frames[ticker] = self._normalize(bars.dropna(how='all').copy())
+        return frames
+
+
+class ReplayProvider(DataProvider):
+    """Replays recorded bars from <directory>/<TICKER>_<interval>.csv (or .parquet).
+    Period requests end at the last recorded bar, so replays are independent of today's date."""
+
+    name = 'replay'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._frames = {}
+
+    @property
+    def key(self):
+        return f"replay:{os.path.abspath(self.directory)}"
+
+    @property
+    def spec(self):
+        return f"replay:{self.directory}"
+
+    def _path(self, ticker, interval, ext):
+        return os.path.join(self.directory, f"{ticker.upper()}_{interval}.{ext}")
+
+    def _load(self, ticker, interval):
+        cache_key = (ticker.upper(), interval)
+        if cache_key not in self._frames:
+            frame = pd.DataFrame()
+            if os.path.exists(self._path(ticker, interval, 'parquet')):
+                frame = pd.read_parquet(self._path(ticker, interval, 'parquet'))
+            elif os.path.exists(self._path(ticker, interval, 'csv')):
+                frame = pd.read_csv(self._path(ticker, interval, 'csv'), index_col=0)
+            else:
+                print(f"${ticker}: no replay file for interval {interval} in {self.directory}")
+            if not frame.empty:
+                frame.index = pd.to_datetime(frame.index)
+                if frame.index.tz is not None:
+                    frame.index = frame.index.tz_localize(None)
+                frame = frame.sort_index()
+            self._frames[cache_key] = frame
+        return self._frames[cache_key]
+
+    def history(self, ticker, start, end, interval='1d'):
+        frame = self._load(ticker, interval)
+        if frame.empty:
+            return frame.copy()
+        return frame[(frame.index >= pd.Timestamp(start)) & (frame.index < pd.Timestamp(end))].copy()
+
+    def history_period(self, ticker, period, interval='1d'):
+        frame = self._load(ticker, interval)
+        if frame.empty:
+            return frame.copy()
+        end = frame.index[-1].normalize() + timedelta(days=1)
+        start = end - timedelta(days=self._period_to_days(period))
+        return frame[frame.index >= start].copy()
+
+    def record(self, ticker, interval, frame, fmt='csv'):
+        """Save a frame (e.g. downloaded from another provider) as a replay fixture."""
+        os.makedirs(self.directory, exist_ok=True)
+        if fmt == 'parquet':
+            frame.to_parquet(self._path(ticker, interval, 'parquet'))
+        else:
+            frame.to_csv(self._path(ticker, interval, 'csv'))
+        self._frames.pop((ticker.upper(), interval), None)
+
+
+class SyntheticProvider(DataProvider):
+    """Deterministic random-walk prices on a weekday 9:30-16:00 session calendar.
+    The same (seed, ticker, timestamp) always produces the same bar, whatever range is requested."""
+
+    name = 'synthetic'
+    epoch = datetime(2015, 1, 1) # daily paths are generated forward from this date
+    session_open = 9 * 60 + 30 # minutes after midnight
+    session_minutes = 390
+
+    def __init__(self, seed=0, start_price=100.0, daily_drift=0.0003, daily_volatility=0.02, now=None):
+        self.seed = seed
+        self.start_price = start_price
+        self.daily_drift = daily_drift
+        self.daily_volatility = daily_volatility
+        self.now = now # 'current' date for period requests (defaults to today)
+        self._closes = {}
+
+    @property
+    def key(self):
+        return f"synthetic:{self.seed}:{self.start_price}:{self.daily_drift}:{self.daily_volatility}"
+
+    @property
+    def spec(self):
+        defaults = (self.start_price, self.daily_drift, self.daily_volatility, self.now) == (100.0, 0.0003, 0.02, None)
+        return f"synthetic:{self.seed}" if defaults else None
+
+    def _rng(self, ticker, *parts):
+        return np.random.default_rng([self.seed, zlib.crc32(ticker.upper().encode())] + list(parts))
+
+    def _daily_closes(self, ticker, end):
+        """Close prices for every weekday from the epoch up to (not including) end."""
+        days = pd.bdate_range(self.epoch, pd.Timestamp(end) - timedelta(days=1))
+        cached = self._closes.get(ticker.upper())
+        if cached is not None and len(cached) >= len(days):
+            return days, cached[:len(days)]
+        # regenerate the full path; the generator stream is the same so the prefix is unchanged
+        n = max(len(days), 8192)
+        rng = self._rng(ticker)
+        start_price = self.start_price * (0.5 + rng.random())
+        log_returns = rng.normal(self.daily_drift - self.daily_volatility ** 2 / 2, self.daily_volatility, n)
+        closes = start_price * np.exp(np.cumsum(log_returns))
+        self._closes[ticker.upper()] = closes
+        return days, closes[:len(days)]
+
+    def _daily_bars(self, ticker, start, end):
+        days, closes = self._daily_closes(ticker, end)
+        opens = np.concatenate([[closes[0]], closes[:-1]]) if len(closes) else closes
+        rng = self._rng(ticker, 1)
+        # (n, 2) draws so each day's values don't depend on how many days were requested
+        wiggle = np.abs(rng.normal(0, self.daily_volatility / 2, (len(closes), 2)))
+        frame = pd.DataFrame({
+            'Open': opens,
+            'High': np.maximum(opens, closes) * (1 + wiggle[:, 0]),
+            'Low': np.minimum(opens, closes) * (1 - wiggle[:, 1]),
+            'Close': closes,
+            'Volume': (1e6 * (1 + wiggle[:, 0] * 10)).astype('int64'),
+        }, index=days)
+        return frame[frame.index >= pd.Timestamp(start)]
+
+    def _intraday_bars(self, ticker, start, end, minutes):
+        daily = self._daily_bars(ticker, start, end)
+        steps = -(-self.session_minutes // minutes) # bars per session, last one may be short
+        frames = []
+        for day, row in zip(daily.index, daily.itertuples()):
+            # brownian bridge from the day's open to its close
+            rng = self._rng(ticker, day.toordinal(), minutes)
+            noise = np.concatenate([[0.0], np.cumsum(rng.normal(0, self.daily_volatility / np.sqrt(steps), steps))])
+            bridge = noise - np.linspace(0, 1, steps + 1) * noise[-1]
+            path = np.exp(np.linspace(np.log(row.Open), np.log(row.Close), steps + 1) + bridge)
+            opens, closes = path[:-1], path[1:]
+            spread = np.abs(rng.normal(0, self.daily_volatility / (2 * np.sqrt(steps)), (2, steps)))
+            index = day + pd.to_timedelta(self.session_open + minutes * np.arange(steps), unit='m')
+            frames.append(pd.DataFrame({
+                'Open': opens,
+                'High': np.maximum(opens, closes) * (1 + spread[0]),
+                'Low': np.minimum(opens, closes) * (1 - spread[1]),
+                'Close': closes,
+                'Volume': np.full(steps, int(row.Volume // steps), dtype='int64'),
+            }, index=index))
+        if not frames:
+            return pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Volume'], index=pd.DatetimeIndex([]))
+        return pd.concat(frames)
+
+    def history(self, ticker, start, end, interval='1d'):
+        if pd.Timestamp(end) <= pd.Timestamp(start):
+            return pd.DataFrame()
+        if interval == '1d':
+            return self._daily_bars(ticker, start, end)
+        if interval.endswith('m') and interval[:-1].isdigit():
+            return self._intraday_bars(ticker, start, end, int(interval[:-1]))
+        if interval == '1h':
+            return self._intraday_bars(ticker, start, end, 60)
+        print(f"Synthetic provider does not support interval {interval}")
+        return pd.DataFrame()
+
+    def history_period(self, ticker, period, interval='1d'):
+        now = pd.Timestamp(self.now) if self.now is not None else pd.Timestamp(datetime.now().date())
+        end = now + timedelta(days=1)
+        start = end - timedelta(days=self._period_to_days(period))
+        return self.history(ticker, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), interval)
+
+
+class HTTPProvider(DataProvider):
+    """Fetches CSV bars from a simple HTTP service (e.g. an internal data gateway or a local stub server):
+    GET <base_url>/history?ticker=..&interval=..&start=..&end=.. (or &period=..) returning CSV with a timestamp index.
+    A 429 response raises RateLimitError so DataFetcher backs off and retries."""
+
+    name = 'http'
+    persistent = True
+
+    def __init__(self, base_url, pool_size=8, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def key(self):
+        return f"http:{self.base_url}"
+
+    @property
+    def spec(self):
+        return f"http:{self.base_url}"
+
+    def session(self):
+        # one keep-alive connection pool shared by every fetch thread
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+        return self._session
+
+    def _get(self, params):
+        response = self.session().get(f"{self.base_url}/history", params=params, timeout=self.timeout)
+        if response.status_code == 429:
+            raise RateLimitError(f"429 Too Many Requests from {self.base_url}")
+        response.raise_for_status()
+        # a successful response without rows is the service saying there are no bars
+        if not response.text.strip():
+            return no_bars()
+        frame = pd.read_csv(io.StringIO(response.text), index_col=0)
+        if frame.empty:
+            return no_bars()
+        frame.index = pd.to_datetime(frame.index)
+        if frame.index.tz is not None:
+            frame.index = frame.index.tz_localize(None)
+        return frame
+
+    def history(self, ticker, start, end, interval='1d'):
+        return self._get({'ticker': ticker, 'start': start, 'end': end, 'interval': interval})
+
+    def history_period(self, ticker, period, interval='1d'):
+        return self._get({'ticker': ticker, 'period': period, 'interval': interval})
+
+
+def get_provider(spec):
+    """Build a provider from a short spec string.
+    Args:
+        spec: 'yfinance', 'synthetic', 'synthetic:<seed>', 'replay:<directory>' or 'http:<base url>'
+    Returns:
+        DataProvider: The matching provider"""
+
+    if isinstance(spec, DataProvider):
+        return spec
+    name, _, arg = (spec or 'yfinance').partition(':')
+    if name == 'yfinance':
+        return YFinanceProvider()
+    if name == 'synthetic':
+        return SyntheticProvider(seed=int(arg) if arg else 0)
+    if name == 'replay':
+        if not arg:
+            raise ValueError("Replay provider needs a directory, e.g. 'replay:fixtures'")
+        return ReplayProvider(arg)
+    if name == 'http':
+        return HTTPProvider(arg)
+    raise ValueError(f"Unknown data provider '{spec}'")
@@ -0,0 +1,114 @@
+import numpy as np
+
+'''Downsampling of long (x, y) series for charts: per-bucket min/max (M4) and Largest-Triangle-Three-Buckets'''
+
+METHODS = ('minmax', 'lttb')
+
+
+def min_max(values, max_points):
+    """Indices keeping each bucket's first, min, max and last point (about max_points in total),
+    so peaks, drawdowns and the shape between them survive.
+    Args:
+        values: 1-d array of y values
+        max_points: Target number of points (4 per bucket)
+    Returns:
+        numpy.ndarray: Sorted indices into values"""
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if max_points is None or n <= max_points:
+        return np.arange(n)
+    size = -(-n // max(max_points // 4, 1))  # points per bucket, rounded up
+    buckets = -(-n // size)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(buckets, size)
+    # all-NaN buckets only happen for NaN inputs; treat them as +/-inf so argmin/argmax stay defined
+    starts = np.arange(buckets) * size
+    lows = np.where(np.isnan(padded), np.inf, padded).argmin(axis=1)
+    highs = np.where(np.isnan(padded), -np.inf, padded).argmax(axis=1)
+    ends = np.minimum(starts + size, n) - 1
+    keep = np.concatenate((starts, starts + lows, starts + highs, ends))
+    return np.unique(np.minimum(keep, n - 1))
+
+
+def lttb(x, y, max_points):
+    """Largest-Triangle-Three-Buckets: picks the point per bucket that forms the largest triangle
+    with the previously picked point and the next bucket's average, keeping the visual shape.
+    Args:
+        x: 1-d array of x values (sorted; datetime64 or numbers)
+        y: 1-d array of y values
+        max_points: Number of points to keep (at least 3)
+    Returns:
+        numpy.ndarray: Sorted indices into x/y"""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if max_points is None or n <= max_points or max_points < 3:
+        return np.arange(n)
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('datetime64[ns]').view('int64')
+    x = (x - x[0]).astype(np.float64)  # relative, so large epochs keep their precision
+
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)  # interior buckets
+    keep = np.empty(max_points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for b in range(max_points - 2):
+        lo, hi = edges[b], edges[b + 1]
+        next_lo, next_hi = hi, edges[b + 2] if b + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean() if next_hi > next_lo else x[n - 1]
+        avg_y = y[next_lo:next_hi].mean() if next_hi > next_lo else y[n - 1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.nanargmax(area)) if not np.isnan(area).all() else lo
+        keep[b + 1] = a
+    return keep
+
+
+def indices(x, y, max_points, method='minmax'):
+    """Indices of the points to draw with the given method ('minmax' or 'lttb')."""
+    if method == 'minmax':
+        return min_max(y, max_points)
+    if method == 'lttb':
+        return lttb(x, y, max_points)
+    raise ValueError(f"Unknown downsampling method '{method}' (expected one of {', '.join(METHODS)})")
+
+
+def constant_runs(values, min_length=2):
+    """Runs of consecutive equal values (e.g. flat portfolio value while the market is closed).
+    Returns:
+        (starts, ends): Index arrays of each run's first and last point"""
+    values = np.asarray(values)
+    n = len(values)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    change = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [n])) - 1
+    long_enough = ends - starts + 1 >= min_length
+    return starts[long_enough], ends[long_enough]
+
+
+def ohlc(values, buckets):
+    """Aggregate a series into at most `buckets` equal-count bars (NaNs, e.g. missing bars, are skipped).
+    Returns:
+        (starts, open, high, low, close): Index of each bar's first point and its OHLC values (NaN if empty)"""
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), empty, empty, empty, empty
+    size = -(-n // max(int(buckets), 1))
+    count = -(-n // size)
+    padded = np.full(count * size, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(count, size)
+    present = ~np.isnan(padded)
+    rows = np.arange(count)
+    first = present.argmax(axis=1)
+    last = size - 1 - present[:, ::-1].argmax(axis=1)
+    empty = ~present.any(axis=1)
+    with np.errstate(invalid='ignore'):
+        high = np.where(empty, np.nan, np.where(present, padded, -np.inf).max(axis=1))
+        low = np.where(empty, np.nan, np.where(present, padded, np.inf).min(axis=1))
+    return rows * size, padded[rows, first], high, low, padded[rows, last]
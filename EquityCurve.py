@@ -0,0 +1,165 @@
+from collections.abc import MutableMapping
+import numpy as np
+import pandas as pd
+from RunningMetrics import RunningMetrics
+import Downsample
+
+'''Time-ordered equity curve: contiguous timestamp/value arrays behind Portfolio.change_over_time'''
+
+class EquityCurve(MutableMapping):
+    chunk_size = 1024 # initial capacity; doubles whenever it fills up
+
+    def __init__(self, values=None):
+        """Portfolio value over time, kept sorted by timestamp.
+        Behaves like the old {timestamp: portfolio_value} dict (indexing, iteration in time order,
+        len, keys/items) while appends in time order are O(1) and land in contiguous arrays.
+        Args:
+            values: Optional {timestamp: value} mapping (or EquityCurve) to start from"""
+
+        self._size = 0
+        self._time = np.empty(self.chunk_size, dtype=np.int64)
+        self._value = np.empty(self.chunk_size, dtype=np.float64)
+        self._metrics = RunningMetrics()
+        self._metrics_stale = False  # set when a write could not be folded in online
+        if values is not None:
+            for timestamp, value in sorted(values.items()):
+                self[timestamp] = value
+
+    @staticmethod
+    def _ns(timestamp):
+        return pd.Timestamp(timestamp).as_unit('ns').value
+
+    def _grow(self, needed):
+        capacity = len(self._time)
+        while capacity < needed:
+            capacity *= 2
+        for name in ('_time', '_value'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _find(self, ns):
+        i = int(np.searchsorted(self._time[:self._size], ns))
+        return i, i < self._size and self._time[i] == ns
+
+    def __setitem__(self, timestamp, value):
+        ns = self._ns(timestamp)
+        value = float(value)
+        n = self._size
+        if n == 0 or ns > self._time[n - 1]:
+            if n == len(self._time):
+                self._grow(n + 1)
+            self._time[n] = ns
+            self._value[n] = value
+            self._size += 1
+        elif ns == self._time[n - 1]:
+            self._value[n - 1] = value
+        else:
+            # out of order: keep the arrays sorted and recompute metrics when next asked
+            i, found = self._find(ns)
+            if found:
+                self._value[i] = value
+            else:
+                if n == len(self._time):
+                    self._grow(n + 1)
+                self._time[i + 1:n + 1] = self._time[i:n]
+                self._value[i + 1:n + 1] = self._value[i:n]
+                self._time[i] = ns
+                self._value[i] = value
+                self._size += 1
+            self._metrics_stale = True
+            return
+        if not self._metrics_stale:
+            self._metrics.update(timestamp, value)
+
+    def __getitem__(self, timestamp):
+        i, found = self._find(self._ns(timestamp))
+        if not found:
+            raise KeyError(timestamp)
+        return float(self._value[i])
+
+    def __delitem__(self, timestamp):
+        i, found = self._find(self._ns(timestamp))
+        if not found:
+            raise KeyError(timestamp)
+        self._time[i:self._size - 1] = self._time[i + 1:self._size]
+        self._value[i:self._size - 1] = self._value[i + 1:self._size]
+        self._size -= 1
+        self._metrics_stale = True
+
+    def __iter__(self):
+        return iter(self.timestamp_list())
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return f"EquityCurve({self._size} points)"
+
+    def extend(self, timestamps, values):
+        """Record many valuations at once (appends in time order are folded into the metrics in one batch)."""
+        times = pd.DatetimeIndex(timestamps).values.astype('datetime64[ns]').view('int64')
+        values = np.asarray(values, dtype=np.float64)
+        if len(times) == 0:
+            return
+        n = self._size
+        if (n == 0 or times[0] > self._time[n - 1]) and (np.diff(times) > 0).all():
+            if n + len(times) > len(self._time):
+                self._grow(n + len(times))
+            self._time[n:n + len(times)] = times
+            self._value[n:n + len(times)] = values
+            self._size += len(times)
+            if not self._metrics_stale:
+                self._metrics_stale = not self._metrics.update_many(pd.DatetimeIndex(self.timestamps[n:]), values)
+            return
+        for ns, value in zip(times.tolist(), values.tolist()):
+            self[pd.Timestamp(ns)] = value
+
+    # array views over the filled part (no copies)
+    @property
+    def timestamps(self):
+        return self._time[:self._size].view('datetime64[ns]')
+
+    @property
+    def portfolio_values(self):
+        return self._value[:self._size]
+
+    def timestamp_list(self):
+        """Timestamps as datetimes, in time order."""
+        return list(pd.DatetimeIndex(self.timestamps).to_pydatetime())
+
+    @property
+    def last_value(self):
+        """Most recent value (None if empty)."""
+        return float(self._value[self._size - 1]) if self._size else None
+
+    @property
+    def last_timestamp(self):
+        return pd.Timestamp(int(self._time[self._size - 1])).to_pydatetime() if self._size else None
+
+    def between(self, start=None, end=None):
+        """Sub-curve with start <= timestamp <= end (either bound optional)."""
+        times = self._time[:self._size]
+        lo = int(np.searchsorted(times, self._ns(start), side='left')) if start is not None else 0
+        hi = int(np.searchsorted(times, self._ns(end), side='right')) if end is not None else self._size
+        curve = EquityCurve()
+        curve.extend(self.timestamps[lo:hi], self._value[lo:hi])
+        return curve
+
+    def downsample(self, max_points, method='minmax'):
+        """At most ~max_points (timestamps, values) for charts.
+        'minmax' keeps each bucket's first, min, max and last point so peaks and drawdowns survive;
+        'lttb' keeps max_points points chosen by Largest-Triangle-Three-Buckets (see Downsample.py)."""
+        keep = Downsample.indices(self.timestamps, self.portfolio_values, max_points, method)
+        return self.timestamps[keep], self.portfolio_values[keep]
+
+    def metrics(self):
+        """RunningMetrics for the curve, rebuilt in bulk only after out-of-order writes or deletions."""
+        if self._metrics_stale:
+            self._metrics = RunningMetrics.from_series(pd.DatetimeIndex(self.timestamps), self.portfolio_values)
+            self._metrics_stale = False
+        return self._metrics
+
+    def to_series(self):
+        return pd.Series(self.portfolio_values, index=pd.DatetimeIndex(self.timestamps))
@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+
+'''Technical indicators over a StockData's bars: NumPy kernels, memoized per (indicator, params), extended incrementally'''
+
+DAY_NS = 86400 * 10**9
+
+
+def _ewm(values, alpha, seed):
+    """y[t] = (1 - alpha) * y[t-1] + alpha * values[t], starting from y[-1] = seed."""
+    if len(values) == 0:
+        return np.empty(0, dtype=np.float64)
+    series = pd.Series(np.concatenate(([seed], values)))
+    return series.ewm(alpha=alpha, adjust=False).mean().to_numpy()[1:]
+
+
+def _window_sums(bars, state, window, column):
+    """Rolling count/sum/sum of squares for the new rows.
+    window is a number of bars or a pandas offset string ('1h', '5D', ...) for a time-based window,
+    which covers (t - window, t] like DataFrame.rolling(window)."""
+    values = bars[column]
+    times = bars['times']
+    if state is None:
+        state = {'times': np.empty(0, dtype=np.int64), 'sum': np.zeros(1), 'sumsq': np.zeros(1)}
+    # cumulative sums carried over from the rows still inside the window
+    cum = np.concatenate((state['sum'], state['sum'][-1] + np.cumsum(values)))
+    cumsq = np.concatenate((state['sumsq'], state['sumsq'][-1] + np.cumsum(values * values)))
+    all_times = np.concatenate((state['times'], times))
+    carried = len(state['times'])
+    rows = np.arange(carried, len(all_times))
+    if isinstance(window, str):
+        span = pd.Timedelta(window).value
+        start = np.searchsorted(all_times, all_times[rows] - span, side='right')
+        keep = int(np.searchsorted(all_times, all_times[-1] - span, side='right')) if len(all_times) else 0
+    else:
+        start = rows + 1 - window
+        keep = max(len(all_times) - window + 1, 0)
+    count = (rows + 1 - start).astype(np.float64)
+    start = np.maximum(start, 0)
+    total = cum[rows + 1] - cum[start]
+    totalsq = cumsq[rows + 1] - cumsq[start]
+    if not isinstance(window, str):
+        # no value until a full window of bars exists (the carried state holds the last window - 1 rows)
+        count = np.where(rows + 1 - window >= 0, count, np.nan)
+    new_state = {'times': all_times[keep:], 'sum': cum[keep:], 'sumsq': cumsq[keep:]}
+    return count, total, totalsq, new_state
+
+
+def sma(bars, state, window=20, column='Close'):
+    count, total, _, state = _window_sums(bars, state, window, column)
+    return {'sma': total / count}, state
+
+
+def bollinger(bars, state, window=20, num_std=2.0, column='Close'):
+    count, total, totalsq, state = _window_sums(bars, state, window, column)
+    mean = total / count
+    std = np.sqrt(np.maximum(totalsq / count - mean * mean, 0.0))
+    return {'middle': mean, 'upper': mean + num_std * std, 'lower': mean - num_std * std}, state
+
+
+def ema(bars, state, span=20, column='Close'):
+    values = bars[column]
+    if len(values) == 0:
+        return {'ema': values.copy()}, state
+    if state is None:
+        state = values[0]  # seeded with the first value
+    out = _ewm(values, 2.0 / (span + 1), state)
+    return {'ema': out}, float(out[-1])
+
+
+def _wilder(deltas, state, period):
+    """Wilder smoothing of per-bar inputs: the first period inputs are averaged to seed it.
+    Returns (smoothed values aligned with deltas, NaN during warm-up; new state)."""
+    out = np.full(len(deltas), np.nan)
+    warmup, average = state if state is not None else ((), None)
+    i = 0
+    if average is None:
+        i = min(period - len(warmup), len(deltas))
+        warmup = tuple(warmup) + tuple(deltas[:i].tolist())
+        if len(warmup) == period:
+            average = float(np.mean(warmup))
+            out[i - 1] = average
+    if average is not None and i < len(deltas):
+        out[i:] = _ewm(deltas[i:], 1.0 / period, average)
+        average = float(out[-1])
+    return out, (warmup if average is None else (), average)
+
+
+def rsi(bars, state, period=14, column='Close'):
+    values = bars[column]
+    last, gain_state, loss_state = state if state is not None else (None, None, None)
+    previous = np.concatenate(([last], values[:-1])) if last is not None else values[:-1]
+    deltas = values[len(values) - len(previous):] - previous
+    offset = len(values) - len(deltas)  # the very first bar has no change
+    gains, gain_state = _wilder(np.maximum(deltas, 0.0), gain_state, period)
+    losses, loss_state = _wilder(np.maximum(-deltas, 0.0), loss_state, period)
+    out = np.full(len(values), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[offset:] = np.where(losses == 0, 100.0, 100.0 - 100.0 / (1.0 + gains / losses))
+    out[offset:][np.isnan(gains)] = np.nan
+    if len(values):
+        last = float(values[-1])
+    return {'rsi': out}, (last, gain_state, loss_state)
+
+
+def atr(bars, state, period=14):
+    high, low, close = bars['High'], bars['Low'], bars['Close']
+    last, smooth_state = state if state is not None else (None, None)
+    previous = np.concatenate(([last if last is not None else np.nan], close[:-1]))
+    with np.errstate(invalid='ignore'):
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+    out, smooth_state = _wilder(true_range, smooth_state, period)
+    if len(close):
+        last = float(close[-1])
+    return {'atr': out}, (last, smooth_state)
+
+
+def vwap(bars, state):
+    """Volume-weighted average of the typical price ((High + Low + Close) / 3), reset every calendar day."""
+    typical = (bars['High'] + bars['Low'] + bars['Close']) / 3
+    volume = bars['Volume']
+    session = bars['times'] // DAY_NS
+    if len(session) == 0:
+        return {'vwap': typical}, state
+    cum_pv = np.cumsum(typical * volume)
+    cum_v = np.cumsum(volume)
+    # index of each row's session start, and the running totals just before it
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(session)) + 1))
+    start_of = starts[np.searchsorted(starts, np.arange(len(session)), side='right') - 1]
+    base_pv = np.where(start_of > 0, cum_pv[start_of - 1], 0.0)
+    base_v = np.where(start_of > 0, cum_v[start_of - 1], 0.0)
+    pv = cum_pv - base_pv
+    v = cum_v - base_v
+    if state is not None and state[0] == session[0]:
+        # continue the session that was open at the end of the previous bars
+        first = start_of == 0
+        pv = np.where(first, pv + state[1], pv)
+        v = np.where(first, v + state[2], v)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = np.where(v > 0, pv / v, np.nan)
+    return {'vwap': out}, (int(session[-1]), float(pv[-1]), float(v[-1]))
+
+
+class Indicators:
+    kernels = {'sma': sma, 'ema': ema, 'rsi': rsi, 'bollinger': bollinger, 'vwap': vwap, 'atr': atr}
+    columns = ('Open', 'High', 'Low', 'Close', 'Volume')
+
+    def __init__(self, stock):
+        """Indicator arrays for one StockData, aligned with its bars.
+        Each (indicator, params) is computed once over the full arrays; when bars are appended
+        (StockData.append_bars) only the new rows are computed, continuing from the saved state.
+        Args:
+            stock: StockData whose bars the indicators run over"""
+
+        self._stock = stock
+        self._cache = {}  # {(name, params): [rows computed, {output: array}, kernel state]}
+
+    def clear(self):
+        self._cache.clear()
+
+    def _bars(self, start):
+        frame = self._stock.stock_data.iloc[start:]
+        bars = {'times': frame.index.values.astype('datetime64[ns]').view('int64')}
+        for column in self.columns:
+            if column in frame:
+                bars[column] = frame[column].to_numpy(dtype=np.float64)
+        return bars
+
+    def compute(self, name, **params):
+        """Full indicator arrays (one value per bar, NaN during warm-up).
+        Args:
+            name: 'sma', 'ema', 'rsi', 'bollinger', 'vwap' or 'atr'
+            params: Kernel parameters (window/span/period, column, num_std)
+        Returns:
+            numpy.ndarray, or {output: numpy.ndarray} for indicators with several outputs (bollinger)"""
+        if name not in self.kernels:
+            raise ValueError(f"Unknown indicator '{name}' (expected one of {', '.join(self.kernels)})")
+        key = (name, tuple(sorted(params.items())))
+        rows = len(self._stock.stock_data)
+        entry = self._cache.get(key)
+        if entry is None or entry[0] > rows:
+            entry = [0, None, None]
+            self._cache[key] = entry
+        if entry[0] < rows:
+            outputs, entry[2] = self.kernels[name](self._bars(entry[0]), entry[2], **params)
+            if entry[1] is None:
+                entry[1] = outputs
+            else:
+                entry[1] = {k: np.concatenate((entry[1][k], outputs[k])) for k in outputs}
+            entry[0] = rows
+        outputs = entry[1] or {}
+        return next(iter(outputs.values())) if len(outputs) == 1 else outputs
+
+    def at(self, name, time=None, mode='exact', **params):
+        """Indicator value at a bar (see StockData.get_price for time and mode).
+        Returns:
+            float (dict for bollinger), NaN during warm-up, or None if there is no matching bar"""
+        if time is None:
+            time = self._stock.curtime
+        if time is None:
+            return None
+        values = self.compute(name, **params)
+        pos, found = self._stock._bar_positions(time, mode)
+        if not found:
+            return None
+        if isinstance(values, dict):
+            return {k: float(v[pos]) for k, v in values.items()}
+        return float(values[pos])
+
+    def at_times(self, name, timestamps, mode='exact', **params):
+        """Batch version of at().
+        Returns:
+            numpy.ndarray (dict of arrays for bollinger), NaN where there is no matching bar"""
+        values = self.compute(name, **params)
+        rows, found = self._stock._bar_positions_many(timestamps, mode)
+        if isinstance(values, dict):
+            return {k: np.where(found, v[rows], np.nan) if len(v) else np.full(len(rows), np.nan) for k, v in values.items()}
+        if len(values) == 0:
+            return np.full(len(rows), np.nan)
+        return np.where(found, values[rows], np.nan)
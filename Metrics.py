@@ -0,0 +1,219 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''Hot-path instrumentation: counters and latency histograms, exported in Prometheus text format.
+Off unless METRICS_ENABLED=1 (or enable() is called); while off, instrumented calls only check a flag.'''
+
+enabled = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+# seconds, from 10 microseconds (price lookups) to 10 seconds (downloads, whole simulations)
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Cumulative-bucket histogram (Prometheus style).
+        Args:
+            buckets: Sorted upper bounds; values above the last go to +Inf"""
+
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Approximate quantile (upper bound of the bucket it falls in; None if empty)."""
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Registry:
+    def __init__(self):
+        """Named metric families ({labels: metric}) plus collectors sampled at export time."""
+        self._families = {}  # {name: [kind, help, {labels tuple: Counter/Histogram}]}
+        self._collectors = []  # callables returning [(name, kind, help, labels dict, value)]
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, help, labels, factory):
+        key = tuple(sorted(labels.items()))
+        family = self._families.get(name)
+        if family is not None:
+            metric = family[2].get(key)
+            if metric is not None:
+                return metric
+        with self._lock:
+            family = self._families.setdefault(name, [kind, help, {}])
+            if family[0] != kind:
+                raise ValueError(f"Metric '{name}' is already a {family[0]}")
+            return family[2].setdefault(key, factory())
+
+    def counter(self, name, help, **labels):
+        return self._get('counter', name, help, labels, Counter)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        return self._get('histogram', name, help, labels, lambda: Histogram(buckets))
+
+    def add_collector(self, collector):
+        """Register a callable sampled on every export, for values that already live elsewhere
+        (cache statistics, queue depth, ...) and so cost nothing between scrapes."""
+        self._collectors.append(collector)
+
+    def clear(self):
+        with self._lock:
+            self._families.clear()
+
+    @staticmethod
+    def _labels(labels, extra=None):
+        items = list(labels) + ([extra] if extra else [])
+        if not items:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            families = {name: (kind, help, dict(metrics)) for name, (kind, help, metrics) in self._families.items()}
+        for name, (kind, help, metrics) in sorted(families.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in sorted(metrics.items()):
+                if kind == 'counter':
+                    lines.append(f"{name}{self._labels(labels)} {metric.value}")
+                    continue
+                with metric._lock:
+                    counts, total, count = list(metric.counts), metric.sum, metric.count
+                cumulative = 0
+                for bound, n in zip(metric.buckets + ('+Inf',), counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{self._labels(labels, ('le', bound))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+
+        sampled = {}
+        for collector in self._collectors:
+            for name, kind, help, labels, value in collector():
+                sampled.setdefault(name, (kind, help, []))[2].append((tuple(sorted(labels.items())), value))
+        for name, (kind, help, values) in sorted(sampled.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in values:
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def timed(name, help, **labels):
+    """Decorator recording a function's latency in a histogram (only while metrics are enabled)."""
+    histogram = registry.histogram(name, help, **labels)
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+class timer:
+    """Context manager recording the time spent in its block (only while metrics are enabled):
+        with Metrics.timer('stage_seconds', 'Time per stage', stage='setup'): ..."""
+
+    __slots__ = ('name', 'help', 'labels', 'start')
+
+    def __init__(self, name, help, **labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            registry.histogram(self.name, self.help, **self.labels).observe(time.perf_counter() - self.start)
+        return False
+
+
+def observe(name, help, value, buckets=LATENCY_BUCKETS, **labels):
+    if enabled:
+        registry.histogram(name, help, buckets, **labels).observe(value)
+
+
+def count(name, help, amount=1, **labels):
+    if enabled:
+        registry.counter(name, help, **labels).inc(amount)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host=''):
+    """Serve /metrics from a background thread, for processes without a web app (SimulationWorker).
+    Returns:
+        ThreadingHTTPServer: call shutdown() to stop it"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
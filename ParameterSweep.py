@@ -0,0 +1,156 @@
+import copy
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from Backtester import Backtester
+from Portfolio import Portfolio
+
+'''Grid search over trading rule parameters, run across processes on one shared price panel'''
+
+# per-worker views onto the shared price panel, set up once by _attach_panel
+_panel = {}
+
+
+def _attach_panel(name, shape, times, tickers, cash, positions, original_value, features, own_tracker):
+    shm = shared_memory.SharedMemory(name=name)
+    if own_tracker:
+        # spawned workers get their own resource tracker, which would unlink the parent's block on exit
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    matrices = np.ndarray((2,) + tuple(shape), dtype=np.float64, buffer=shm.buf)
+    _panel.update({
+        'shm': shm,
+        'prices': matrices[0],
+        'value_prices': matrices[1],
+        'times': list(pd.DatetimeIndex(times).to_pydatetime()),
+        'tickers': tickers,
+        'cash': cash,
+        'positions': positions,
+        'original_value': original_value,
+        'features': features
+    })
+
+
+def _run_config(args):
+    index, params, trading_rules = args
+    port = Portfolio(_panel['cash'], None, positions=dict(_panel['positions']))
+    port.original_value = _panel['original_value']
+    engine = Backtester(_panel['tickers'], trading_rules)
+    if engine.compiler.needs_features:
+        # grids only change thresholds and share counts, so the base run's indicator inputs still line up
+        engine.compiler.use_features(*_panel['features'])
+    run = engine.run(_panel['times'], _panel['prices'], _panel['value_prices'], port)
+    return index, params, ParameterSweep.metrics(port, run['value'], _panel['original_value'])
+
+
+class ParameterSweep:
+    def __init__(self, simulation, grid):
+        """Grid search over a simulation's trading rules.
+        Args:
+            simulation: SimulationManager whose settings (cash, dates, tickers, rules) are the base case
+            grid: {'TICKER.<rule index>.<field>': [values]}, e.g. {'NVDA.0.threshold': [170, 180, 190]}"""
+
+        self.simulation = simulation
+        self.grid = grid
+        for path in grid:
+            self._locate(simulation.trading_rules, path)  # fail early on bad paths
+
+    @staticmethod
+    def _locate(trading_rules, path):
+        ticker, _, rest = path.partition('.')
+        rule_index, _, field = rest.partition('.')
+        if ticker not in trading_rules or not rule_index.isdigit() or int(rule_index) >= len(trading_rules[ticker]):
+            raise ValueError(f"Grid path '{path}' does not match a trading rule")
+        if field not in ('threshold', 'shares'):
+            raise ValueError(f"Grid path '{path}' must end in .threshold or .shares")
+        return ticker, int(rule_index), field
+
+    def configurations(self):
+        """Every combination of the grid as (params, trading_rules)."""
+        paths = list(self.grid.keys())
+        for values in itertools.product(*(self.grid[path] for path in paths)):
+            rules = copy.deepcopy(self.simulation.trading_rules)
+            for path, value in zip(paths, values):
+                ticker, rule_index, field = self._locate(rules, path)
+                rules[ticker][rule_index][field] = float(value) if field == 'threshold' else int(value)
+            yield dict(zip(paths, values)), rules
+
+    @staticmethod
+    def metrics(port, values, original_value):
+        """Final metrics for one configuration."""
+        final_value = float(values[-1]) if len(values) else float(port.cash)
+        initial_value = float(values[0]) if len(values) else final_value
+        peaks = np.maximum.accumulate(values) if len(values) else values
+        drawdowns = (peaks - values) / peaks * 100 if len(values) else values
+        # same definitions as SimulationManager's final metrics
+        sharpe = port.calculate_sharpe_ratio()
+        volatility = port.calculate_volatility()
+        return {
+            'total_return_pct': round((final_value - initial_value) / initial_value * 100, 2) if initial_value > 0 else 0,
+            'final_value': round(final_value, 2),
+            'total_pnl': round(final_value - original_value, 2),
+            'sharpe_ratio': round(float(sharpe), 3) if sharpe else None,
+            'volatility_pct': round(float(volatility) * 100, 2) if volatility else None,
+            'max_drawdown_pct': round(float(drawdowns.max()), 2) if len(values) else 0.0,
+            'total_trades': len(port.past_trades)
+        }
+
+    def run(self, max_workers=None, rank_by='total_return_pct', ascending=False):
+        """Run every configuration across worker processes.
+        The price panel is loaded once here and shared with workers through shared memory.
+        Args:
+            max_workers: Number of worker processes (defaults to the CPU count)
+            rank_by: Metric column used to rank configurations
+            ascending: Rank ascending instead of descending
+        Returns:
+            pandas.DataFrame: One row per configuration (grid values + metrics), best first"""
+
+        sim = self.simulation
+        port, data, times = sim.setup()
+        times, prices, value_prices = sim.price_panel(port, data, times)
+        base = Backtester(list(sim.tickers.keys()), sim.trading_rules)
+        base.prepare(times, data, prices)
+        features = (base.compiler.left_features, base.compiler.right_features)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(prices.nbytes * 2, 1))
+        try:
+            matrices = np.ndarray((2,) + prices.shape, dtype=np.float64, buffer=shm.buf)
+            matrices[0] = prices
+            matrices[1] = value_prices
+            init_args = (shm.name, prices.shape, pd.DatetimeIndex(times).asi8, list(sim.tickers.keys()),
+                         port.cash, dict(port.positions), port.original_value, features,
+                         multiprocessing.get_start_method() != 'fork')
+            configs = [(i, params, rules) for i, (params, rules) in enumerate(self.configurations())]
+            workers = max_workers or os.cpu_count() or 1
+            chunksize = max(1, len(configs) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach_panel, initargs=init_args) as pool:
+                rows = []
+                for index, params, metrics in pool.map(_run_config, configs, chunksize=chunksize):
+                    rows.append({**params, **metrics, 'config': index})
+            del matrices
+        finally:
+            shm.close()
+            shm.unlink()
+
+        table = pd.DataFrame(rows)
+        if table.empty:
+            return table
+        return table.sort_values(rank_by, ascending=ascending, na_position='last').reset_index(drop=True)
+
+
+def main():
+    # Sweep NVDA sell thresholds and sizes on synthetic data
+    from SimulationManager import SimulationManager
+    from DataProvider import SyntheticProvider
+    base = SimulationManager('sweep', 100000, '2025-07-21', 40, 'daily', {'NVDA': 100, 'AMZN': 120},
+                             {'NVDA': [{'action': 'sell', 'condition': 'greater_than', 'threshold': 180, 'shares': 10}]},
+                             provider=SyntheticProvider())
+    sweep = ParameterSweep(base, {'NVDA.0.threshold': list(range(100, 260, 10)), 'NVDA.0.shares': [5, 10, 20]})
+    print(sweep.run().head(10).to_string())
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,206 @@
 import datetime
 from StockData import StockData
+from TradeLedger import TradeLedger
+from EquityCurve import EquityCurve
 from datetime import datetime, timedelta
+import io
+import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter
+import Downsample
+import Metrics
 
 class Portfolio:
-    def __init__(self, cash, var1, var2 = None, positions = None, past_trades = None): 
+    def __init__(self, cash, var1, var2 = None, positions = None, past_trades = None, provider = None): 
         self.cash = cash     # Starting cash
         self.var1 = var1 
         self.var2 = var2
+        self.provider = provider  # market data provider for StockData (None = StockData default)
 
         if positions is not None:
             self.positions = positions
         else:
             self.positions = {}       # {ticker: shares held}
         
-        if past_trades is not None:
-            self.past_trades = past_trades
-        else:
-            self.past_trades = []
+        # columnar record of fills; still iterates as {'action', 'ticker', 'price', 'shares', 'timestamp'} dicts
+        self.past_trades = TradeLedger(past_trades)
         
         self.original_value = cash  #keep track of original value fo the portfolio
-        self.change_over_time = {}  # {timestamp: portfolio_value}
+        self.change_over_time = EquityCurve()  # {timestamp: portfolio_value}, kept in time order with running metrics
+        self._data = {}  # {ticker: StockData} price history used for fills and valuation
+        self._marks = {}  # {ticker: (price, shares)} each position was last valued at
+        self._mark_time = None  # ns timestamp of the last valuation (None = re-price everything on the next one)
+        self._positions_value = 0.0  # sum of price * shares over _marks (in position order, like Backtester)
+        self._market_closed = False  # some position had no bar at _mark_time
+        self._calendar = None  # {ns timestamp: tickers with a bar then}, rebuilt when price data is added
+        self._calendar_end = None  # latest timestamp in _calendar
+
+    # price history for a ticker, loaded once per portfolio (through the shared StockData cache)
+    def _stock_data(self, ticker):
+        if ticker not in self._data:
+            self._data[ticker] = StockData(ticker, self.var1, self.var2, provider=self.provider)
+            self._calendar = None
+        return self._data[ticker]
+
+    def preload(self, tickers):
+        """Load price history for several tickers in one batch (see StockData.load_many)."""
+        missing = [ticker for ticker in tickers if ticker not in self._data]
+        # only date ranges can be batched; period/interval portfolios load lazily
+        if missing and self.var2 is not None and len(self.var2) == 10:
+            self._data.update(StockData.load_many(missing, self.var1, self.var2, provider=self.provider))
+            self._calendar = None
+
+    @property
+    def price_data(self):
+        """{ticker: StockData} loaded so far (a copy; share it with add_price_data)."""
+        return dict(self._data)
+
+    def add_price_data(self, data):
+        """Fill and value with already loaded price history (e.g. the intraday bars a simulation steps over)
+        instead of the portfolio's own; cached marks are dropped.
+        Args:
+            data: {ticker: StockData}"""
+        self._data.update(data)
+        self._calendar = None
+        self.invalidate_marks()
+
+    # market price of a ticker at a timestamp
+    def _market_price(self, ticker, timestamp):
+        return self._stock_data(ticker).get_price(timestamp)
     
+    @Metrics.timed('portfolio_get_value_seconds', 'Portfolio.get_value latency')
     def get_value(self, timestamp):
-        position_val = self.cash
-        market_closed = False
-        
-        for position in self.positions.keys():
-            sd = StockData(position, self.var1, self.var2)
-            sd.curtime = timestamp  # Set the current time for the stock data
-            market_price = sd.get_price()
-            if(market_price is None):
-                market_closed = True
-                break
-            position_val += (market_price * self.positions[position])
-        
-        # If market is closed, use the last known portfolio value
-        if market_closed:
-            if self.change_over_time:
-                # Get the most recent portfolio value
-                last_timestamp = max(self.change_over_time.keys())
-                position_val = self.change_over_time[last_timestamp]
-                print(f"Market closed at {timestamp}. Using last known value: ${position_val:,.2f}")
-            else:
-                # If no previous data, just return cash value
-                position_val = self.cash
-                print(f"Market closed at {timestamp}. No previous data. Using cash value: ${position_val:,.2f}")
+        # only positions with a bar at a new timestamp are re-priced; fills update their own ticker's mark
+        ns = pd.Timestamp(timestamp).value
+        if self._mark_time is None or len(self._marks) != len(self.positions):
+            self._mark_to_market(timestamp)
+        elif ns != self._mark_time:
+            self._mark_changes(timestamp, ns)
+        
+        if self._market_closed:
+            # If market is closed, use the last known portfolio value (or cash if there is none)
+            position_val = self.change_over_time.last_value if self.change_over_time else self.cash
+        else:
+            position_val = self.cash + self._positions_value
         
         # Track value over time
-        self.change_over_time[timestamp] = position_val
+        self.record_value(timestamp, position_val)
         return position_val
 
+    def invalidate_marks(self):
+        """Drop the per-position marks, e.g. after positions or price data changed outside buy/sell;
+        the next valuation re-prices every position."""
+        self._mark_time = None
+        self._marks = {}
+
+    def apply_fills(self, fills, positions, cash, timestamps=(), values=()):
+        """Bring the portfolio up to date with trading done outside buy/sell (e.g. a vectorized backtest).
+        Args:
+            fills: (actions, tickers, prices, shares, timestamps) columns, appended to past_trades in one go
+            positions: {ticker: shares held} afterwards
+            cash: Cash afterwards
+            timestamps, values: Valuations to append to change_over_time"""
+        self.past_trades.record_many(*fills)
+        self.change_over_time.extend(timestamps, values)
+        self.set_positions(positions, cash)
+
+    def set_positions(self, positions, cash=None):
+        """Replace the holdings (and optionally cash) wholesale, e.g. when restoring a checkpoint.
+        Args:
+            positions: {ticker: shares held}
+            cash: New cash balance (None = unchanged)"""
+        self.positions = positions
+        if cash is not None:
+            self.cash = cash
+        self.invalidate_marks()
+
+    def record_value(self, timestamp, value):
+        """Store a valuation in change_over_time (which also updates the running metrics)."""
+        self.change_over_time[timestamp] = value
+
+    # return/drawdown statistics over change_over_time (see RunningMetrics)
+    def _running_metrics(self):
+        return self.change_over_time.metrics()
+
+    @staticmethod
+    def _periods_per_year(period):
+        if period == 'daily':
+            return 252  # Trading days per year
+        elif period == 'weekly':
+            return 52
+        elif period == 'monthly':
+            return 12
+        elif period == 'annual':
+            return 1
+        print(f"Invalid period '{period}'. Using 'daily'.")
+        return 252
+
+    def _mark_to_market(self, timestamp):
+        # price every position at timestamp and restart the marks from there;
+        # load any positions we have no history for yet concurrently, not one by one
+        self.preload(self.positions.keys())
+        self._marks = {}
+        for position, shares in self.positions.items():
+            market_price = self._market_price(position, timestamp)
+            if market_price is not None:
+                self._marks[position] = (market_price, shares)
+        self._sum_marks()
+        self._mark_time = pd.Timestamp(timestamp).value
+        self._set_market_closed(len(self._marks) < len(self.positions), timestamp)
+
+    def _mark_changes(self, timestamp, ns):
+        # re-price only the held tickers that have a bar at timestamp; the others keep their marks
+        bars = self._bar_calendar(ns).get(ns, frozenset())
+        held = [ticker for ticker in bars if ticker in self._marks] if len(bars) < len(self._marks) \
+            else [ticker for ticker in self._marks if ticker in bars]
+        for ticker in held:
+            self._marks[ticker] = (self._market_price(ticker, timestamp), self._marks[ticker][1])
+        if held:
+            self._sum_marks()
+        self._mark_time = ns
+        self._set_market_closed(len(held) < len(self._marks), timestamp)
+
+    def _set_market_closed(self, closed, timestamp):
+        self._market_closed = closed
+        if closed:
+            if self.change_over_time:
+                print(f"Market closed at {timestamp}. Using last known value: ${self.change_over_time.last_value:,.2f}")
+            else:
+                print(f"Market closed at {timestamp}. No previous data. Using cash value: ${self.cash:,.2f}")
+
+    def _bar_calendar(self, ns):
+        # which tickers have a bar at each timestamp; rebuilt when data was added or ns is past its end
+        # (bars appended to a StockData)
+        if self._calendar is None or self._calendar_end is None or ns > self._calendar_end:
+            tickers = list(self._data)
+            times = [self._data[ticker].bar_times() for ticker in tickers]
+            all_times = np.concatenate(times) if times else np.empty(0, dtype=np.int64)
+            owners = np.repeat(np.arange(len(tickers)), [len(t) for t in times])
+            order = np.argsort(all_times, kind='stable')
+            all_times, owners = all_times[order], owners[order]
+            bounds = np.flatnonzero(np.diff(all_times)) + 1
+            starts = np.r_[0, bounds] if len(all_times) else bounds
+            self._calendar = {time: frozenset(tickers[i] for i in group)
+                              for time, group in zip(all_times[starts].tolist(), np.split(owners, bounds))}
+            self._calendar_end = int(all_times[-1]) if len(all_times) else None
+        return self._calendar
+
+    def _mark_fill(self, ticker, market_price):
+        # a fill re-marks only its own ticker, at the fill's market price and the new share count
+        if self._mark_time is None:
+            return
+        self._marks[ticker] = (market_price, self.positions[ticker])
+        self._sum_marks()
+
+    def _sum_marks(self):
+        # re-added rather than adjusted by the change, so the loop engine's values keep matching the
+        # vectorized engine's to the last bit (no price lookups here, only the cached marks)
+        self._positions_value = sum(price * shares for price, shares in self._marks.values())
+
     def get_PNL(self, timestamp):
         value = self.get_value(timestamp)
         if value is not None:
@@ -62,18 +210,13 @@ class Portfolio:
         print(f"CASH: ${self.cash}")
         print("POSITIONS:")
         for ticker, shares in self.positions.items():
-            sd = StockData(ticker, self.var1, self.var2)
-            sd.curtime = timestamp  # Set the current time for the stock data
-            market_price = sd.get_price()
+            market_price = self._market_price(ticker, timestamp)
             print(f"  {ticker}: {shares} shares @ ${market_price}")
         print(f"P&L: ${self.get_PNL(timestamp):,.2f}")
         print(f"Current Value: ${self.get_value(timestamp):,.2f}")
 
     def buy(self, ticker, price, shares, timestamp):
-
-        sd = StockData(ticker, self.var1, self.var2)
-        sd.curtime = timestamp  # Set the current time for the stock data
-        market_price = sd.get_price()
+        market_price = self._market_price(ticker, timestamp)
         if(market_price is None):
             return
 
@@ -83,16 +226,15 @@ class Portfolio:
         price = min(price, market_price)
         cost = price * shares
         if self.cash >= cost:
+            self.past_trades.record('BUY', ticker, price, shares, timestamp)  # first: it rejects fractional shares
             self.cash -= cost
             self.positions[ticker] = self.positions.get(ticker, 0) + shares
-            self.past_trades.append({'action': 'BUY', 'ticker': ticker, 'price': price, 'shares': shares, 'timestamp': timestamp})
+            self._mark_fill(ticker, market_price)
         else:
             print(f"Not enough cash to buy {shares} shares of {ticker}")
     
     def sell(self, ticker, price, shares, timestamp):
-        sd = StockData(ticker, self.var1, self.var2)
-        sd.curtime = timestamp  # Set the current time for the stock data
-        market_price = sd.get_price()
+        market_price = self._market_price(ticker, timestamp)
         if(market_price is None):
             return
 
@@ -102,13 +244,50 @@ class Portfolio:
         price = max(price, market_price)
 
         if self.positions.get(ticker, 0) >= shares:
+            self.past_trades.record('SELL', ticker, price, shares, timestamp)
             self.positions[ticker] -= shares
+            self._mark_fill(ticker, market_price)
             self.cash += price * shares
-            self.past_trades.append({'action': 'SELL', 'ticker': ticker, 'price': price, 'shares': shares, 'timestamp': timestamp})
         else:
             print(f"Not enough shares to sell {shares} of {ticker}")
 
-    def plot_portfolio_value(self, title="Portfolio Value Over Time", save_path=None, show_percentage=False):
+    @staticmethod
+    def _figure(show):
+        # show=True draws through pyplot as before; otherwise a standalone Agg figure that never
+        # touches pyplot's global state, so it is safe to render from server threads
+        if show:
+            return plt.figure(figsize=(12, 6))
+        figure = Figure(figsize=(12, 6))
+        FigureCanvasAgg(figure)
+        return figure
+
+    @staticmethod
+    def _finish_figure(figure, save_path, output, show):
+        figure.tight_layout()
+
+        # Save if path provided
+        if save_path:
+            figure.savefig(save_path, dpi=300, bbox_inches='tight')
+            print(f"Plot saved to {save_path}")
+
+        image = None
+        if output:
+            buffer = io.BytesIO()
+            figure.savefig(buffer, format=output, dpi=figure.dpi, bbox_inches='tight')
+            image = buffer.getvalue()
+
+        if show:
+            plt.show()
+        return image
+
+    @staticmethod
+    def _plot_width(figure, max_points):
+        # default target: 4 points (first/min/max/last) per horizontal pixel
+        pixels = int(figure.get_figwidth() * figure.dpi)
+        return pixels, max_points if max_points is not None else 4 * pixels
+
+    def plot_portfolio_value(self, title="Portfolio Value Over Time", save_path=None, show_percentage=False,
+                             show=True, output=None, max_points=None, downsample='minmax'):
         """
         Plot the portfolio value changes over time.
         Shows constant values during market closures.
@@ -117,82 +296,80 @@ class Portfolio:
             title (str): Title for the plot
             save_path (str): Optional path to save the plot as an image
             show_percentage (bool): If True, show percentage changes from original value
+            show (bool): Open a pyplot window; False renders headless on the Agg backend
+            output (str): Optional image format ('png', 'svg', ...) to return as bytes
+            max_points (int): Points drawn at most (default: 4 per pixel of figure width)
+            downsample (str): 'minmax' (keeps each bucket's extremes) or 'lttb'
+        Returns:
+            bytes: The rendered image if output is given, else None
         """
         if not self.change_over_time:
             print("No portfolio value data available. Call get_value() with timestamps first.")
             return
         
-        # Sort timestamps and values
-        timestamps = sorted(self.change_over_time.keys())
-        values = [self.change_over_time[ts] for ts in timestamps]
+        # Timestamps (as matplotlib date numbers) and values, already in time order
+        timestamps = self.change_over_time.timestamps
+        values = self.change_over_time.portfolio_values
         
         # Calculate percentage changes if requested
         if show_percentage:
-            values = [((val - self.original_value) / self.original_value) * 100 for val in values]
+            values = (values - self.original_value) / self.original_value * 100
             ylabel = 'Portfolio Value Change (%)'
             title += " (Percentage Change)"
         else:
             ylabel = 'Portfolio Value ($)'
         
         # Create the plot
-        plt.figure(figsize=(12, 6))
-        
-        # Plot the main line
-        plt.plot(timestamps, values, marker='o', linewidth=2, markersize=4, color='blue', label='Portfolio Value')
-        
-        # Identify and highlight constant value periods (market closures)
-        constant_periods = []
-        current_period_start = None
-        current_value = None
-        
-        for i, (ts, val) in enumerate(zip(timestamps, values)):
-            if i == 0:
-                current_value = val
-                current_period_start = ts
-            elif val == current_value and i < len(values) - 1:
-                # Still in a constant period
-                continue
-            else:
-                # Value changed or end of data
-                if current_period_start and i > 1:  # Only highlight if period has multiple points
-                    constant_periods.append((current_period_start, timestamps[i-1], current_value))
-                current_value = val
-                current_period_start = ts
-        
-        # Highlight constant value periods with different styling
-        for start_ts, end_ts, const_val in constant_periods:
-            period_timestamps = [ts for ts in timestamps if start_ts <= ts <= end_ts]
-            period_values = [self.change_over_time[ts] for ts in period_timestamps]
-            plt.plot(period_timestamps, period_values, '--', color='gray', alpha=0.7, linewidth=1)
+        figure = self._figure(show)
+        ax = figure.gca()
+        pixels, max_points = self._plot_width(figure, max_points)
+        keep = Downsample.indices(timestamps, values, max_points, downsample)
+        dates = mdates.date2num(timestamps)
+        
+        # Plot the main line (markers only while individual points are distinguishable)
+        marker = 'o' if len(keep) <= pixels // 10 else None
+        ax.plot(dates[keep], values[keep], marker=marker, linewidth=2, markersize=4, color='blue', label='Portfolio Value')
+        
+        # Highlight constant value periods (market closures) at least a pixel wide, in one dashed line
+        starts, ends = Downsample.constant_runs(values)
+        span = dates[-1] - dates[0]
+        wide = dates[ends] - dates[starts] >= span / pixels
+        starts, ends = starts[wide], ends[wide]
+        if len(starts):
+            gap = np.full(len(starts), np.nan)
+            ax.plot(np.column_stack((dates[starts], dates[ends], gap)).ravel(),
+                    np.column_stack((values[starts], values[ends], gap)).ravel(),
+                    '--', color='gray', alpha=0.7, linewidth=1)
         
         # Add horizontal line for original value
         if show_percentage:
-            plt.axhline(y=0, color='r', linestyle='--', alpha=0.7, label='Original Value (0%)')
+            ax.axhline(y=0, color='r', linestyle='--', alpha=0.7, label='Original Value (0%)')
         else:
-            plt.axhline(y=self.original_value, color='r', linestyle='--', alpha=0.7, label=f'Original Value: ${self.original_value:,.2f}')
+            ax.axhline(y=self.original_value, color='r', linestyle='--', alpha=0.7, label=f'Original Value: ${self.original_value:,.2f}')
         
         # Formatting
-        plt.title(title, fontsize=14, fontweight='bold')
-        plt.xlabel('Date', fontsize=12)
-        plt.ylabel(ylabel, fontsize=12)
-        plt.grid(True, alpha=0.3)
-        plt.legend()
-        
-        # Format x-axis dates
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-        plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=1))
-        plt.xticks(rotation=45)
+        ax.set_title(title, fontsize=14, fontweight='bold')
+        ax.set_xlabel('Date', fontsize=12)
+        ax.set_ylabel(ylabel, fontsize=12)
+        ax.grid(True, alpha=0.3)
+        ax.legend()
+        
+        # Format x-axis dates (one tick per day unless that would crowd the axis)
+        ax.xaxis_date()
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+        ax.xaxis.set_major_locator(mdates.DayLocator(interval=1) if span <= 31 else mdates.AutoDateLocator())
+        ax.tick_params(axis='x', labelrotation=45)
         
         # Format y-axis based on display type
         if show_percentage:
-            plt.gca().yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'{x:.1f}%'))
+            ax.yaxis.set_major_formatter(FuncFormatter(lambda x, p: f'{x:.1f}%'))
         else:
-            plt.gca().yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'${x:,.0f}'))
+            ax.yaxis.set_major_formatter(FuncFormatter(lambda x, p: f'${x:,.0f}'))
         
         # Adjust y-axis to show changes more proportionally
         if len(values) > 1:
-            min_val = min(values)
-            max_val = max(values)
+            min_val = float(values.min())
+            max_val = float(values.max())
             range_val = max_val - min_val
             
             # Add padding but limit it to reasonable bounds
@@ -202,69 +379,76 @@ class Portfolio:
                     padding = max(range_val * 0.2, 0.1)  # 20% padding, minimum 0.1%
                 else:
                     padding = max(range_val * 0.1, 100)  # At least $100 padding
-                plt.ylim(min_val - padding, max_val + padding)
+                ax.set_ylim(min_val - padding, max_val + padding)
             else:
                 # If all values are the same, add small padding around the value
                 if show_percentage:
-                    plt.ylim(min_val - 0.1, min_val + 0.1)  # Small percentage padding
+                    ax.set_ylim(min_val - 0.1, min_val + 0.1)  # Small percentage padding
                 else:
-                    plt.ylim(min_val - 100, min_val + 100)  # Small dollar padding
+                    ax.set_ylim(min_val - 100, min_val + 100)  # Small dollar padding
         
-        plt.tight_layout()
-        
-        # Save if path provided
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-            print(f"Plot saved to {save_path}")
-        
-        plt.show()
+        return self._finish_figure(figure, save_path, output, show)
 
-    def plot_pnl(self, title="Portfolio P&L Over Time", save_path=None):
+    def plot_pnl(self, title="Portfolio P&L Over Time", save_path=None, show=True, output=None, max_points=None,
+                 downsample='minmax'):
         """
         Plot the portfolio profit and loss over time.
+        One bar per time point while they fit; longer curves are downsampled and drawn as
+        a filled profit/loss area over the same time-point axis.
         
         Args:
             title (str): Title for the plot
             save_path (str): Optional path to save the plot as an image
+            show (bool): Open a pyplot window; False renders headless on the Agg backend
+            output (str): Optional image format ('png', 'svg', ...) to return as bytes
+            max_points (int): Points drawn at most (default: 4 per pixel of figure width)
+            downsample (str): 'minmax' (keeps each bucket's extremes) or 'lttb'
+        Returns:
+            bytes: The rendered image if output is given, else None
         """
         if not self.change_over_time:
             print("No portfolio value data available. Call get_value() with timestamps first.")
             return
         
-        # Sort timestamps and calculate P&L
-        timestamps = sorted(self.change_over_time.keys())
-        pnl_values = [self.change_over_time[ts] - self.original_value for ts in timestamps]
+        # Timestamps (already in time order) and P&L
+        timestamps = self.change_over_time.timestamps
+        pnl_values = self.change_over_time.portfolio_values - self.original_value
+        positions = np.arange(len(pnl_values))
         
         # Create the plot
-        plt.figure(figsize=(12, 6))
-        
-        # Use different colors for profit/loss
-        colors = ['green' if pnl >= 0 else 'red' for pnl in pnl_values]
-        plt.bar(range(len(timestamps)), pnl_values, color=colors, alpha=0.7)
+        figure = self._figure(show)
+        ax = figure.gca()
+        pixels, max_points = self._plot_width(figure, max_points)
+        
+        if len(pnl_values) <= pixels // 4:
+            # Use different colors for profit/loss
+            colors = np.where(pnl_values >= 0, 'green', 'red')
+            ax.bar(positions, pnl_values, color=colors, alpha=0.7)
+        else:
+            keep = Downsample.indices(positions, pnl_values, max_points, downsample)
+            ax.fill_between(positions[keep], pnl_values[keep], 0, where=pnl_values[keep] >= 0,
+                            color='green', alpha=0.7, interpolate=True)
+            ax.fill_between(positions[keep], pnl_values[keep], 0, where=pnl_values[keep] < 0,
+                            color='red', alpha=0.7, interpolate=True)
         
         # Add horizontal line at zero
-        plt.axhline(y=0, color='black', linestyle='-', alpha=0.5)
+        ax.axhline(y=0, color='black', linestyle='-', alpha=0.5)
         
         # Formatting
-        plt.title(title, fontsize=14, fontweight='bold')
-        plt.xlabel('Time Points', fontsize=12)
-        plt.ylabel('Profit/Loss ($)', fontsize=12)
-        plt.grid(True, alpha=0.3)
+        ax.set_title(title, fontsize=14, fontweight='bold')
+        ax.set_xlabel('Time Points', fontsize=12)
+        ax.set_ylabel('Profit/Loss ($)', fontsize=12)
+        ax.grid(True, alpha=0.3)
         
-        # Set x-axis labels
-        plt.xticks(range(len(timestamps)), [ts.strftime('%m/%d %H:%M') for ts in timestamps], rotation=45)
+        # Set x-axis labels (every time point while they fit, else evenly spaced)
+        ticks = positions if len(positions) <= 60 else np.linspace(0, len(positions) - 1, 20).astype(np.int64)
+        ax.set_xticks(ticks)
+        ax.set_xticklabels(pd.DatetimeIndex(timestamps[ticks]).strftime('%m/%d %H:%M'), rotation=45)
         
         # Format y-axis as currency
-        plt.gca().yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'${x:,.0f}'))
+        ax.yaxis.set_major_formatter(FuncFormatter(lambda x, p: f'${x:,.0f}'))
         
-        plt.tight_layout()
-        
-        # Save if path provided
-        if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
-            print(f"Plot saved to {save_path}")
-        
-        plt.show()
+        return self._finish_figure(figure, save_path, output, show)
 
     def calculate_sharpe_ratio(self, risk_free_rate=0.02, period='daily'):
         """
@@ -284,50 +468,16 @@ class Portfolio:
             print("Insufficient data for Sharpe ratio calculation. Need at least 2 data points.")
             return None
         
-        # Get sorted values and calculate returns
-        timestamps = sorted(self.change_over_time.keys())
-        values = [self.change_over_time[ts] for ts in timestamps]
-        
-        # Calculate percentage returns
-        returns = []
-        for i in range(1, len(values)):
-            if values[i-1] != 0:  # Avoid division by zero
-                daily_return = (values[i] - values[i-1]) / values[i-1]
-                returns.append(daily_return)
-        
-        if len(returns) < 2:
+        # Return statistics are kept up to date as values are recorded (see RunningMetrics)
+        metrics = self._running_metrics()
+        if metrics.returns < 2:
             print("Insufficient return data for Sharpe ratio calculation.")
             return None
         
-        # Convert to numpy array for easier calculations
-        returns = np.array(returns)
-        
-        # Calculate annualized metrics based on period
-        if period == 'daily':
-            periods_per_year = 252  # Trading days per year
-        elif period == 'weekly':
-            periods_per_year = 52
-        elif period == 'monthly':
-            periods_per_year = 12
-        elif period == 'annual':
-            periods_per_year = 1
-        else:
-            print(f"Invalid period '{period}'. Using 'daily'.")
-            periods_per_year = 252
-        
-        # Annualize the risk-free rate
-        daily_risk_free_rate = risk_free_rate / periods_per_year
-        
-        # Calculate excess returns
-        excess_returns = returns - daily_risk_free_rate
-        
-        # Calculate Sharpe ratio
-        if np.std(returns) == 0:
+        # Annualized Sharpe ratio (excess return over the per-period risk-free rate)
+        sharpe_ratio = metrics.sharpe_ratio(risk_free_rate, self._periods_per_year(period))
+        if sharpe_ratio is None:
             print("Portfolio has zero volatility. Sharpe ratio is undefined.")
-            return None
-        
-        # Annualized Sharpe ratio
-        sharpe_ratio = (np.mean(excess_returns) * periods_per_year) / (np.std(returns) * np.sqrt(periods_per_year))
         
         return sharpe_ratio
     
@@ -345,41 +495,13 @@ class Portfolio:
             print("Insufficient data for volatility calculation. Need at least 2 data points.")
             return None
         
-        # Get sorted values and calculate returns
-        timestamps = sorted(self.change_over_time.keys())
-        values = [self.change_over_time[ts] for ts in timestamps]
-        
-        # Calculate percentage returns
-        returns = []
-        for i in range(1, len(values)):
-            if values[i-1] != 0:  # Avoid division by zero
-                daily_return = (values[i] - values[i-1]) / values[i-1]
-                returns.append(daily_return)
-        
-        if len(returns) < 2:
+        metrics = self._running_metrics()
+        if metrics.returns < 2:
             print("Insufficient return data for volatility calculation.")
             return None
         
-        # Convert to numpy array
-        returns = np.array(returns)
-        
-        # Calculate annualized volatility based on period
-        if period == 'daily':
-            periods_per_year = 252  # Trading days per year
-        elif period == 'weekly':
-            periods_per_year = 52
-        elif period == 'monthly':
-            periods_per_year = 12
-        elif period == 'annual':
-            periods_per_year = 1
-        else:
-            print(f"Invalid period '{period}'. Using 'daily'.")
-            periods_per_year = 252
-        
         # Annualized volatility
-        volatility = np.std(returns) * np.sqrt(periods_per_year)
-        
-        return volatility
+        return metrics.volatility(self._periods_per_year(period))
     
     def calculate_returns_summary(self, risk_free_rate=0.02):
         """Calculate a comprehensive summary of portfolio returns and risk metrics.
@@ -394,47 +516,25 @@ class Portfolio:
             print("Insufficient data for returns summary. Need at least 2 data points.")
             return None
         
-        # Get sorted values and calculate returns
-        timestamps = sorted(self.change_over_time.keys())
-        values = [self.change_over_time[ts] for ts in timestamps]
-        
-        # Calculate percentage returns
-        returns = []
-        for i in range(1, len(values)):
-            if values[i-1] != 0:  # Avoid division by zero
-                daily_return = (values[i] - values[i-1]) / values[i-1]
-                returns.append(daily_return)
-        
-        if len(returns) < 2:
+        metrics = self._running_metrics()
+        if metrics.returns < 2:
             print("Insufficient return data for summary calculation.")
             return None
         
-        returns = np.array(returns)
-        
         # Calculate metrics
-        total_return = (values[-1] - values[0]) / values[0] * 100
-        annualized_return = (1 + total_return/100) ** (252/len(returns)) - 1
-        volatility = np.std(returns) * np.sqrt(252) * 100
+        total_return = metrics.total_return()
+        annualized_return = (1 + total_return/100) ** (252/metrics.returns) - 1
+        volatility = metrics.volatility(252) * 100
         sharpe_ratio = self.calculate_sharpe_ratio(risk_free_rate)
         
-        # Calculate maximum drawdown
-        peak = values[0]
-        max_drawdown = 0
-        for value in values:
-            if value > peak:
-                peak = value
-            drawdown = (peak - value) / peak * 100
-            if drawdown > max_drawdown:
-                max_drawdown = drawdown
-        
         summary = {
             'total_return_pct': round(total_return, 2),
             'annualized_return_pct': round(annualized_return * 100, 2),
             'volatility_pct': round(volatility, 2),
             'sharpe_ratio': round(sharpe_ratio, 3) if sharpe_ratio else None,
-            'max_drawdown_pct': round(max_drawdown, 2),
-            'data_points': len(values),
-            'time_period_days': (timestamps[-1] - timestamps[0]).days
+            'max_drawdown_pct': round(metrics.max_drawdown, 2),
+            'data_points': metrics.count,
+            'time_period_days': (metrics.last_time - metrics.first_time).days
         }
         
         return summary
@@ -0,0 +1,244 @@
+import inspect
+import numpy as np
+import pandas as pd
+from Indicators import Indicators
+import Metrics
+
+'''Compiles trading_rules dicts once into arrays that are evaluated for all rules at a time'''
+
+class RuleCompiler:
+    actions = ('buy', 'sell')
+    # condition -> (comparison, what the left side is)
+    conditions = {
+        'greater_than': ('gt', 'value'),
+        'less_than': ('lt', 'value'),
+        'crosses_above': ('cross_above', 'value'),
+        'crosses_below': ('cross_below', 'value'),
+        'pct_change_above': ('gt', 'pct_change'),
+        'pct_change_below': ('lt', 'pct_change')
+    }
+    comparisons = ('gt', 'lt', 'cross_above', 'cross_below')
+
+    def __init__(self, tickers, trading_rules):
+        """Validate and compile trading rules against a fixed ticker universe.
+        A rule is {'action', 'condition', 'threshold', 'shares'} plus optional fields:
+            indicator: compare an indicator of the ticker instead of its price, e.g. {'name': 'rsi', 'period': 14}
+            compare_to: compare against an indicator instead of threshold, e.g. {'name': 'sma', 'window': 20}
+            lookback: bars for the pct_change_above / pct_change_below conditions (default 1)
+        Indicator specs may also be a bare name ('rsi'); bollinger takes 'output' ('upper', 'middle', 'lower').
+        Rules for tickers outside the universe are ignored (they never have a price).
+        Args:
+            tickers: Ordered list of tickers (columns of the price vectors/matrices)
+            trading_rules: {ticker: [rule dict]} as built by app.py
+        Raises:
+            ValueError: Describing the first invalid rule"""
+
+        self.tickers = list(tickers)
+        self.column = {ticker: j for j, ticker in enumerate(self.tickers)}
+        self.rules = []  # (column, ticker, action, condition, threshold, shares) in evaluation order
+        self._left_specs = []
+        self._right_specs = []
+        comparisons = []
+        for ticker, rules in trading_rules.items():
+            for n, rule in enumerate(rules, 1):
+                where = f"Trading rule {n} for {ticker}"
+                action, condition, threshold, shares, left, right = self._parse(rule, where)
+                if ticker not in self.column:
+                    continue
+                self.rules.append((self.column[ticker], ticker, action, condition, threshold, shares))
+                comparisons.append(self.comparisons.index(self.conditions[condition][0]))
+                self._left_specs.append(left)
+                self._right_specs.append(right)
+
+        self.columns = np.array([rule[0] for rule in self.rules], dtype=np.int64)
+        self.thresholds = np.array([rule[4] for rule in self.rules], dtype=np.float64)
+        self.comparison = np.array(comparisons, dtype=np.int8)
+        # rules whose left side is the live price (the rest read precomputed features)
+        self.on_price = np.array([spec is None for spec in self._left_specs], dtype=bool)
+        self.on_threshold = np.array([spec is None for spec in self._right_specs], dtype=bool)
+        self.left_features = None  # steps x rules, set by prepare()/use_features()
+        self.right_features = None
+        self._previous = None  # (step, left, right) from the last evaluate() call
+
+    def _parse(self, rule, where):
+        if not isinstance(rule, dict):
+            raise ValueError(f"{where}: must be an object")
+        action = rule.get('action', 'sell')
+        if action not in self.actions:
+            raise ValueError(f"{where}: unknown action '{action}' (expected buy or sell)")
+        condition = rule.get('condition')
+        if condition not in self.conditions:
+            raise ValueError(f"{where}: unknown condition '{condition}' (expected one of {', '.join(self.conditions)})")
+        try:
+            shares = int(rule.get('shares'))
+        except (TypeError, ValueError):
+            raise ValueError(f"{where}: shares must be a whole number")
+        if shares <= 0:
+            raise ValueError(f"{where}: shares must be positive")
+
+        left = self._indicator_spec(rule.get('indicator'), where, 'indicator')
+        right = self._indicator_spec(rule.get('compare_to'), where, 'compare_to')
+        threshold = rule.get('threshold')
+        if right is None:
+            try:
+                threshold = float(threshold)
+            except (TypeError, ValueError):
+                raise ValueError(f"{where}: threshold must be a number")
+            if not np.isfinite(threshold):
+                raise ValueError(f"{where}: threshold must be finite")
+        else:
+            threshold = np.nan
+
+        if self.conditions[condition][1] == 'pct_change':
+            if left is not None:
+                raise ValueError(f"{where}: {condition} applies to the price, not an indicator")
+            try:
+                lookback = int(rule.get('lookback', 1))
+            except (TypeError, ValueError):
+                raise ValueError(f"{where}: lookback must be a whole number of bars")
+            if lookback < 1:
+                raise ValueError(f"{where}: lookback must be at least 1 bar")
+            left = ('pct_change', lookback)
+        return action, condition, threshold, shares, left, right
+
+    @staticmethod
+    def _indicator_spec(spec, where, field):
+        if spec is None:
+            return None
+        if isinstance(spec, str):
+            spec = {'name': spec}
+        if not isinstance(spec, dict) or 'name' not in spec:
+            raise ValueError(f"{where}: {field} must be an indicator name or {{'name': ..., <params>}}")
+        params = {k: v for k, v in spec.items() if k not in ('name', 'output')}
+        name = spec['name']
+        kernel = Indicators.kernels.get(name)
+        if kernel is None:
+            raise ValueError(f"{where}: unknown indicator '{name}' (expected one of {', '.join(Indicators.kernels)})")
+        try:
+            inspect.signature(kernel).bind(None, None, **params)
+        except TypeError:
+            raise ValueError(f"{where}: invalid parameters {sorted(params)} for indicator '{name}'")
+        for key, value in params.items():
+            if key == 'column':
+                valid = value in Indicators.columns
+            elif key == 'num_std':
+                valid = isinstance(value, (int, float)) and value >= 0
+            elif key == 'window' and isinstance(value, str):
+                try:
+                    valid = pd.Timedelta(value) > pd.Timedelta(0)
+                except ValueError:
+                    valid = False
+            else:
+                valid = isinstance(value, int) and not isinstance(value, bool) and value >= 1
+            if not valid:
+                raise ValueError(f"{where}: invalid {key} {value!r} for indicator '{name}'")
+        output = spec.get('output')
+        if name == 'bollinger':
+            output = output or 'middle'
+            if output not in ('upper', 'middle', 'lower'):
+                raise ValueError(f"{where}: bollinger output must be upper, middle or lower")
+        elif output is not None:
+            raise ValueError(f"{where}: indicator '{name}' has a single output")
+        return ('indicator', name, tuple(sorted(params.items())), output)
+
+    def _feature(self, spec, ticker, times, data, prices, column):
+        if spec is None:
+            return None
+        if spec[0] == 'pct_change':
+            lookback = spec[1]
+            series = prices[:, column]
+            change = np.full(len(series), np.nan)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                change[lookback:] = (series[lookback:] / series[:-lookback] - 1) * 100
+            return change
+        _, name, params, output = spec
+        stock = data.get(ticker)
+        if stock is None:
+            return np.full(len(times), np.nan)
+        values = stock.indicators.at_times(name, times, **dict(params))
+        return values[output] if output else values
+
+    def prepare(self, times, data, prices):
+        """Precompute indicator / percent-change inputs for every step.
+        Args:
+            times: Step timestamps
+            data: {ticker: StockData} the indicators are computed on
+            prices: Step x ticker price matrix the rules see"""
+        n = len(times)
+        left = np.full((n, len(self.rules)), np.nan)
+        right = np.full((n, len(self.rules)), np.nan)
+        for r, (j, ticker, *_) in enumerate(self.rules):
+            feature = self._feature(self._left_specs[r], ticker, times, data, prices, j)
+            if feature is not None:
+                left[:, r] = feature
+            feature = self._feature(self._right_specs[r], ticker, times, data, prices, j)
+            if feature is not None:
+                right[:, r] = feature
+        self.use_features(left, right)
+
+    def use_features(self, left, right):
+        """Reuse features computed by another compiler over the same rules and steps (e.g. in sweep workers)."""
+        self.left_features = left
+        self.right_features = right
+        self._previous = None
+
+    @property
+    def needs_features(self):
+        return not (self.on_price.all() and self.on_threshold.all())
+
+    def _sides(self, prices, left_features, right_features):
+        # prices: (..., tickers) -> left/right operands (..., rules)
+        left = prices[..., self.columns]
+        if left_features is not None:
+            left = np.where(self.on_price, left, left_features)
+        right = np.broadcast_to(self.thresholds, left.shape)
+        if right_features is not None:
+            right = np.where(self.on_threshold, right, right_features)
+        return left, right
+
+    def _compare(self, left, right, previous_left, previous_right):
+        with np.errstate(invalid='ignore'):
+            above = left > right
+            below = left < right
+            was_above = previous_left > previous_right
+            was_below = previous_left < previous_right
+        # a cross needs a comparable previous step on the other side of the line
+        had_previous = ~np.isnan(previous_left - previous_right)
+        c = self.comparison
+        return np.select([c == 0, c == 1, c == 2],
+                         [above, below, above & ~was_above & had_previous],
+                         below & ~was_below & had_previous)
+
+    @Metrics.timed('rules_evaluate_seconds', 'Trading rule evaluation', mode='batch')
+    def masks(self, prices):
+        """Boolean matrix (steps x rules): True where a rule fires, for the whole run at once.
+        A rule never fires when its ticker has no price at that step."""
+        self._check_prepared()
+        left, right = self._sides(prices, self.left_features, self.right_features)
+        previous_left = np.vstack((np.full((1, left.shape[1]), np.nan), left[:-1]))
+        previous_right = np.vstack((np.full((1, right.shape[1]), np.nan), right[:-1]))
+        fired = self._compare(left, right, previous_left, previous_right)
+        return fired & ~np.isnan(prices[:, self.columns])
+
+    @Metrics.timed('rules_evaluate_seconds', 'Trading rule evaluation', mode='step')
+    def evaluate(self, step, prices):
+        """Indices of the rules that fire at one step, in evaluation order.
+        Args:
+            step: Step number (row of the prepared features); steps must be evaluated in order
+            prices: Current price per ticker (NaN = no bar)"""
+        self._check_prepared()
+        prices = np.asarray(prices, dtype=np.float64)
+        left, right = self._sides(prices,
+                                  None if self.left_features is None else self.left_features[step],
+                                  None if self.right_features is None else self.right_features[step])
+        if self._previous is not None and self._previous[0] == step - 1:
+            previous_left, previous_right = self._previous[1], self._previous[2]
+        else:
+            previous_left = previous_right = np.full(len(self.rules), np.nan)
+        self._previous = (step, left, right)
+        fired = self._compare(left, right, previous_left, previous_right) & ~np.isnan(prices[self.columns])
+        return np.flatnonzero(fired)
+
+    def _check_prepared(self):
+        if self.left_features is None and self.needs_features:
+            raise ValueError("Rules use indicators or percent changes: call prepare() first")
@@ -0,0 +1,147 @@
+import math
+import numpy as np
+
+'''Online risk metrics over a stream of portfolio valuations (Welford mean/variance, running peak and drawdown)'''
+
+class RunningMetrics:
+    _fields = ('count', 'first_time', 'first_value', 'last_time', 'last_value',
+               'returns', 'mean', 'm2', 'peak', 'max_drawdown')
+
+    def __init__(self):
+        """Accumulators updated once per recorded valuation so metric queries are O(1).
+        Valuations must arrive in time order; re-recording the latest timestamp replaces it."""
+
+        self.count = 0  # valuations seen
+        self.first_time = None
+        self.first_value = None
+        self.last_time = None
+        self.last_value = None
+        self.returns = 0  # period returns seen (periods starting at a zero value are skipped)
+        self.mean = 0.0  # mean period return
+        self.m2 = 0.0  # sum of squared deviations from the mean (Welford)
+        self.peak = None
+        self.max_drawdown = 0.0  # percent
+        self._previous = None  # state before the latest valuation, restored when it is replaced
+
+    def _state(self):
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def _restore(self, state):
+        for name, value in zip(self._fields, state):
+            setattr(self, name, value)
+
+    def update(self, timestamp, value):
+        """Add the valuation at timestamp.
+        Returns:
+            bool: False if timestamp is older than the latest valuation (the caller has to rebuild)"""
+        if self.last_time is not None:
+            if timestamp < self.last_time:
+                return False
+            if timestamp == self.last_time:
+                self._restore(self._previous)
+        self._previous = self._state()
+
+        if self.count == 0:
+            self.first_time = timestamp
+            self.first_value = value
+            self.peak = value
+        else:
+            if self.last_value != 0:
+                period_return = (value - self.last_value) / self.last_value
+                self.returns += 1
+                delta = period_return - self.mean
+                self.mean += delta / self.returns
+                self.m2 += delta * (period_return - self.mean)
+            if value > self.peak:
+                self.peak = value
+        if self.peak:
+            self.max_drawdown = max(self.max_drawdown, (self.peak - value) / self.peak * 100)
+        self.count += 1
+        self.last_time = timestamp
+        self.last_value = value
+        return True
+
+    def update_many(self, timestamps, values):
+        """Add valuations given in time order, all after the latest one, in bulk.
+        The batch's returns are merged into mean/m2 with Chan et al.'s pairwise update instead of one Welford step each.
+        Returns:
+            bool: False if the batch does not start after the latest valuation (the caller has to rebuild)"""
+        if len(values) == 0:
+            return True
+        if self.last_time is not None and timestamps[0] <= self.last_time:
+            return False
+        values = np.asarray(values, dtype=np.float64)
+        head = values[:-1]
+        if len(head):
+            if self.count == 0:
+                self.first_time = timestamps[0]
+                self.first_value = float(head[0])
+                self.peak = float(head[0])
+                series = head
+            else:
+                series = np.concatenate(([self.last_value], head))
+            previous = series[:-1]
+            nonzero = previous != 0
+            returns = np.diff(series)[nonzero] / previous[nonzero]
+            if len(returns):
+                mean = float(returns.mean())
+                total = self.returns + len(returns)
+                delta = mean - self.mean
+                self.m2 += float(((returns - mean) ** 2).sum()) + delta * delta * self.returns * len(returns) / total
+                self.mean += delta * len(returns) / total
+                self.returns = total
+            peaks = np.maximum.accumulate(np.concatenate(([self.peak], head)))[1:]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                drawdowns = np.where(peaks != 0, (peaks - head) / peaks * 100, 0.0)
+            self.peak = float(peaks[-1])
+            self.max_drawdown = max(self.max_drawdown, float(drawdowns.max()))
+            self.count += len(head)
+            self.last_time = timestamps[len(head) - 1]
+            self.last_value = float(head[-1])
+        # as in from_series, the last point goes through update() so it can still be replaced in place
+        return self.update(timestamps[-1], float(values[-1]))
+
+    @classmethod
+    def from_series(cls, timestamps, values):
+        """Accumulators for an already sorted series, computed in bulk."""
+        metrics = cls()
+        if len(values) == 0:
+            return metrics
+        head = np.asarray(values[:-1], dtype=np.float64)
+        if len(head):
+            previous = head[:-1]
+            nonzero = previous != 0
+            returns = np.diff(head)[nonzero] / previous[nonzero]
+            peaks = np.maximum.accumulate(head)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                drawdowns = np.where(peaks != 0, (peaks - head) / peaks * 100, 0.0)
+            metrics.count = len(head)
+            metrics.first_time = timestamps[0]
+            metrics.first_value = float(head[0])
+            metrics.last_time = timestamps[len(head) - 1]
+            metrics.last_value = float(head[-1])
+            metrics.returns = len(returns)
+            metrics.mean = float(returns.mean()) if len(returns) else 0.0
+            metrics.m2 = float(((returns - metrics.mean) ** 2).sum())
+            metrics.peak = float(peaks[-1])
+            metrics.max_drawdown = max(float(drawdowns.max()), 0.0)
+        # the last point goes through update() so it can still be replaced in place
+        metrics.update(timestamps[-1], float(values[-1]))
+        return metrics
+
+    def std(self):
+        """Population standard deviation of the period returns (same as np.std)."""
+        return math.sqrt(self.m2 / self.returns) if self.returns else 0.0
+
+    def sharpe_ratio(self, risk_free_rate, periods_per_year):
+        std = self.std()
+        if std == 0:
+            return None
+        return (self.mean - risk_free_rate / periods_per_year) * periods_per_year / (std * math.sqrt(periods_per_year))
+
+    def volatility(self, periods_per_year):
+        return self.std() * math.sqrt(periods_per_year)
+
+    def total_return(self):
+        """Percent change from the first to the latest valuation."""
+        return (self.last_value - self.first_value) / self.first_value * 100
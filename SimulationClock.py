@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+'''Simulation time: steps over the loaded trading bars, paced flat out, in (scaled) real time or at a fixed rate'''
+
+class SimulationClock:
+    modes = ('max_speed', 'realtime', 'stepped')
+
+    def __init__(self, mode='max_speed', speed=1.0, step_delay=0.1):
+        """Decide how much wall-clock time each simulation step takes.
+        Args:
+            mode: 'max_speed' (never sleeps), 'realtime' (simulated time passes speed times faster
+                  than wall-clock time) or 'stepped' (a fixed pause per step)
+            speed: Real-time multiplier, e.g. 3600 replays one simulated hour per second
+            step_delay: Seconds per step in 'stepped' mode; None waits for advance() before every step"""
+
+        if mode not in self.modes:
+            raise ValueError(f"Unknown pacing mode '{mode}' (expected one of {', '.join(self.modes)})")
+        if mode == 'realtime' and not speed > 0:
+            raise ValueError("Real-time speed must be positive")
+        self.mode = mode
+        self.speed = float(speed)
+        self.step_delay = step_delay
+        self._origin = None  # (wall time, simulated time) of the first tick
+        self._stopped = threading.Event()
+        self._advance = threading.Semaphore(0)
+
+    @classmethod
+    def from_env(cls):
+        """Clock configured by SIMULATION_PACING / SIMULATION_SPEED / SIMULATION_STEP_DELAY."""
+        return cls(os.environ.get('SIMULATION_PACING', 'max_speed'),
+                   speed=float(os.environ.get('SIMULATION_SPEED', 1.0)),
+                   step_delay=float(os.environ.get('SIMULATION_STEP_DELAY', 0.1)))
+
+    @staticmethod
+    def calendar(data, after=None, until=None):
+        """Simulation steps: the merged, sorted timestamps of every loaded bar across tickers.
+        Args:
+            data: {ticker: StockData} (or {ticker: DataFrame})
+            after: Only bars strictly after this time (the simulation's start)
+            until: Only bars at or before this time
+        Returns:
+            list: datetimes, one per step"""
+        stamps = [np.empty(0, dtype=np.int64)]
+        for stock in data.values():
+            frame = getattr(stock, 'stock_data', stock)
+            if frame is not None and not frame.empty:
+                stamps.append(frame.index.values.astype('datetime64[ns]').view('int64'))
+        steps = np.unique(np.concatenate(stamps))  # sorted union, duplicates dropped
+        if after is not None:
+            steps = steps[np.searchsorted(steps, pd.Timestamp(after).as_unit('ns').value, side='right'):]
+        if until is not None:
+            steps = steps[:np.searchsorted(steps, pd.Timestamp(until).as_unit('ns').value, side='right')]
+        return list(pd.DatetimeIndex(steps).to_pydatetime())
+
+    @property
+    def paced(self):
+        return self.mode != 'max_speed'
+
+    def tick(self, sim_time):
+        """Wait until the step at sim_time is due.
+        Returns:
+            bool: False if the clock was stopped while waiting"""
+        if self._stopped.is_set():
+            return False
+        if self.mode == 'realtime':
+            if self._origin is None:
+                self._origin = (time.monotonic(), sim_time)
+                return True
+            wall_start, sim_start = self._origin
+            due = wall_start + (sim_time - sim_start).total_seconds() / self.speed
+            return not self._stopped.wait(max(due - time.monotonic(), 0))
+        if self.mode == 'stepped':
+            if self.step_delay is None:
+                self._advance.acquire()
+                return not self._stopped.is_set()
+            return not self._stopped.wait(self.step_delay)
+        return True
+
+    def advance(self, steps=1):
+        """Release the next step(s) of a manually stepped clock."""
+        for _ in range(steps):
+            self._advance.release()
+
+    def stop(self):
+        """Wake up any waiting tick() so a stopped simulation does not sit out its pause."""
+        self._stopped.set()
+        self._advance.release()
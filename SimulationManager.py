@@ -0,0 +1,469 @@
+from Portfolio import Portfolio
+from StockData import StockData
+from Backtester import Backtester
+from RuleCompiler import RuleCompiler
+from SimulationClock import SimulationClock
+from ChartSeries import ChartSeries
+from SimulationStore import SimulationStore, StoredResults, FINISHED
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+import cProfile
+import os
+import pstats
+import time
+import threading
+import numpy as np
+import Metrics
+
+'''Runs one portfolio simulation (used by the Flask app and parameter sweeps)'''
+
+PROFILE_TOP = 100  # functions kept in stored profile reports
+RATE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)  # steps per second
+
+class SimulationManager:
+    def __init__(self, simulation_id, initial_cash, start_date, duration_days, trading_frequency, tickers, trading_rules, provider=None, engine='vectorized', clock=None, store=None, checkpoint_every=50, profile=False):
+        self.simulation_id = simulation_id
+        self.initial_cash = initial_cash
+        self.start_date = start_date
+        self.duration_days = duration_days
+        self.trading_frequency = trading_frequency  # 'daily' or 'intraday'
+        self.tickers = tickers
+        self.trading_rules = trading_rules
+        self.provider = provider  # market data provider (None = StockData default)
+        self.engine = engine  # 'vectorized' (Backtester) or 'loop' (step-by-step)
+        self.clock = clock or SimulationClock()  # pacing; max_speed unless asked otherwise
+        self.results = []
+        self.chart = ChartSeries(tickers.keys(), initial_cash)  # array-backed copy of the results for charts
+        self.total_steps = None  # number of trading bars in the run, known once the data is loaded
+        self.results_changed = threading.Condition()  # notified when results grow or the run ends
+        self.is_running = False
+        self.is_complete = False
+        self.status = 'created'  # queued, running, completed, failed, cancelled or timed_out
+        self.cancelled = False
+        self.deadline = None  # time.monotonic() after which the run times out
+        self.timeout = None  # seconds the scheduler allowed the run (for the timeout message)
+        self.finished_at = None
+        self.thread = None
+        self.store = store  # SimulationStore for checkpoints and finished results (None = memory only)
+        self.checkpoint_every = checkpoint_every  # steps between checkpoints
+        self._stored_steps = 0  # leading results already written to the store
+        self.profile = profile  # run under cProfile and include the top functions in profile_report()
+        self.timings = {}  # {stage: seconds} for setup, run, checkpoint, final_metrics
+        self._run_started = None  # (perf_counter, first step) once the engine starts
+        self._profiler = None
+        if store is not None:
+            self._provider_spec()  # fail now, not at the first save, if the run could not be resumed
+
+    def publish(self, records, times, prices):
+        """Append step records (with their timestamps and price rows for charts) and wake up anyone streaming results.
+        Returns:
+            bool: False (and the records are dropped) once the run was cancelled or timed out"""
+        with self.results_changed:
+            if not self.is_running:
+                return False
+            self.results.extend(records)
+            self.chart.extend(times, [record['portfolio_value'] for record in records], prices)
+            self.results_changed.notify_all()
+            return True
+
+    def finish(self):
+        with self.results_changed:
+            if self.status in ('created', 'queued', 'running'):
+                self.status = 'failed' if hasattr(self, 'error') else 'completed'
+            self.is_running = False
+            self.is_complete = True
+            self.finished_at = time.monotonic()
+            if self.store is not None and self.results and len(self.results) == self._stored_steps:
+                # every step is on disk: serve them from the store instead of keeping them in memory
+                self.results = StoredResults(self.store, self.simulation_id, self._stored_steps)
+            self.results_changed.notify_all()
+        if self.store is not None:
+            self.store.save_simulation(self)
+            if self.timings:
+                # kept with the simulation so any web process (or a later reload) can serve it
+                self.store.save_profile(self.simulation_id, self.profile_report(top=PROFILE_TOP))
+
+    def cancel(self, reason=None, status='cancelled'):
+        """Stop the run at its next step (or before it starts if it is still queued).
+        Returns:
+            bool: False if the run had already finished or been stopped"""
+        with self.results_changed:
+            if self.is_complete or self.status in FINISHED:
+                return False
+            self.cancelled = True
+            self.is_running = False
+            self.status = status
+            if reason:
+                self.error = reason
+            started = self.thread is not None
+        self.clock.stop()
+        if not started:
+            self.finish()
+        return True
+
+    def _stopped(self):
+        # checked between stages and steps; a run past its deadline times itself out here rather
+        # than at the scheduler's next sweep, so an overrunning stage publishes nothing afterwards
+        if self.is_running and self.deadline is not None and time.monotonic() > self.deadline:
+            self.cancel(f"Simulation timed out after {self.timeout} seconds", status='timed_out')
+        return not self.is_running
+
+    def chart_data(self, points=500, start=None, end=None, method='lttb', price_method='ohlc', tickers=None):
+        """Downsampled equity, P&L and price series for charts (see ChartSeries.chart)"""
+        with self.results_changed:
+            snapshot = self.chart.snapshot(start, end)
+        return self.chart.chart(points, start, end, method, price_method, tickers, snapshot)
+
+    def wait_for_results(self, cursor, timeout):
+        """Block until there are results past cursor or the run has finished"""
+        with self.results_changed:
+            self.results_changed.wait_for(lambda: len(self.results) > cursor or self.is_complete, timeout)
+            return self.results[cursor:]
+        
+    def run_simulation(self):
+        """Run the portfolio simulation"""
+        profiler = cProfile.Profile() if self.profile else None
+        with self.results_changed:
+            if self.cancelled:
+                return
+            self.thread = threading.current_thread()
+            self.is_running = True
+            self.status = 'running'
+        try:
+            if self.store is not None:
+                self.store.save_simulation(self)
+            if profiler is not None:
+                profiler.enable()
+            with self._stage('setup'):
+                port, data, times = self.setup()
+                start = self._resume(port)
+            
+            self._run_started = (time.perf_counter(), start)
+            with self._stage('run'):
+                if not self._stopped():  # may have been cancelled or timed out while the data loaded
+                    if self.engine == 'vectorized':
+                        self._run_vectorized(port, data, times, start)
+                    else:
+                        self._run_loop(port, data, times, start)
+            steps = len(self.results) - start
+            Metrics.count('simulation_steps_total', 'Simulation steps executed', steps, engine=self.engine)
+            if self.timings['run'] > 0:
+                Metrics.observe('simulation_steps_per_second', 'Step throughput of finished simulations',
+                                steps / self.timings['run'], RATE_BUCKETS, engine=self.engine)
+            stopped = self._stopped()
+            # a stopped loop run may have traded a step it never published; store the published steps only
+            self._persist(port if self.engine == 'loop' and not stopped else None, force=True)
+            
+            # Calculate final metrics (not for runs that were cancelled or timed out)
+            with self._stage('final_metrics'):
+                if self.results and not stopped:
+                    self.final_metrics = self.compute_final_metrics(port, self.results[0]['portfolio_value'], self.results[-1]['portfolio_value'])
+            
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            # stop profiling first so finish() can store the complete report
+            if profiler is not None:
+                profiler.disable()
+                self._profiler = profiler
+            self.finish()
+
+    @contextmanager
+    def _stage(self, name):
+        # wall time per stage, kept for profile_report() and exported as a histogram when metrics are on
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            Metrics.observe('simulation_stage_seconds', 'Time spent per simulation stage', elapsed, stage=name)
+
+    def steps_per_second(self):
+        """Step throughput of the engine so far (None before it starts)"""
+        if self._run_started is None:
+            return None
+        started, first_step = self._run_started
+        elapsed = self.timings['run'] if 'run' in self.timings else time.perf_counter() - started
+        return (len(self.results) - first_step) / elapsed if elapsed > 0 else None
+
+    def profile_report(self, top=25):
+        """Where the run spent its time: seconds per stage, step throughput and, for runs started
+        with profile=True, the top functions by cumulative time once the run has finished"""
+        if not self.timings and self.store is not None:
+            # reloaded from the store: the report saved when the run finished (None if it never ran)
+            stored = self.store.profile(self.simulation_id)
+            if stored is not None:
+                return SimulationStore.trim_profile(stored, top)
+        rate = self.steps_per_second()
+        report = {
+            'simulation_id': self.simulation_id,
+            'status': self.status,
+            'engine': self.engine,
+            'steps': len(self.results),
+            'total_steps': self.total_steps,
+            'stages': {stage: round(seconds, 6) for stage, seconds in self.timings.items()},
+            'steps_per_sec': round(rate, 1) if rate is not None else None,
+            'functions': None
+        }
+        if self._profiler is not None:
+            rows = sorted(pstats.Stats(self._profiler).stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+            report['functions'] = [{
+                'function': f"{os.path.basename(filename)}:{line}({name})",
+                'calls': calls,
+                'total_seconds': round(total, 6),
+                'cumulative_seconds': round(cumulative, 6)
+            } for (filename, line, name), (_, calls, total, cumulative, _) in rows]
+        return report
+
+    def _provider_spec(self):
+        # provider as get_provider() spec; a stored run has to come back with the same data source
+        if self.provider is None or isinstance(self.provider, str):
+            return self.provider
+        spec = self.provider.spec
+        if spec is None and self.store is not None:
+            raise ValueError(f"{type(self.provider).__name__} with these settings can't be rebuilt from the store; "
+                             "pass a provider spec string (e.g. 'synthetic:3') or run without a store")
+        return spec
+
+    def config(self):
+        """Constructor arguments as JSON-able data, stored so the simulation can be rebuilt after a restart"""
+        provider = self._provider_spec()
+        return {
+            'simulation_id': self.simulation_id,
+            'initial_cash': self.initial_cash,
+            'start_date': self.start_date,
+            'duration_days': self.duration_days,
+            'trading_frequency': self.trading_frequency,
+            'tickers': self.tickers,
+            'trading_rules': self.trading_rules,
+            'provider': provider,
+            'engine': self.engine,
+            'profile': self.profile,
+            'clock': {'mode': self.clock.mode, 'speed': self.clock.speed, 'step_delay': self.clock.step_delay}
+        }
+
+    @classmethod
+    def from_store(cls, store, record, checkpoint_every=50):
+        """Rebuild a simulation from its SimulationStore record.
+        Finished simulations serve their results from the store; unfinished ones resume from
+        their last checkpoint when run again."""
+        config = record['config']
+        sim = cls(config['simulation_id'], config['initial_cash'], config['start_date'], config['duration_days'],
+                  config['trading_frequency'], config['tickers'], config['trading_rules'], provider=config['provider'],
+                  engine=config['engine'], clock=SimulationClock(**config['clock']), store=store,
+                  checkpoint_every=checkpoint_every, profile=config.get('profile', False))
+        sim.total_steps = record['total_steps']
+        if record['status'] in FINISHED:
+            sim.status = record['status']
+            if record['error'] is not None:
+                sim.error = record['error']
+            if record['final_metrics'] is not None:
+                sim.final_metrics = record['final_metrics']
+            sim._load_steps(store.result_count(sim.simulation_id), records=False)
+            sim.is_complete = True
+            sim.finished_at = time.monotonic()
+        return sim
+
+    def _load_steps(self, steps, records=True):
+        # chart arrays for the first `steps` stored steps, plus their records when the run continues;
+        # a finished run leaves its records in the store (StoredResults reads them on access)
+        times, values, prices = self.store.result_rows(self.simulation_id, self.chart.tickers, steps)
+        chart = ChartSeries(self.chart.tickers, self.initial_cash)
+        chart.extend(times.view('datetime64[ns]'), values, prices)
+        with self.results_changed:
+            self.chart = chart
+            self.results = self.store.results(self.simulation_id, 0, steps) if records else StoredResults(self.store, self.simulation_id, steps)
+        self._stored_steps = steps
+
+    def _resume(self, port):
+        """Restore the steps (and, for the loop engine, the portfolio) of the last checkpoint.
+        Returns:
+            int: First step that still has to run"""
+        checkpoint = self.store.load_checkpoint(self.simulation_id) if self.store is not None else None
+        if checkpoint is None:
+            return 0
+        steps, state = checkpoint
+        if self.engine == 'loop':
+            if state is None:
+                return 0
+            SimulationStore.restore_portfolio(port, state)
+        self._load_steps(steps)
+        return steps
+
+    def _persist(self, port=None, force=False):
+        """Checkpoint the results published since the last checkpoint, every checkpoint_every steps
+        (or now, if forced), together with the portfolio when given"""
+        if self.store is None:
+            return
+        steps = len(self.results)
+        if steps - self._stored_steps < (1 if force else self.checkpoint_every):
+            return
+        with self._stage('checkpoint'):
+            self.store.checkpoint(self, self._stored_steps, steps, port)
+        self._stored_steps = steps
+
+    def setup(self):
+        """Build the starting portfolio (after the initial purchases) and load the price data.
+        Returns:
+            tuple: (portfolio, {ticker: StockData}, step timestamps)"""
+        # Initialize portfolio and stock data
+        currtime = datetime.strptime(self.start_date, '%Y-%m-%d')
+        start_date_str = currtime.strftime('%Y-%m-%d')
+        end_date_str = (currtime + relativedelta(months=2)).strftime('%Y-%m-%d')
+        
+        port = Portfolio(self.initial_cash, start_date_str, end_date_str, provider=self.provider)
+        
+        port.preload(self.tickers.keys())
+        
+        # Initial purchases
+        for ticker, shares in self.tickers.items():
+            port.buy(ticker, 500, shares, currtime)  # High price limit to ensure purchase
+        
+        # Initialize stock data with appropriate interval (one batched load for all tickers)
+        interval = '30m' if self.trading_frequency == 'intraday' else '1d'
+        data = StockData.load_many(self.tickers.keys(), start_date_str, end_date_str, interval, provider=self.provider)
+        if self.trading_frequency == 'intraday':
+            # mark the portfolio on the same 30-minute bars the rules see (daily bars never line up with them)
+            port.add_price_data(data)
+        
+        # Step over the bars that actually exist (no weekends, holidays or off-hours)
+        times = SimulationClock.calendar(data, currtime, currtime + timedelta(days=self.duration_days))
+        self.total_steps = len(times)
+        
+        return port, data, times
+
+    def compute_final_metrics(self, port, initial_value, final_value):
+        """Summary metrics reported when a run finishes"""
+        total_return = (final_value - initial_value) / initial_value * 100 if initial_value > 0 else 0
+        
+        sharpe_ratio = port.calculate_sharpe_ratio()
+        volatility = port.calculate_volatility()
+        
+        return {
+            'total_return_pct': round(total_return, 2),
+            'final_value': round(final_value, 2),
+            'total_pnl': round(final_value - self.initial_cash, 2),
+            'sharpe_ratio': round(sharpe_ratio, 3) if sharpe_ratio else None,
+            'volatility_pct': round(volatility * 100, 2) if volatility else None,
+            'total_trades': len(port.past_trades),
+            'final_positions': port.positions
+        }
+
+    def _interval_labels(self, times):
+        if self.trading_frequency != 'intraday':
+            return [f"Interval {i + 1}" for i in range(len(times))]
+        labels = []
+        day_num = 0
+        last_date = None
+        for t in times:
+            if t.date() != last_date:
+                day_num += 1
+                interval_in_day = 0
+                last_date = t.date()
+            interval_in_day += 1
+            labels.append(f"Day {day_num}, Interval {interval_in_day}")
+        return labels
+
+    def _format_date(self, currtime):
+        return currtime.strftime('%Y-%m-%d %H:%M') if self.trading_frequency == 'intraday' else currtime.strftime('%Y-%m-%d')
+
+    def price_panel(self, port, data, times):
+        """Step timestamps plus the aligned step x ticker price matrices the vectorized engine runs on.
+        Rules see the simulation's bars; fills and marks use the portfolio's own price history."""
+        tickers = list(self.tickers.keys())
+        prices = Backtester.price_matrix({ticker: data[ticker].stock_data for ticker in tickers}, times, tickers)
+        value_prices = Backtester.price_matrix({ticker: port._stock_data(ticker).stock_data for ticker in tickers}, times, tickers)
+        return times, prices, value_prices
+
+    def _run_vectorized(self, port, data, times, start=0):
+        """Evaluate the whole run at once over aligned price matrices (see Backtester).
+        Steps before start were restored from a checkpoint; they are recomputed but not published again."""
+        times, prices, value_prices = self.price_panel(port, data, times)
+        engine = Backtester(list(self.tickers.keys()), self.trading_rules)
+        engine.prepare(times, data, prices)
+        run = engine.run(times, prices, value_prices, port)
+        if self._stopped():
+            return
+        records = engine.results(times, prices, run, port.original_value,
+                                 self._interval_labels(times),
+                                 [self._format_date(t) for t in times])
+        if not self.clock.paced:
+            self.publish(records[start:], times[start:], prices[start:])
+            return
+        # paced replay: release the precomputed steps on the clock's schedule
+        for i in range(start, len(times)):
+            if not self.clock.tick(times[i]) or self._stopped():
+                break
+            if not self.publish([records[i]], [times[i]], prices[i]):
+                break
+            self._persist()
+
+    def _run_loop(self, port, data, times, start=0):
+        """Step-by-step reference implementation of the simulation loop (from step start when resuming)"""
+        labels = self._interval_labels(times)
+        tickers = list(self.tickers.keys())
+        # rules are compiled once; each step evaluates all of them against the current price vector
+        rules = RuleCompiler(tickers, self.trading_rules)
+        if rules.needs_features:
+            rules.prepare(times, data, Backtester.price_matrix({ticker: data[ticker].stock_data for ticker in tickers}, times, tickers))
+        if start:
+            # crossing conditions compare against the step before the resume point
+            previous = [data[ticker].get_price(times[start - 1]) for ticker in tickers]
+            rules.evaluate(start - 1, np.array([np.nan if price is None else price for price in previous]))
+        for i in range(start, len(times)):
+            currtime = times[i]
+            if self._stopped():  # Check if simulation was stopped or timed out
+                break
+                
+            # Move to the next bar
+            if not self.clock.tick(currtime):
+                break
+            
+            # Update current time for all stock data objects
+            for ticker in tickers:
+                data[ticker].curtime = currtime
+            
+            # Get current prices
+            current_prices = {}
+            for ticker in tickers:
+                price = data[ticker].get_price()
+                if price is not None:
+                    current_prices[ticker] = price
+            
+            # Check trading conditions and execute trades
+            trades_executed = []
+            price_row = np.array([current_prices.get(ticker, np.nan) for ticker in tickers])
+            
+            for r in rules.evaluate(i, price_row):
+                j, ticker, action, condition, threshold, shares = rules.rules[r]
+                price = current_prices[ticker]
+                if action == 'sell':
+                    if port.positions.get(ticker, 0) >= shares:
+                        port.sell(ticker, price, shares, currtime)
+                        trades_executed.append(f"Sold {shares} {ticker} @ ${price:.2f}")
+                else:
+                    # Check if we have enough cash to buy
+                    if port.cash >= price * shares:
+                        port.buy(ticker, price + 1, shares, currtime)  # Add small buffer to ensure purchase
+                        trades_executed.append(f"Bought {shares} {ticker} @ ${price:.2f}")
+            
+            # Get current portfolio value
+            current_value = port.get_value(currtime)
+            
+            # Store interval result
+            daily_result = {
+                'day': i + 1,
+                'interval_label': labels[i],
+                'date': self._format_date(currtime),
+                'prices': current_prices.copy(),
+                'portfolio_value': current_value,
+                'trades': trades_executed.copy(),
+                'positions': port.positions.copy(),
+                'cash': port.cash,
+                'pnl': port.get_PNL(currtime)
+            }
+            if not self.publish([daily_result], [currtime], price_row):
+                break
+            self._persist(port)
@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import deque
+
+'''Bounded worker pool and job queue for simulations started through the Flask app'''
+
+class SchedulerFull(Exception):
+    """Raised by submit() when the queue is at capacity (the app answers 429)."""
+    pass
+
+
+class SimulationScheduler:
+    def __init__(self, max_workers=4, max_queue=32, job_timeout=600, result_ttl=3600, sweep_interval=5.0):
+        """Run simulations on a fixed set of worker threads.
+        Args:
+            max_workers: Simulations that may run at the same time
+            max_queue: Simulations allowed to wait for a worker before submit() refuses new ones
+            job_timeout: Seconds a simulation may run before it is stopped (None = no limit)
+            result_ttl: Seconds a finished simulation is kept before it is evicted (None = keep)
+            sweep_interval: Seconds between timeout/eviction checks"""
+
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.result_ttl = result_ttl
+        self.sweep_interval = sweep_interval
+        self.simulations = {}  # {simulation_id: SimulationManager}, queued, running and finished
+        self._queue = deque()  # simulation ids waiting for a worker
+        self._running = {}  # {simulation_id: SimulationManager} whose worker thread has not returned yet
+        self._lock = threading.Condition()
+        self._threads = []
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.evicted = 0
+
+    def _start(self):
+        # workers start on first submit so importing the app does not spawn threads
+        if self._threads:
+            return
+        for n in range(self.max_workers):
+            thread = threading.Thread(target=self._work, name=f'simulation-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        sweeper = threading.Thread(target=self._sweep, name='simulation-sweeper', daemon=True)
+        sweeper.start()
+        self._threads.append(sweeper)
+
+    def submit(self, simulation):
+        """Queue a simulation.
+        Returns:
+            int: Queue position (1 = next to start)"""
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerFull(f"Simulation queue is full ({self.max_queue} waiting)")
+            self._start()
+            simulation.status = 'queued'
+            self.simulations[simulation.simulation_id] = simulation
+            self._queue.append(simulation.simulation_id)
+            self._lock.notify()
+            return len(self._queue)
+
+    def add(self, simulation):
+        """Track a simulation that is already finished (e.g. reloaded from a SimulationStore),
+        so it is served and evicted like the ones run here."""
+        with self._lock:
+            return self.simulations.setdefault(simulation.simulation_id, simulation)
+
+    def get(self, simulation_id):
+        with self._lock:
+            return self.simulations.get(simulation_id)
+
+    def active(self):
+        """Simulations that are queued or running."""
+        with self._lock:
+            return [simulation for simulation in self.simulations.values() if not simulation.is_complete]
+
+    def __contains__(self, simulation_id):
+        with self._lock:
+            return simulation_id in self.simulations
+
+    def queue_position(self, simulation_id):
+        """1-based position in the queue, or None once the simulation has left it."""
+        with self._lock:
+            try:
+                return self._queue.index(simulation_id) + 1
+            except ValueError:
+                return None
+
+    def cancel(self, simulation_id):
+        """Stop a simulation. A queued one never starts; a running one stops at its next step.
+        Returns:
+            bool: False if the simulation is unknown"""
+        with self._lock:
+            simulation = self.simulations.get(simulation_id)
+            if simulation is None:
+                return False
+            if simulation_id in self._queue:
+                self._queue.remove(simulation_id)
+        simulation.cancel()
+        return True
+
+    def remove(self, simulation_id):
+        """Cancel (if needed) and forget a simulation.
+        Returns:
+            bool: False if the simulation is unknown"""
+        if not self.cancel(simulation_id):
+            return False
+        with self._lock:
+            self.simulations.pop(simulation_id, None)
+        return True
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self._queue)
+                simulation_id = self._queue.popleft()
+                simulation = self.simulations.get(simulation_id)
+                if simulation is None:
+                    continue
+                self._running[simulation_id] = simulation
+            if self.job_timeout:
+                simulation.timeout = self.job_timeout
+                simulation.deadline = time.monotonic() + self.job_timeout
+            try:
+                simulation.run_simulation()
+            finally:
+                # the slot stays busy until the thread is back, even if the run was stopped long before
+                with self._lock:
+                    self._running.pop(simulation_id, None)
+                    self.completed += 1
+                    if simulation.status == 'timed_out':
+                        self.timed_out += 1
+
+    def _sweep(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            self.enforce_limits()
+
+    def enforce_limits(self, now=None):
+        """Stop simulations past their deadline and evict finished ones older than result_ttl.
+        A stopped simulation keeps its worker until its thread returns (see stats()['overrunning'])."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            simulations = list(self.simulations.items())
+        expired = []
+        for simulation_id, simulation in simulations:
+            deadline = getattr(simulation, 'deadline', None)
+            if not simulation.is_complete and deadline is not None and now > deadline:
+                simulation.cancel(f"Simulation timed out after {self.job_timeout} seconds", status='timed_out')
+            finished_at = getattr(simulation, 'finished_at', None)
+            if self.result_ttl is not None and finished_at is not None and now - finished_at > self.result_ttl:
+                expired.append(simulation_id)
+        with self._lock:
+            for simulation_id in expired:
+                if self.simulations.pop(simulation_id, None) is not None:
+                    self.evicted += 1
+
+    def stats(self):
+        """Pool occupancy and counters. 'running' counts every busy worker; 'overrunning' those whose
+        simulation was cancelled or timed out but is still inside a step or a download."""
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'running': len(self._running),
+                'overrunning': sum(simulation.status in ('cancelled', 'timed_out') for simulation in self._running.values()),
+                'queued': len(self._queue),
+                'max_queue': self.max_queue,
+                'simulations': len(self.simulations),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'evicted': self.evicted
+            }
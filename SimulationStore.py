@@ -0,0 +1,467 @@
+import io
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+import numpy as np
+from ChartSeries import ChartSeries
+
+'''Durable simulation state in SQLite: configuration, status, per-step results and checkpoints for resume.
+Also the shared queue/registry when simulations run in SimulationWorker processes (see app.py)'''
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS simulations (
+    id TEXT PRIMARY KEY,
+    config TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    total_steps INTEGER,
+    final_metrics TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    simulation_id TEXT NOT NULL,
+    step INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    value REAL NOT NULL,
+    prices BLOB NOT NULL,
+    PRIMARY KEY (simulation_id, step)
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    simulation_id TEXT PRIMARY KEY,
+    steps INTEGER NOT NULL,
+    state TEXT,
+    arrays BLOB,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS portfolio_rows (
+    simulation_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    arrays BLOB NOT NULL,
+    PRIMARY KEY (simulation_id, kind, start)
+);
+"""
+
+# checkpointed portfolio arrays, stored in chunks of the rows added since the previous checkpoint
+PORTFOLIO_COLUMNS = {
+    'trades': {'action': np.int8, 'ticker': np.int32, 'price': np.float64, 'shares': np.int64, 'trade_time': np.int64},
+    'curve': {'curve_time': np.int64, 'curve_value': np.float64}
+}
+
+# columns added after the first version of the schema: (name, declaration)
+MIGRATIONS = (
+    ('owner', 'TEXT'),  # worker that claimed the simulation
+    ('heartbeat', 'REAL'),  # last time that worker reported it alive
+    ('cancel_requested', 'INTEGER NOT NULL DEFAULT 0'),
+    ('profile', 'TEXT')  # SimulationManager.profile_report() of the finished run
+)
+
+FINISHED = ('completed', 'failed', 'cancelled', 'timed_out')
+CHART_CACHE_SIZE = 32  # simulations whose decoded chart series a process keeps
+
+
+class StoredResults(Sequence):
+    def __init__(self, store, simulation_id, count):
+        """Read-only list of a finished simulation's step records, fetched from the store on access.
+        Args:
+            store: SimulationStore holding the records
+            simulation_id: Simulation the records belong to
+            count: Number of stored steps"""
+
+        self._store = store
+        self._id = simulation_id
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, stride = index.indices(self._count)
+            records = self._store.results(self._id, start, stop) if stop > start else []
+            return records[::stride] if stride != 1 else records
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('result index out of range')
+        return self._store.results(self._id, index, index + 1)[0]
+
+    def __repr__(self):
+        return f"StoredResults({self._count} steps of {self._id})"
+
+
+class StoredSimulation:
+    poll_interval = 0.25  # seconds between store reads while waiting for results
+
+    def __init__(self, store, record):
+        """Read-only view of a simulation in the store, for web processes that do not run it.
+        Offers the attributes app.py reads from a SimulationManager (status, results, final_metrics, ...).
+        Args:
+            store: SimulationStore
+            record: Row from SimulationStore.simulation()"""
+
+        self.store = store
+        self.simulation_id = record['id']
+        self.tickers = list(record['config']['tickers'])
+        self.initial_cash = record['config']['initial_cash']
+        self.engine = record['config']['engine']
+        self._update(record)
+
+    def _update(self, record):
+        self.status = record['status']
+        self.total_steps = record['total_steps']
+        self.is_complete = self.status in FINISHED
+        self.is_running = self.status == 'running'
+        if record['error'] is not None:
+            self.error = record['error']
+        if record['final_metrics'] is not None:
+            self.final_metrics = record['final_metrics']
+        self.results = StoredResults(self.store, self.simulation_id, self.store.result_count(self.simulation_id))
+
+    def refresh(self):
+        """Re-read status and result count (False if the simulation was deleted)."""
+        record = self.store.simulation(self.simulation_id)
+        if record is None:
+            return False
+        self._update(record)
+        return True
+
+    @property
+    def chart(self):
+        # a new view is made per request, so the decoded series lives in the store's cache
+        return self.store.chart(self.simulation_id, self.tickers, self.initial_cash, len(self.results))
+
+    def chart_data(self, points=500, start=None, end=None, method='lttb', price_method='ohlc', tickers=None):
+        return self.chart.chart(points, start, end, method, price_method, tickers)
+
+    def profile_report(self, top=25):
+        """Report the worker stored when the run finished (see SimulationManager.profile_report);
+        status and step count only while it is still queued or running."""
+        report = self.store.profile(self.simulation_id)
+        if report is not None:
+            return SimulationStore.trim_profile(report, top)
+        return {'simulation_id': self.simulation_id, 'status': self.status, 'engine': self.engine,
+                'steps': len(self.results), 'total_steps': self.total_steps, 'stages': {},
+                'steps_per_sec': None, 'functions': None}
+
+    def wait_for_results(self, cursor, timeout):
+        """Poll the store until there are results past cursor, the run has finished or timeout passes"""
+        deadline = time.monotonic() + timeout
+        while len(self.results) <= cursor and not self.is_complete and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            if not self.refresh():
+                break
+        return self.results[cursor:]
+
+
+class SimulationStore:
+    def __init__(self, path):
+        """SQLite-backed store for simulations (one connection per thread, WAL so readers don't block the writer).
+        Args:
+            path: Database file (created if missing)"""
+
+        self.path = path
+        self._local = threading.local()
+        self._charts = OrderedDict()  # {simulation_id: ChartSeries}, least recently used first
+        self._charts_lock = threading.Lock()
+        db = self._db()
+        db.executescript(SCHEMA)
+        existing = {row[1] for row in db.execute("PRAGMA table_info(simulations)")}
+        for name, declaration in MIGRATIONS:
+            if name not in existing:
+                db.execute(f"ALTER TABLE simulations ADD COLUMN {name} {declaration}")
+        db.commit()
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def save_simulation(self, sim):
+        """Insert or update a simulation's configuration and status."""
+        with self._db() as db:
+            self._save_simulation(db, sim)
+
+    def enqueue(self, sim, max_queue):
+        """Save a 'queued' simulation unless max_queue simulations are already waiting. The count and the
+        insert share one write transaction, so concurrent web processes cannot overfill the queue.
+        Returns:
+            bool: False if the queue was full (nothing saved)"""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if db.execute("SELECT COUNT(*) FROM simulations WHERE status = 'queued'").fetchone()[0] >= max_queue:
+                db.rollback()
+                return False
+            self._save_simulation(db, sim)
+        except BaseException:
+            db.rollback()
+            raise
+        db.commit()
+        return True
+
+    @staticmethod
+    def _save_simulation(db, sim):
+        now = time.time()
+        db.execute("INSERT INTO simulations (id, config, status, error, total_steps, final_metrics, created_at, updated_at) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET status = excluded.status, "
+                       "error = excluded.error, total_steps = excluded.total_steps, final_metrics = excluded.final_metrics, "
+                       "updated_at = excluded.updated_at",
+                       (sim.simulation_id, json.dumps(sim.config()), sim.status, getattr(sim, 'error', None), sim.total_steps,
+                        json.dumps(getattr(sim, 'final_metrics', None), default=str), now, now))
+
+    def checkpoint(self, sim, start, stop, port=None):
+        """Write steps [start, stop) of sim's results and, in the same transaction, the resume point.
+        Args:
+            sim: SimulationManager whose results/chart hold the steps
+            start, stop: Step range not yet stored
+            port: Portfolio after step stop - 1 (loop engine), or None when the run is replayed from the data"""
+        times, values, prices = sim.chart.rows(start, stop)
+        rows = [(sim.simulation_id, step, json.dumps(record, default=str), int(t), float(v), p.tobytes())
+                for step, record, t, v, p in zip(range(start, stop), sim.results[start:stop], times, values, prices)]
+        with self._db() as db:
+            db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", rows)
+            state = self._save_portfolio(db, sim.simulation_id, port) if port is not None else None
+            db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                       (sim.simulation_id, stop, state, None, time.time()))
+            db.execute("UPDATE simulations SET status = ?, total_steps = ?, updated_at = ? WHERE id = ?",
+                       (sim.status, sim.total_steps, time.time(), sim.simulation_id))
+
+    @staticmethod
+    def _save_portfolio(db, simulation_id, port):
+        # the trade ledger and equity curve only grow while a simulation runs, so each checkpoint
+        # writes just the rows added since the previous one (tracked by the counts in its state)
+        ledger, curve = port.past_trades, port.change_over_time
+        row = db.execute("SELECT state FROM checkpoints WHERE simulation_id = ?", (simulation_id,)).fetchone()
+        previous = json.loads(row[0]) if row is not None and row[0] is not None else {}
+        columns = {
+            'trades': lambda lo, hi: {'action': ledger.action_codes[lo:hi], 'ticker': ledger.ticker_codes[lo:hi],
+                                      'price': ledger.prices[lo:hi], 'shares': ledger.shares[lo:hi],
+                                      'trade_time': ledger.timestamps[lo:hi].view('int64')},
+            'curve': lambda lo, hi: {'curve_time': curve.timestamps[lo:hi].view('int64'),
+                                     'curve_value': curve.portfolio_values[lo:hi]}
+        }
+        counts = {'trades': len(ledger), 'curve': len(curve)}
+        for kind, count in counts.items():
+            start = previous.get(kind, 0)
+            if start > count:  # rows were removed since (e.g. a restart from an older checkpoint): rewrite them all
+                start = 0
+            db.execute("DELETE FROM portfolio_rows WHERE simulation_id = ? AND kind = ? AND start >= ?",
+                       (simulation_id, kind, start))
+            if count > start:
+                buffer = io.BytesIO()
+                np.savez(buffer, **columns[kind](start, count))
+                db.execute("INSERT INTO portfolio_rows VALUES (?, ?, ?, ?)", (simulation_id, kind, start, buffer.getvalue()))
+        return json.dumps({'cash': port.cash, 'positions': port.positions, 'original_value': port.original_value,
+                           'tickers': ledger.tickers, 'trades': counts['trades'], 'curve': counts['curve']})
+
+    def load_checkpoint(self, simulation_id):
+        """(steps stored, portfolio state dict or None), or None if the simulation has no checkpoint."""
+        row = self._db().execute("SELECT steps, state, arrays FROM checkpoints WHERE simulation_id = ?",
+                                 (simulation_id,)).fetchone()
+        if row is None:
+            return None
+        steps, state, arrays = row
+        if state is None:
+            return steps, None
+        state = json.loads(state)
+        if arrays is not None:
+            # checkpoint written before portfolio rows were stored incrementally
+            with np.load(io.BytesIO(arrays), allow_pickle=False) as npz:
+                state.update({name: npz[name] for name in npz.files})
+            return steps, state
+        for kind, dtypes in PORTFOLIO_COLUMNS.items():
+            chunks = []
+            for blob, in self._db().execute("SELECT arrays FROM portfolio_rows WHERE simulation_id = ? AND kind = ? "
+                                            "AND start < ? ORDER BY start", (simulation_id, kind, state[kind])):
+                with np.load(io.BytesIO(blob), allow_pickle=False) as npz:
+                    chunks.append({name: npz[name] for name in npz.files})
+            for name, dtype in dtypes.items():
+                state[name] = np.concatenate([chunk[name] for chunk in chunks]) if chunks else np.empty(0, dtype=dtype)
+        return steps, state
+
+    @staticmethod
+    def restore_portfolio(port, state):
+        """Put a checkpointed state (cash, positions, ledger, equity curve) back into port."""
+        port.original_value = state['original_value']
+        port.past_trades = port.past_trades.__class__()
+        port.change_over_time = port.change_over_time.__class__()
+        fills = ([port.past_trades.actions[action] for action in state['action'].tolist()],
+                 [state['tickers'][code] for code in state['ticker'].tolist()],
+                 state['price'], state['shares'], state['trade_time'].view('datetime64[ns]'))
+        port.apply_fills(fills, state['positions'], state['cash'],
+                         state['curve_time'].view('datetime64[ns]'), state['curve_value'])
+
+    def save_profile(self, simulation_id, report):
+        with self._db() as db:
+            db.execute("UPDATE simulations SET profile = ? WHERE id = ?", (json.dumps(report), simulation_id))
+
+    def profile(self, simulation_id):
+        """Stored profile report of a finished simulation, or None."""
+        row = self._db().execute("SELECT profile FROM simulations WHERE id = ?", (simulation_id,)).fetchone()
+        return json.loads(row[0]) if row is not None and row[0] is not None else None
+
+    @staticmethod
+    def trim_profile(report, top):
+        if report.get('functions') is not None:
+            report = dict(report, functions=report['functions'][:top])
+        return report
+
+    def results(self, simulation_id, start=0, stop=None):
+        """Stored step records [start, stop) in step order."""
+        rows = self._db().execute("SELECT record FROM results WHERE simulation_id = ? AND step >= ? AND step < ? ORDER BY step",
+                                  (simulation_id, start, stop if stop is not None else 2**62)).fetchall()
+        return [json.loads(record) for record, in rows]
+
+    def result_rows(self, simulation_id, tickers, stop=None, start=0):
+        """(timestamps ns, values, step x ticker prices) of the stored steps [start, stop), for rebuilding charts."""
+        rows = self._db().execute("SELECT timestamp, value, prices FROM results WHERE simulation_id = ? AND step >= ? AND step < ? "
+                                  "ORDER BY step", (simulation_id, start, stop if stop is not None else 2**62)).fetchall()
+        times = np.array([row[0] for row in rows], dtype=np.int64)
+        values = np.array([row[1] for row in rows], dtype=np.float64)
+        prices = np.frombuffer(b''.join(row[2] for row in rows), dtype=np.float64).reshape(len(rows), len(tickers))
+        return times, values, prices
+
+    def chart(self, simulation_id, tickers, initial_cash, steps):
+        """ChartSeries of the first `steps` stored steps of a simulation. Kept per process and only extended with
+        the rows stored since the last call, so chart polls do not decode the whole run each time."""
+        with self._charts_lock:
+            chart = self._charts.get(simulation_id)
+            if chart is None:
+                chart = self._charts[simulation_id] = ChartSeries(tickers, initial_cash)
+                while len(self._charts) > CHART_CACHE_SIZE:
+                    self._charts.popitem(last=False)
+            self._charts.move_to_end(simulation_id)
+            if len(chart) < steps:
+                times, values, prices = self.result_rows(simulation_id, tickers, steps, len(chart))
+                chart.extend(times.view('datetime64[ns]'), values, prices)
+        return chart
+
+    def simulation(self, simulation_id):
+        """Stored simulation as a dict (config and final_metrics decoded), or None."""
+        row = self._db().execute("SELECT id, config, status, error, total_steps, final_metrics, created_at, updated_at "
+                                 "FROM simulations WHERE id = ?", (simulation_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def simulations(self, statuses=None):
+        """All stored simulations (optionally only those with one of the given statuses), oldest first."""
+        query = "SELECT id, config, status, error, total_steps, final_metrics, created_at, updated_at FROM simulations"
+        params = ()
+        if statuses:
+            query += f" WHERE status IN ({', '.join('?' * len(statuses))})"
+            params = tuple(statuses)
+        return [self._row(row) for row in self._db().execute(query + " ORDER BY created_at", params)]
+
+    @staticmethod
+    def _row(row):
+        keys = ('id', 'config', 'status', 'error', 'total_steps', 'final_metrics', 'created_at', 'updated_at')
+        record = dict(zip(keys, row))
+        record['config'] = json.loads(record['config'])
+        record['final_metrics'] = json.loads(record['final_metrics']) if record['final_metrics'] else None
+        return record
+
+    def result_count(self, simulation_id):
+        return self._db().execute("SELECT COUNT(*) FROM results WHERE simulation_id = ?", (simulation_id,)).fetchone()[0]
+
+    def delete(self, simulation_id):
+        """Remove a simulation and everything stored for it.
+        Returns:
+            bool: True if it existed"""
+        with self._db() as db:
+            deleted = db.execute("DELETE FROM simulations WHERE id = ?", (simulation_id,)).rowcount
+            db.execute("DELETE FROM results WHERE simulation_id = ?", (simulation_id,))
+            db.execute("DELETE FROM checkpoints WHERE simulation_id = ?", (simulation_id,))
+            db.execute("DELETE FROM portfolio_rows WHERE simulation_id = ?", (simulation_id,))
+        with self._charts_lock:
+            self._charts.pop(simulation_id, None)
+        return deleted > 0
+
+    # shared queue for SimulationWorker processes
+
+    def count(self, statuses):
+        return self._db().execute(f"SELECT COUNT(*) FROM simulations WHERE status IN ({', '.join('?' * len(statuses))})",
+                                  tuple(statuses)).fetchone()[0]
+
+    def queue_position(self, simulation_id):
+        """1-based position among queued simulations, or None if it is not queued."""
+        row = self._db().execute("SELECT created_at FROM simulations WHERE id = ? AND status = 'queued'",
+                                 (simulation_id,)).fetchone()
+        if row is None:
+            return None
+        return self._db().execute("SELECT COUNT(*) FROM simulations WHERE status = 'queued' AND created_at <= ?",
+                                  row).fetchone()[0]
+
+    def claim(self, worker_id):
+        """Take the oldest queued simulation for a worker.
+        Returns:
+            dict: Its record (now 'running' and owned by worker_id), or None if the queue is empty"""
+        db = self._db()
+        while True:
+            row = db.execute("SELECT id FROM simulations WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            with db:
+                # another worker may have taken it between the two statements
+                claimed = db.execute("UPDATE simulations SET status = 'running', owner = ?, heartbeat = ? "
+                                     "WHERE id = ? AND status = 'queued'", (worker_id, time.time(), row[0])).rowcount
+            if claimed:
+                return self.simulation(row[0])
+
+    def heartbeat(self, worker_id, simulation_ids):
+        """Mark a worker's simulations as still being worked on."""
+        if not simulation_ids:
+            return
+        with self._db() as db:
+            db.execute(f"UPDATE simulations SET heartbeat = ? WHERE owner = ? AND id IN ({', '.join('?' * len(simulation_ids))})",
+                       (time.time(), worker_id) + tuple(simulation_ids))
+
+    def requeue_stale(self, stale_after):
+        """Put back running simulations whose worker stopped sending heartbeats (they resume from their
+        last checkpoint on the next worker), or mark them cancelled if a cancel was requested.
+        Returns:
+            int: Simulations requeued or cancelled"""
+        cutoff = time.time() - stale_after
+        with self._db() as db:
+            cancelled = db.execute("UPDATE simulations SET status = 'cancelled', owner = NULL, updated_at = ? "
+                                   "WHERE status = 'running' AND heartbeat < ? AND cancel_requested = 1",
+                                   (time.time(), cutoff)).rowcount
+            requeued = db.execute("UPDATE simulations SET status = 'queued', owner = NULL, updated_at = ? "
+                                  "WHERE status = 'running' AND heartbeat < ?", (time.time(), cutoff)).rowcount
+        return cancelled + requeued
+
+    def request_cancel(self, simulation_id):
+        """Cancel a simulation: queued ones are cancelled right away, running ones by their worker.
+        Returns:
+            bool: False if the simulation is unknown"""
+        with self._db() as db:
+            found = db.execute("UPDATE simulations SET cancel_requested = 1 WHERE id = ?", (simulation_id,)).rowcount
+            db.execute("UPDATE simulations SET status = 'cancelled', updated_at = ? WHERE id = ? AND status IN ('created', 'queued')",
+                       (time.time(), simulation_id))
+        return found > 0
+
+    def cancel_requests(self, simulation_ids):
+        """Which of the given simulations should stop.
+        Returns:
+            dict: {simulation_id: True if it was deleted, False if only cancelled}"""
+        if not simulation_ids:
+            return {}
+        rows = dict(self._db().execute(f"SELECT id, cancel_requested FROM simulations WHERE id IN ({', '.join('?' * len(simulation_ids))})",
+                                       tuple(simulation_ids)).fetchall())
+        return {simulation_id: simulation_id not in rows for simulation_id in simulation_ids
+                if simulation_id not in rows or rows[simulation_id]}
+
+    def stats(self):
+        """Simulation counts by status."""
+        counts = dict(self._db().execute("SELECT status, COUNT(*) FROM simulations GROUP BY status").fetchall())
+        workers = self._db().execute("SELECT COUNT(DISTINCT owner) FROM simulations WHERE status = 'running'").fetchone()[0]
+        return {'queued': counts.get('queued', 0), 'running': counts.get('running', 0), 'active_workers': workers,
+                'by_status': counts, 'simulations': sum(counts.values())}
@@ -0,0 +1,131 @@
+import argparse
+import os
+import socket
+import threading
+import Metrics
+from SimulationManager import SimulationManager
+from SimulationScheduler import SimulationScheduler
+from SimulationStore import SimulationStore
+
+'''Runs simulations queued in a SimulationStore, in a process separate from the web tier
+
+    python SimulationWorker.py simulations.db --workers 4
+'''
+
+class SimulationWorker:
+    def __init__(self, store, max_workers=4, poll_interval=0.5, job_timeout=600, stale_after=30, checkpoint_every=10):
+        """Claims queued simulations from a shared store and runs them on a local SimulationScheduler.
+        Any number of worker processes (on any host that can reach the database file) may share one store.
+        Args:
+            store: SimulationStore (or path to one) the web processes queue simulations in
+            max_workers: Simulations this worker runs at the same time
+            poll_interval: Seconds between queue polls / heartbeats
+            job_timeout: Seconds a simulation may run before it is stopped (None = no limit)
+            stale_after: Seconds without a heartbeat after which another worker's simulations are requeued
+            checkpoint_every: Steps between checkpoints (how often web processes see new results)"""
+
+        self.store = store if isinstance(store, SimulationStore) else SimulationStore(store)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.checkpoint_every = checkpoint_every
+        # finished simulations are served from the store, so they are dropped right away
+        self.scheduler = SimulationScheduler(max_workers, max_queue=max_workers, job_timeout=job_timeout,
+                                             result_ttl=0, sweep_interval=poll_interval)
+        self._deleted = set()  # simulations deleted while running here; removed again once they stop
+        self._stop = threading.Event()
+        self._metrics_server = None
+
+    def collect_metrics(self):
+        """Samples for this worker's /metrics (the web tier only sees the shared queue)"""
+        stats = self.scheduler.stats()
+        worker = {'worker': self.worker_id}
+        samples = [
+            ('simulation_worker_slots', 'gauge', 'Simulations this worker runs at the same time', worker, self.max_workers),
+            ('simulations_running', 'gauge', 'Simulations being run', worker, stats['running']),
+            ('simulations_overrunning', 'gauge', 'Stopped simulations still holding a worker', worker, stats['overrunning']),
+            ('simulations_completed_total', 'counter', 'Simulations finished by this process', worker, stats['completed']),
+            ('simulations_timed_out_total', 'counter', 'Simulations stopped at the time limit', worker, stats['timed_out'])
+        ]
+        for simulation in self.scheduler.active():
+            rate = simulation.steps_per_second()
+            if rate is not None:
+                samples.append(('simulation_running_steps_per_second', 'gauge', 'Step throughput of running simulations',
+                                dict(worker, simulation_id=simulation.simulation_id), rate))
+        return samples
+
+    def serve_metrics(self, port, host=''):
+        """Expose collect_metrics() and the engines' hot-path histograms at http://host:port/metrics."""
+        Metrics.registry.add_collector(self.collect_metrics)
+        self._metrics_server = Metrics.serve(port, host)
+
+    def run_once(self):
+        """One poll: heartbeat, apply cancellations, requeue dead workers' runs and claim new ones.
+        Returns:
+            int: Simulations claimed"""
+        active = self.scheduler.active()
+        self.store.heartbeat(self.worker_id, [sim.simulation_id for sim in active])
+        for simulation_id, deleted in self.store.cancel_requests([sim.simulation_id for sim in active]).items():
+            if deleted:
+                self._deleted.add(simulation_id)
+            self.scheduler.cancel(simulation_id)
+        for simulation_id in list(self._deleted):
+            simulation = self.scheduler.get(simulation_id)
+            if simulation is None or simulation.is_complete:
+                # finishing saved it again; remove what the web tier already deleted
+                self.store.delete(simulation_id)
+                self._deleted.discard(simulation_id)
+        self.store.requeue_stale(self.stale_after)
+
+        claimed = 0
+        while len(active) + claimed < self.max_workers:
+            record = self.store.claim(self.worker_id)
+            if record is None:
+                break
+            simulation = SimulationManager.from_store(self.store, record, self.checkpoint_every)
+            self.scheduler.submit(simulation)
+            claimed += 1
+        return claimed
+
+    def run(self):
+        """Poll until stop() is called."""
+        print(f"Simulation worker {self.worker_id}: {self.max_workers} slots on {self.store.path}")
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Simulation worker {self.worker_id}: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run simulations queued by app.py (SIMULATION_EXECUTOR=store)")
+    parser.add_argument('store', nargs='?', default=os.environ.get('SIMULATION_STORE'),
+                        help="SQLite database shared with the web processes (default: $SIMULATION_STORE)")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SIMULATION_WORKERS', 4)))
+    parser.add_argument('--timeout', type=float, default=float(os.environ.get('SIMULATION_TIMEOUT', 600)))
+    parser.add_argument('--checkpoint-every', type=int, default=int(os.environ.get('SIMULATION_CHECKPOINT_EVERY', 10)))
+    parser.add_argument('--poll', type=float, default=0.5, help="seconds between queue polls")
+    parser.add_argument('--stale-after', type=float, default=30,
+                        help="seconds without a heartbeat before a dead worker's simulations are requeued")
+    parser.add_argument('--metrics-port', type=int, default=os.environ.get('SIMULATION_WORKER_METRICS_PORT'),
+                        help="serve this worker's Prometheus metrics on this port (default: off)")
+    args = parser.parse_args(argv)
+    if not args.store:
+        parser.error("no store given (pass a database path or set SIMULATION_STORE)")
+    worker = SimulationWorker(args.store, args.workers, args.poll, args.timeout, args.stale_after, args.checkpoint_every)
+    if args.metrics_port:
+        worker.serve_metrics(args.metrics_port)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,33 @@
-import yfinance as yf
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
+from DataCache import DataCache, shared_cache
+from DataFetcher import shared_fetcher
+from BarStore import BarStore
+from DataProvider import get_provider
+from Indicators import Indicators
+import Metrics
 
 '''Code for the data struture storing stock time series and analysis functions'''
 
 class StockData:
     period_limit = 60 # 60 days for minute intervals 
     interval_set = set(["1m", "2m", "5m", "15m", "30m", "60m"])
+    # default price history backend ('yfinance', 'synthetic[:seed]' or 'replay:<dir>')
+    provider = get_provider(os.environ.get('STOCKDATA_PROVIDER', 'yfinance'))
+    cache = shared_cache # process-wide cache of downloaded frames (None to disable)
+    fetcher = shared_fetcher # bounds concurrent downloads, coalesces duplicates, retries on rate limits
+    # optional on-disk bar store consulted before downloading date ranges
+    bar_store = BarStore(os.environ['STOCKDATA_BAR_STORE']) if os.environ.get('STOCKDATA_BAR_STORE') else None
 
-    def __init__(self, stock_symbol, var1, var2 = None): # var1 and var2 define which 
+    def __init__(self, stock_symbol, var1, var2 = None, provider = None): # var1 and var2 define which 
         self.ticker = stock_symbol
+        self.curtime = None
+        self.stock_data = pd.DataFrame()
+        if provider is not None:
+            self.provider = get_provider(provider)
         if var2 is None:
             self.get_stock_data_for_date(stock_symbol, var1)
         #date format length
@@ -25,6 +43,86 @@ class StockData:
         print("- The date falls on a weekend or holiday")
         print("- The stock symbol is invalid")
 
+    # fetch history through the shared cache, downloading only on a miss
+    @Metrics.timed('stockdata_load_seconds', 'StockData history loads, including cache hits')
+    def _load_history(self, stock_symbol, start=None, end=None, interval='1d', period=None):
+        provider = self.provider
+
+        def fetch(start=None, end=None):
+            if period is not None:
+                return provider.history_period(stock_symbol, period, interval)
+            return provider.history(stock_symbol, start, end, interval)
+
+        def download():
+            # date ranges from remote providers go through the bar store (if any) so only missing
+            # gaps hit the network; relative periods like '60d' always go to the provider
+            Metrics.count('stockdata_fetches_total', 'History requests that missed the cache', provider=provider.name)
+            with Metrics.timer('stockdata_fetch_seconds', 'History downloads (cache misses)', provider=provider.name):
+                if self.bar_store is not None and provider.persistent and period is None:
+                    return self.bar_store.fetch(stock_symbol, start, end, interval, fetch)
+                return fetch(start, end)
+
+        key = DataCache.make_key(stock_symbol, start, end, interval, period, provider.key)
+        if self.cache is None:
+            return self.fetcher.call(key, download)
+        frame = self.cache.get_or_load(key, lambda: self.fetcher.call(key, download))
+        # shallow copy so per-instance columns (e.g. SMA) don't leak into the cached frame
+        return frame.copy(deep=False)
+
+    @classmethod
+    def from_frame(cls, stock_symbol, frame, provider=None):
+        """Wrap an already loaded frame without fetching anything."""
+        sd = cls.__new__(cls)
+        sd.ticker = stock_symbol
+        if provider is not None:
+            sd.provider = get_provider(provider)
+        sd.curtime = None
+        sd.stock_data = frame
+        if not frame.empty:
+            sd.curtime = frame.index[0]
+        return sd
+
+    @classmethod
+    def load_many(cls, tickers, start_date, end_date, interval='1d', provider=None, max_workers=8):
+        """Load several tickers for the same date range at once.
+        Cache misses are fetched in one bulk request when the provider supports it, otherwise
+        with a bounded concurrent fan-out; duplicate tickers are only fetched once.
+        Args:
+            tickers: Iterable of ticker symbols
+            start_date: Start date in 'YYYY-MM-DD' format
+            end_date: End date in 'YYYY-MM-DD' format
+            interval: Data interval ('1d', '30m', ...)
+            provider: Data provider (None = StockData default)
+            max_workers: Maximum concurrent downloads for the fan-out path
+        Returns:
+            dict: {ticker: StockData}"""
+
+        tickers = list(dict.fromkeys(tickers))
+        source = get_provider(provider) if provider is not None else cls.provider
+
+        # bulk-download whatever is not cached yet (the bar store fetches per-ticker gaps instead)
+        fetched = {}
+        if cls.cache is not None and source.supports_bulk and cls.bar_store is None:
+            keys = {t: cls.cache.make_key(t, start_date, end_date, interval, None, source.key) for t in tickers}
+            missing = [t for t in tickers if keys[t] not in cls.cache]  # membership checks don't count as lookups
+            if len(missing) > 1:
+                bulk_key = ('bulk', tuple(missing), start_date, end_date, interval, source.key)
+                frames = cls.fetcher.call(bulk_key, lambda: source.history_many(missing, start_date, end_date, interval))
+                for ticker, frame in frames.items():
+                    if ticker in keys and not frame.empty:
+                        # counted as this ticker's one (missed) lookup; the load below reuses the frame
+                        fetched[ticker] = cls.cache.get_or_load(keys[ticker], lambda frame=frame: frame)
+
+        def load(ticker):
+            if ticker in fetched:
+                return cls.from_frame(ticker, fetched[ticker].copy(deep=False), provider)
+            sd = cls.from_frame(ticker, pd.DataFrame(), provider)
+            sd.get_stock_data(ticker, start_date, end_date, interval)
+            return sd
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tickers)))) as pool:
+            return dict(zip(tickers, pool.map(load, tickers)))
+
     # get stock data in a range (per day basis)
     def get_stock_data(self, stock_symbol, start_date, end_date, interval='1d'):
         """Get stock data for a given symbol and date range.
@@ -39,13 +137,11 @@ class StockData:
         if start_date == end_date:
             print("Error: End date is the same as start date")
     
-        stock = yf.Ticker(stock_symbol)
-        self.stock_data = stock.history(start=start_date, end=end_date, interval=interval)
+        self.stock_data = self._load_history(stock_symbol, start_date, end_date, interval)
         
         if self.stock_data.empty:
             self.stock_error_message(stock_symbol, start_date)
         else:
-            self.stock_data.index = self.stock_data.index.tz_localize(None)
             self.curtime = self.stock_data.index[0]
         
 
@@ -58,15 +154,12 @@ class StockData:
         Returns:
             pandas.DataFrame: Stock data for the specific date"""
 
-        stock = yf.Ticker(stock_symbol)
         date_obj = datetime.strptime(date, '%Y-%m-%d')
         new_date = date_obj + timedelta(days=1)
-        self.stock_data = stock.history(start = date, end = new_date.strftime('%Y-%m-%d'))
+        self.stock_data = self._load_history(stock_symbol, date, new_date.strftime('%Y-%m-%d'))
         
         if self.stock_data.empty:
             self.stock_error_message(stock_symbol, date)
-        else:
-            self.stock_data.index = self.stock_data.index.tz_localize(None)
 
     # retrive stock data for minute time intervals 
     def get_stock_data_for_time_interval(self, stock_symbol, period, interval):
@@ -85,77 +178,226 @@ class StockData:
         elif int(period[0:-1]) > 8 and interval == "1m":
             return "Error: Period cannot be greater than 8 days for 1-minute intervals"
     
-        stock = yf.Ticker(stock_symbol)
-        self.stock_data = stock.history(period=period, interval=interval)
+        self.stock_data = self._load_history(stock_symbol, interval=interval, period=period)
         
         if self.stock_data.empty:
             self.stock_error_message(stock_symbol, period)
-        else:
-            self.stock_data.index = self.stock_data.index.tz_localize(None)
-    
-    def get_price(self):
-        time = self.curtime
-        if time in self.stock_data.index:
-            mid_price = (float(self.stock_data.loc[time, "High"]) + float(self.stock_data.loc[time, "Low"]))/2
-            return mid_price
-        else:
-            #print("Market is not open at this time")
-            pass
     
-    def moving_average(self, window='1h'):
-        self.stock_data["SMA"] = self.stock_data['Close'].rolling(window=window).mean()
-        return self.stock_data.loc[self.curtime, "SMA"]
-
-    def price_increase(self):
-        current_time = self.curtime
-        start_time = self.stock_data.index[0]
-        # Get the start price
-        if start_time in self.stock_data.index:
-            start_price = self.stock_data.loc[start_time, 'Close']
+    @property
+    def stock_data(self):
+        return self._stock_data
+
+    @stock_data.setter
+    def stock_data(self, frame):
+        self._stock_data = frame
+        self._price_index = None  # rebuilt lazily on the next price lookup
+        self._close_index = None
+        if getattr(self, '_indicators', None) is not None:
+            self._indicators.clear()  # new bars, not appended ones: recompute from scratch
+
+    @property
+    def indicators(self):
+        """Memoized technical indicators over these bars (see Indicators)."""
+        if getattr(self, '_indicators', None) is None:
+            self._indicators = Indicators(self)
+        return self._indicators
+
+    def append_bars(self, frame):
+        """Add newer bars (e.g. from a live feed); rows at or before the last bar are ignored.
+        Cached indicators are extended over the new rows instead of being recomputed."""
+        current = self._stock_data
+        if frame is None or frame.empty:
+            return
+        if current is not None and not current.empty:
+            frame = frame[frame.index > current.index[-1]]
+            if frame.empty:
+                return
+            frame = pd.concat([current, frame])
+        self._stock_data = frame
+        self._price_index = None
+        self._close_index = None
+
+    # sorted int64 timestamps and contiguous mid prices for binary-search lookups
+    def _build_price_index(self):
+        frame = self._stock_data
+        if frame is None or frame.empty or 'High' not in frame or 'Low' not in frame:
+            self._price_index = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+            return self._price_index
+        times = frame.index.values.astype('datetime64[ns]').view('int64')
+        mids = (frame['High'].to_numpy(dtype='float64') + frame['Low'].to_numpy(dtype='float64')) / 2
+        self._price_order = None
+        if len(times) > 1 and not (np.diff(times) >= 0).all():
+            order = np.argsort(times, kind='stable')
+            times, mids = times[order], mids[order]
+            self._price_order = order  # sorted position -> row in the frame
+        self._price_index = (np.ascontiguousarray(times), np.ascontiguousarray(mids))
+        return self._price_index
+
+    def bar_times(self):
+        """Sorted bar timestamps as int64 nanoseconds (shared with the price index; do not modify)."""
+        return (self._price_index if self._price_index is not None else self._build_price_index())[0]
+
+    @staticmethod
+    def _to_ns(timestamps):
+        return pd.DatetimeIndex(np.atleast_1d(timestamps)).values.astype('datetime64[ns]').view('int64')
+
+    def _lookup(self, targets, mode):
+        """Positions of the bars matching targets (int64 ns) and a mask of which were found."""
+        if mode not in ('exact', 'asof', 'next'):
+            raise ValueError(f"Invalid lookup mode '{mode}' (use 'exact', 'asof' or 'next')")
+        times, mids = self._price_index if self._price_index is not None else self._build_price_index()
+        n = len(times)
+        if mode == 'asof':
+            pos = np.searchsorted(times, targets, side='right') - 1
+            found = pos >= 0
         else:
-            # Find the closest available time to start_time
-            available_times = self.stock_data.index
-            if len(available_times) == 0:
-                print("No data available for start time")
+            pos = np.searchsorted(times, targets, side='left')
+            found = pos < n
+            if mode == 'exact' and n:
+                found &= times[np.minimum(pos, n - 1)] == targets
+        return np.clip(pos, 0, max(n - 1, 0)), found
+
+    def _bar_positions(self, time, mode='exact'):
+        """Frame row of the bar matching time (see get_price) and whether there is one."""
+        rows, found = self._bar_positions_many([time], mode)
+        return int(rows[0]), bool(found[0])
+
+    def _bar_positions_many(self, timestamps, mode='exact'):
+        pos, found = self._lookup(self._to_ns(timestamps), mode)
+        order = getattr(self, '_price_order', None)
+        return (order[pos] if order is not None else pos), found
+
+    @Metrics.timed('stockdata_get_price_seconds', 'StockData.get_price latency')
+    def get_price(self, time=None, mode='exact'):
+        """Mid price ((High + Low) / 2) of the bar at time.
+        Args:
+            time: Timestamp to price (defaults to self.curtime)
+            mode: 'exact' (bar at time), 'asof' (last bar at or before time) or 'next' (first bar at or after time)
+        Returns:
+            float: Mid price, or None if there is no matching bar (e.g. market closed)"""
+
+        if time is None:
+            time = self.curtime
+        if time is None:
+            return None
+        # scalar fast path: one conversion and one binary search, no temporary arrays
+        times, mids = self._price_index if self._price_index is not None else self._build_price_index()
+        target = pd.Timestamp(time).value
+        if mode == 'asof':
+            pos = int(times.searchsorted(target, side='right')) - 1
+            if pos < 0:
                 return None
-            
-            # Find the closest time after or equal to start_time
-            valid_times = available_times[available_times >= start_time]
-            if len(valid_times) == 0:
-                print(f"No data available after start time {start_time}")
+        elif mode == 'exact' or mode == 'next':
+            pos = int(times.searchsorted(target, side='left'))
+            if pos == len(times) or (mode == 'exact' and times[pos] != target):
+                #print("Market is not open at this time")
                 return None
-            
-            closest_start_time = valid_times[0]
-            start_price = self.stock_data.loc[closest_start_time, 'Close']
-        
-        # Get the current price
-        if current_time is None:
-            # Use the latest available time
-            current_price = self.stock_data['Close'].iloc[-1]
-            current_time = self.stock_data.index[-1]
         else:
-            if current_time in self.stock_data.index:
-                current_price = self.stock_data.loc[current_time, 'Close']
-            else:
-                # Find the closest available time to current_time
-                available_times = self.stock_data.index
-                valid_times = available_times[available_times <= current_time]
-                if len(valid_times) == 0:
-                    print(f"No data available before current time {current_time}")
-                    return None
-                
-                closest_current_time = valid_times[-1]
-                current_price = self.stock_data.loc[closest_current_time, 'Close']
-                current_time = closest_current_time
-        
-        # Calculate percentage change
+            raise ValueError(f"Invalid lookup mode '{mode}' (use 'exact', 'asof' or 'next')")
+        return float(mids[pos])
+
+    @Metrics.timed('stockdata_get_prices_seconds', 'StockData.get_prices (batch) latency')
+    def get_prices(self, timestamps, mode='exact'):
+        """Batch version of get_price.
+        Args:
+            timestamps: Sequence of timestamps
+            mode: 'exact', 'asof' or 'next' (see get_price)
+        Returns:
+            numpy.ndarray: float64 mid prices, NaN where there is no matching bar"""
+
+        targets = self._to_ns(timestamps)
+        if len(targets) == 0:
+            return np.empty(0, dtype=np.float64)
+        pos, found = self._lookup(targets, mode)
+        mids = self._price_index[1]
+        if len(mids) == 0:
+            return np.full(len(targets), np.nan)
+        return np.where(found, mids[pos], np.nan)
+    
+    def moving_average(self, window='1h'):
+        """Rolling mean of Close at curtime (window is a bar count or a time span like '1h').
+        Returns:
+            float: Moving average, or None if there is no bar at curtime"""
+        return self.indicators.at('sma', self.curtime, window=window)
+
+    # sorted int64 timestamps and the percent change of Close since the first bar, for as-of lookups
+    def _build_close_index(self):
+        frame = self._stock_data
+        if frame is None or frame.empty or 'Close' not in frame:
+            self._close_index = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64), None)
+            return self._close_index
+        times = frame.index.values.astype('datetime64[ns]').view('int64')
+        closes = frame['Close'].to_numpy(dtype='float64')
+        if len(times) > 1 and not (np.diff(times) >= 0).all():
+            order = np.argsort(times, kind='stable')
+            times, closes = times[order], closes[order]
+        start_price = float(closes[0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = (closes - start_price) / start_price * 100
+        self._close_index = (np.ascontiguousarray(times), change, start_price)
+        return self._close_index
+
+    def price_increase(self, time=None):
+        """Percent change of Close from the first bar to the last bar at or before time.
+        Args:
+            time: Timestamp (defaults to self.curtime; the latest bar if both are None)
+        Returns:
+            float: Percent change, or None if there is no bar at or before time"""
+
+        times, change, start_price = self._close_index or self._build_close_index()
+        if len(times) == 0:
+            print("No data available for start time")
+            return None
         if start_price == 0:
             print("Start price is zero, cannot calculate percentage change")
             return None
         
-        change_pct = (current_price - start_price) / start_price * 100
-        
-        return change_pct
+        if time is None:
+            time = self.curtime
+        if time is None:
+            # Use the latest available time
+            return float(change[-1])
+        pos = int(times.searchsorted(pd.Timestamp(time).value, side='right')) - 1
+        if pos < 0:
+            print(f"No data available before current time {time}")
+            return None
+        return float(change[pos])
+
+    def price_increases(self, timestamps):
+        """Batch version of price_increase.
+        Returns:
+            numpy.ndarray: Percent changes, NaN where there is no bar at or before the timestamp"""
+
+        times, change, start_price = self._close_index or self._build_close_index()
+        targets = self._to_ns(timestamps)
+        if len(times) == 0 or not start_price:
+            return np.full(len(targets), np.nan)
+        pos = np.searchsorted(times, targets, side='right') - 1
+        return np.where(pos >= 0, change[np.maximum(pos, 0)], np.nan)
+
+    @staticmethod
+    def price_increases_many(data, time=None):
+        """price_increase across a universe of tickers at one time (e.g. for screening).
+        One as-of binary search per ticker on its precomputed close index; nothing is aligned or copied.
+        Args:
+            data: {ticker: StockData}
+            time: Timestamp (defaults to each StockData's curtime, or its latest bar)
+        Returns:
+            pandas.Series: Percent change per ticker, NaN where there is no data"""
+
+        changes = np.full(len(data), np.nan)
+        target = pd.Timestamp(time).value if time is not None else None
+        for i, stock in enumerate(data.values()):
+            times, change, start_price = stock._close_index or stock._build_close_index()
+            if len(times) == 0 or not start_price:
+                continue
+            when = target
+            if when is None and stock.curtime is not None:
+                when = pd.Timestamp(stock.curtime).value
+            pos = len(times) - 1 if when is None else int(times.searchsorted(when, side='right')) - 1
+            if pos >= 0:
+                changes[i] = change[pos]
+        return pd.Series(changes, index=list(data.keys()), name='price_increase_pct')
 
 
 def main():
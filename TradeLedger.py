@@ -0,0 +1,241 @@
+import numpy as np
+import pandas as pd
+
+'''Columnar trade ledger: typed NumPy arrays instead of one dict per fill'''
+
+class TradeLedger:
+    actions = ('BUY', 'SELL')
+    chunk_size = 1024 # initial capacity; doubles whenever it fills up
+    log_block = 500.0  # realized_pnl: largest cost-basis shrink (natural log) solved in one cumulative sum
+
+    def __init__(self, trades=None):
+        """Append-only store of fills.
+        Behaves like the old list of {'action', 'ticker', 'price', 'shares', 'timestamp'} dicts
+        (len, iteration, indexing, append) while keeping the data in contiguous arrays.
+        Args:
+            trades: Optional iterable of trade dicts (or another TradeLedger) to start from"""
+
+        self._size = 0
+        self._action = np.empty(self.chunk_size, dtype=np.int8)
+        self._ticker = np.empty(self.chunk_size, dtype=np.int32)
+        self._price = np.empty(self.chunk_size, dtype=np.float64)
+        self._shares = np.empty(self.chunk_size, dtype=np.int64)
+        self._timestamp = np.empty(self.chunk_size, dtype=np.int64)
+        self._codes = {}  # {ticker: code}
+        self.tickers = []  # code -> ticker
+        if trades is not None:
+            self.extend(trades)
+
+    def _grow(self, needed=None):
+        capacity = len(self._price) * 2
+        while needed is not None and capacity < needed:
+            capacity *= 2
+        for name in ('_action', '_ticker', '_price', '_shares', '_timestamp'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def ticker_code(self, ticker):
+        """Interned integer code for a ticker (assigned on first use)."""
+        code = self._codes.get(ticker)
+        if code is None:
+            code = len(self.tickers)
+            self._codes[ticker] = code
+            self.tickers.append(ticker)
+        return code
+
+    def record(self, action, ticker, price, shares, timestamp):
+        """Append one fill.
+        Args:
+            action: 'BUY' or 'SELL'
+            ticker: Stock ticker symbol
+            price: Fill price
+            shares: Number of shares (whole shares)
+            timestamp: Fill time"""
+
+        if shares != int(shares):
+            raise ValueError(f"shares must be a whole number, got {shares}")
+        if self._size == len(self._price):
+            self._grow()
+        i = self._size
+        self._action[i] = self.actions.index(action)
+        self._ticker[i] = self.ticker_code(ticker)
+        self._price[i] = price
+        self._shares[i] = shares
+        self._timestamp[i] = pd.Timestamp(timestamp).as_unit('ns').value
+        self._size += 1
+
+    def record_many(self, actions, tickers, prices, shares, timestamps):
+        """Append many fills at once (columns in fill order, as for record()).
+        Args:
+            actions: 'BUY'/'SELL' per fill
+            tickers: Ticker per fill
+            prices: Fill prices
+            shares: Share counts (whole shares)
+            timestamps: Fill times"""
+
+        count = len(prices)
+        if count == 0:
+            return
+        shares = np.asarray(shares)
+        if shares.dtype.kind not in 'iu' and not np.array_equal(shares, np.trunc(shares)):
+            raise ValueError("shares must be whole numbers")
+        if self._size + count > len(self._price):
+            self._grow(self._size + count)
+        i, j = self._size, self._size + count
+        self._action[i:j] = [self.actions.index(action) for action in actions]
+        self._ticker[i:j] = [self.ticker_code(ticker) for ticker in tickers]
+        self._price[i:j] = prices
+        self._shares[i:j] = shares
+        self._timestamp[i:j] = pd.DatetimeIndex(timestamps).values.astype('datetime64[ns]').view('int64')
+        self._size = j
+
+    def append(self, trade):
+        """List-compatible append of a trade dict."""
+        self.record(trade['action'], trade['ticker'], trade['price'], trade['shares'], trade['timestamp'])
+
+    def extend(self, trades):
+        for trade in trades:
+            self.append(trade)
+
+    def _row(self, i):
+        return {
+            'action': self.actions[self._action[i]],
+            'ticker': self.tickers[self._ticker[i]],
+            'price': float(self._price[i]),
+            'shares': int(self._shares[i]),
+            'timestamp': pd.Timestamp(int(self._timestamp[i])).to_pydatetime()
+        }
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self._row(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(self._size))]
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('trade index out of range')
+        return self._row(index)
+
+    def __repr__(self):
+        return f"TradeLedger({self._size} trades, {len(self.tickers)} tickers)"
+
+    # column views over the filled part of the arrays (no copies)
+    @property
+    def action_codes(self):
+        return self._action[:self._size]
+
+    @property
+    def ticker_codes(self):
+        return self._ticker[:self._size]
+
+    @property
+    def prices(self):
+        return self._price[:self._size]
+
+    @property
+    def shares(self):
+        return self._shares[:self._size]
+
+    @property
+    def timestamps(self):
+        return self._timestamp[:self._size].view('datetime64[ns]')
+
+    def signed_shares(self):
+        """Shares with sells negative."""
+        return np.where(self.action_codes == 0, self.shares, -self.shares)
+
+    def net_positions(self):
+        """{ticker: net shares bought minus sold}."""
+        net = np.bincount(self.ticker_codes, weights=self.signed_shares(), minlength=len(self.tickers))
+        return {ticker: int(net[code]) for code, ticker in enumerate(self.tickers)}
+
+    def turnover(self, by_ticker=False):
+        """Traded notional (price * shares), in total or as {ticker: notional}."""
+        notional = self.prices * self.shares
+        if not by_ticker:
+            return float(notional.sum())
+        per_ticker = np.bincount(self.ticker_codes, weights=notional, minlength=len(self.tickers))
+        return {ticker: float(per_ticker[code]) for code, ticker in enumerate(self.tickers)}
+
+    def realized_pnl(self):
+        """{ticker: realized P&L} using the average-cost method (sells beyond the ledger's buys are priced at zero cost).
+        Solved for all fills at once: the holding after each fill is a grouped cumulative sum floored at zero, and the
+        cost basis (buys add price * shares, sells scale it by held after / held before) a cumulative sum in log space."""
+        if self._size == 0:
+            return {}
+        codes = self.ticker_codes
+        if len(self.tickers) <= np.iinfo(np.int16).max:
+            codes = codes.astype(np.int16)  # stable argsort is a radix sort for 16-bit keys
+        order = np.argsort(codes, kind='stable')  # group fills by ticker, keep time order within each
+        codes = codes[order]
+        buy = self.action_codes[order] == 0
+        price = self.prices[order]
+        qty = self.shares[order]
+        n = len(order)
+        positions = np.arange(n)
+        first = np.r_[True, codes[1:] != codes[:-1]]
+        group = np.maximum.accumulate(np.where(first, positions, 0))
+
+        # shares held after each fill: the running net, lifted by its lowest point so far (oversells clamp to zero).
+        # Offsetting each ticker below all earlier ones lets one running minimum serve every ticker.
+        signed = np.where(buy, qty, -qty)
+        net = np.cumsum(signed)
+        net -= (net - signed)[group]
+        offset = (np.cumsum(first) - 1) * (2 * int(np.abs(signed).sum()) + 1)
+        held = net - np.minimum(np.minimum.accumulate(net - offset) + offset, 0)
+        held_before = np.zeros(n, dtype=held.dtype)
+        held_before[1:] = held[:-1]
+        held_before[first] = 0
+
+        # a position opened from zero starts a new cost basis; within one, c[t] = c[t-1] * r[t] + buys[t] with
+        # r = held / held_before on sells. Cumulative sums of buys / prod(r) are taken per block of at most
+        # log_block shrink so they stay finite, and each block carries its predecessor's basis forward.
+        opened = held_before == 0
+        partial = ~buy & (held > 0) & ~opened
+        log_r = np.zeros(n)
+        log_r[partial] = np.log(held[partial] / held_before[partial])
+        shrink = np.cumsum(log_r)
+        shrink -= shrink[np.maximum.accumulate(np.where(opened, positions, 0))]
+        block = np.floor(-shrink / self.log_block)
+        starts = opened.copy()
+        starts[1:] |= block[1:] != block[:-1]
+        block_first = np.maximum.accumulate(np.where(starts, positions, 0))
+        scale = np.exp(shrink - shrink[block_first])  # prod(r) since the block's first fill, in [e^-log_block, 1]
+        weighted = pd.Series(np.where(buy, price * qty, 0.0) / scale)
+        cost = scale * weighted.groupby(np.cumsum(starts)).cumsum().to_numpy()  # basis after each fill, without earlier blocks
+        bounds = np.r_[starts.nonzero()[0], n]
+        for begin in (starts & ~opened).nonzero()[0]:
+            end = bounds[np.searchsorted(bounds, begin, side='right')]
+            cost[begin:end] += cost[begin - 1] * np.exp(shrink[begin:end] - shrink[begin - 1])
+
+        cost_before = np.zeros(n)
+        cost_before[1:] = cost[:-1]
+        average = np.divide(cost_before, held_before, out=np.zeros(n), where=~opened)
+        realized = np.where(buy, 0.0, (price - average) * qty)
+        per_ticker = np.bincount(codes, weights=realized, minlength=len(self.tickers))
+        return {self.tickers[code]: float(per_ticker[code]) for code in codes[first]}
+
+    def fills_per_interval(self, freq='1D'):
+        """Number of fills per time bucket (pandas offset alias, e.g. '1D', '30min')."""
+        if self._size == 0:
+            return pd.Series(dtype='int64')
+        buckets = pd.DatetimeIndex(self.timestamps).floor(freq)
+        return pd.Series(1, index=buckets).groupby(level=0).sum()
+
+    def to_frame(self):
+        """DataFrame view of the ledger; numeric columns share memory with the ledger arrays."""
+        return pd.DataFrame({
+            'action': pd.Categorical.from_codes(self.action_codes, categories=list(self.actions)),
+            'ticker': pd.Categorical.from_codes(self.ticker_codes, categories=list(self.tickers)),
+            'price': self.prices,
+            'shares': self.shares,
+            'timestamp': self.timestamps
+        }, copy=False)
@@ -1,167 +1,128 @@
-from flask import Flask, render_template, jsonify, request
-from Portfolio import Portfolio
-from StockData import StockData
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
+from DataCache import shared_cache
+from DataFetcher import shared_fetcher
+from DataProvider import get_provider
+from SimulationManager import SimulationManager
+from SimulationScheduler import SimulationScheduler, SchedulerFull
+from SimulationStore import SimulationStore, StoredSimulation, FINISHED
+from SimulationClock import SimulationClock
+from RuleCompiler import RuleCompiler
+import Downsample
+import Metrics
 import json
-import time
-import threading
 import uuid
+import os
 
 app = Flask(__name__)
 
-# Store active simulations
-active_simulations = {}
+# Bounded pool of simulation workers; finished simulations are evicted after SIMULATION_TTL seconds
+scheduler = SimulationScheduler(
+    max_workers=int(os.environ.get('SIMULATION_WORKERS', 4)),
+    max_queue=int(os.environ.get('SIMULATION_QUEUE', 32)),
+    job_timeout=float(os.environ.get('SIMULATION_TIMEOUT', 600)),
+    result_ttl=float(os.environ.get('SIMULATION_TTL', 3600))
+)
 
-class SimulationManager:
-    def __init__(self, simulation_id, initial_cash, start_date, duration_days, trading_frequency, tickers, trading_rules):
-        self.simulation_id = simulation_id
-        self.initial_cash = initial_cash
-        self.start_date = start_date
-        self.duration_days = duration_days
-        self.trading_frequency = trading_frequency  # 'daily' or 'intraday'
-        self.tickers = tickers
-        self.trading_rules = trading_rules
-        self.results = []
-        self.is_running = False
-        self.is_complete = False
-        self.thread = None
-        
-    def run_simulation(self):
-        """Run the portfolio simulation"""
+# Store active simulations (queued, running and recently finished)
+active_simulations = scheduler.simulations
+
+# Optional durable store (SIMULATION_STORE=path/to/simulations.db): running simulations are checkpointed
+# every SIMULATION_CHECKPOINT_EVERY steps, finished results are served from disk, and runs interrupted
+# by a restart resume from their last checkpoint
+store = SimulationStore(os.environ['SIMULATION_STORE']) if os.environ.get('SIMULATION_STORE') else None
+checkpoint_every = int(os.environ.get('SIMULATION_CHECKPOINT_EVERY', 50))
+
+# SIMULATION_EXECUTOR=store turns this process into a pure web tier: simulations are queued in the store
+# and run by SimulationWorker processes, and every request reads from the store, so any number of web
+# workers (e.g. gunicorn -w 8 app:app) can answer for any simulation. The default, 'local', runs them here.
+executor = os.environ.get('SIMULATION_EXECUTOR', 'local')
+if executor not in ('local', 'store'):
+    raise ValueError(f"Unknown SIMULATION_EXECUTOR '{executor}' (expected local or store)")
+if executor == 'store' and store is None:
+    raise ValueError("SIMULATION_EXECUTOR=store needs SIMULATION_STORE")
+
+def find_simulation(simulation_id):
+    """A simulation known to the scheduler or, once evicted or after a restart, reloaded from the store"""
+    if executor == 'store':
+        record = store.simulation(simulation_id)
+        return StoredSimulation(store, record) if record is not None else None
+    simulation = scheduler.get(simulation_id)
+    if simulation is None and store is not None:
+        record = store.simulation(simulation_id)
+        if record is not None and record['status'] in FINISHED:
+            simulation = scheduler.add(SimulationManager.from_store(store, record, checkpoint_every))
+    return simulation
+
+def collect_metrics():
+    """Gauges and counters sampled when /metrics is scraped (free between scrapes)"""
+    cache = shared_cache.stats()
+    fetcher = shared_fetcher.stats()
+    samples = [
+        ('data_cache_hits_total', 'counter', 'Price history cache hits', {}, cache['hits']),
+        ('data_cache_misses_total', 'counter', 'Price history cache misses', {}, cache['misses']),
+        ('data_cache_hit_ratio', 'gauge', 'Price history cache hit ratio', {}, cache['hit_rate']),
+        ('data_cache_bytes', 'gauge', 'Bytes held by the price history cache', {}, cache['bytes']),
+        ('data_fetcher_requests_total', 'counter', 'Downloads started by the shared fetcher', {}, fetcher['requests']),
+        ('data_fetcher_coalesced_total', 'counter', 'Requests that joined an identical in-flight download', {}, fetcher['coalesced']),
+        ('data_fetcher_retries_total', 'counter', 'Download retries after rate limiting', {}, fetcher['retries']),
+        ('data_fetcher_in_flight', 'gauge', 'Downloads in progress', {}, fetcher['in_flight'])
+    ]
+    if executor == 'store':
+        stats = store.stats()
+        samples.append(('simulation_queue_depth', 'gauge', 'Simulations waiting for a worker', {}, stats['queued']))
+        samples.append(('simulations_running', 'gauge', 'Simulations being run', {}, stats['running']))
+        return samples
+    stats = scheduler.stats()
+    samples += [
+        ('simulation_queue_depth', 'gauge', 'Simulations waiting for a worker', {}, stats['queued']),
+        ('simulations_running', 'gauge', 'Simulations being run', {}, stats['running']),
+        ('simulations_overrunning', 'gauge', 'Stopped simulations still holding a worker', {}, stats['overrunning']),
+        ('simulations_completed_total', 'counter', 'Simulations finished by this process', {}, stats['completed']),
+        ('simulations_rejected_total', 'counter', 'Simulations refused because the queue was full', {}, stats['rejected']),
+        ('simulations_timed_out_total', 'counter', 'Simulations stopped at the time limit', {}, stats['timed_out'])
+    ]
+    for simulation in scheduler.active():
+        rate = simulation.steps_per_second()
+        if rate is not None:
+            samples.append(('simulation_running_steps_per_second', 'gauge', 'Step throughput of running simulations',
+                            {'simulation_id': simulation.simulation_id}, rate))
+    return samples
+
+Metrics.registry.add_collector(collect_metrics)
+
+def queue_position(simulation_id):
+    if executor == 'store':
+        return store.queue_position(simulation_id)
+    return scheduler.queue_position(simulation_id)
+
+def resume_simulations():
+    """Queue the simulations a previous server process left unfinished"""
+    if store is None or executor == 'store':  # workers requeue those themselves
+        return
+    for record in store.simulations(('created', 'queued', 'running')):
+        if record['id'] in scheduler:
+            continue
+        simulation = SimulationManager.from_store(store, record, checkpoint_every)
         try:
-            self.is_running = True
-            
-            # Initialize portfolio and stock data
-            currtime = datetime.strptime(self.start_date, '%Y-%m-%d')
-            start_date_str = currtime.strftime('%Y-%m-%d')
-            end_date_str = (currtime + relativedelta(months=2)).strftime('%Y-%m-%d')
-            
-            port = Portfolio(self.initial_cash, start_date_str, end_date_str)
-            
-            # Initial purchases
-            for ticker, shares in self.tickers.items():
-                port.buy(ticker, 500, shares, currtime)  # High price limit to ensure purchase
-            
-            # Initialize stock data with appropriate interval
-            data = {}
-            interval = '30m' if self.trading_frequency == 'intraday' else '1d'
-            for ticker in self.tickers.keys():
-                data[ticker] = StockData(ticker, start_date_str, end_date_str)
-                # Update the stock data with the correct interval
-                data[ticker].get_stock_data(ticker, start_date_str, end_date_str, interval)
-            
-            # Run simulation based on trading frequency
-            if self.trading_frequency == 'intraday':
-                # For intraday: simulate 30-minute intervals within each day
-                total_intervals = self.duration_days * 13  # 13 intervals per day (6.5 hours / 30 min)
-                interval_delta = timedelta(minutes=30)
-            else:
-                # For daily: simulate day by day
-                total_intervals = self.duration_days
-                interval_delta = timedelta(days=1)
-            
-            for i in range(total_intervals):
-                if not self.is_running:  # Check if simulation was stopped
-                    break
-                    
-                # Move to next interval
-                currtime = currtime + interval_delta
-                
-                # Update current time for all stock data objects
-                for ticker in self.tickers.keys():
-                    data[ticker].curtime = currtime
-                
-                # Get current prices
-                current_prices = {}
-                for ticker in self.tickers.keys():
-                    price = data[ticker].get_price()
-                    if price is not None:
-                        current_prices[ticker] = price
-                
-                # Check trading conditions and execute trades
-                trades_executed = []
-                
-                for ticker, rules in self.trading_rules.items():
-                    if ticker in current_prices:
-                        price = current_prices[ticker]
-                        for rule in rules:
-                            # Handle sell rules
-                            if rule['action'] == 'sell':
-                                if rule['condition'] == 'greater_than' and price > rule['threshold']:
-                                    if port.positions.get(ticker, 0) >= rule['shares']:
-                                        port.sell(ticker, price, rule['shares'], currtime)
-                                        trades_executed.append(f"Sold {rule['shares']} {ticker} @ ${price:.2f}")
-                                elif rule['condition'] == 'less_than' and price < rule['threshold']:
-                                    if port.positions.get(ticker, 0) >= rule['shares']:
-                                        port.sell(ticker, price, rule['shares'], currtime)
-                                        trades_executed.append(f"Sold {rule['shares']} {ticker} @ ${price:.2f}")
-                            
-                            # Handle buy rules
-                            elif rule['action'] == 'buy':
-                                if rule['condition'] == 'greater_than' and price > rule['threshold']:
-                                    # Check if we have enough cash to buy
-                                    cost = price * rule['shares']
-                                    if port.cash >= cost:
-                                        port.buy(ticker, price + 1, rule['shares'], currtime)  # Add small buffer to ensure purchase
-                                        trades_executed.append(f"Bought {rule['shares']} {ticker} @ ${price:.2f}")
-                                elif rule['condition'] == 'less_than' and price < rule['threshold']:
-                                    # Check if we have enough cash to buy
-                                    cost = price * rule['shares']
-                                    if port.cash >= cost:
-                                        port.buy(ticker, price + 1, rule['shares'], currtime)  # Add small buffer to ensure purchase
-                                        trades_executed.append(f"Bought {rule['shares']} {ticker} @ ${price:.2f}")
-                
-                # Get current portfolio value
-                current_value = port.get_value(currtime)
-                
-                # Store interval result
-                interval_label = f"Interval {i + 1}"
-                if self.trading_frequency == 'intraday':
-                    day_num = (i // 13) + 1
-                    interval_in_day = (i % 13) + 1
-                    interval_label = f"Day {day_num}, Interval {interval_in_day}"
-                
-                daily_result = {
-                    'day': i + 1,
-                    'interval_label': interval_label,
-                    'date': currtime.strftime('%Y-%m-%d %H:%M') if self.trading_frequency == 'intraday' else currtime.strftime('%Y-%m-%d'),
-                    'prices': current_prices.copy(),
-                    'portfolio_value': current_value,
-                    'trades': trades_executed.copy(),
-                    'positions': port.positions.copy(),
-                    'cash': port.cash,
-                    'pnl': port.get_PNL(currtime)
-                }
-                self.results.append(daily_result)
-                
-                # Small delay for real-time effect
-                time.sleep(0.1)
-            
-            # Calculate final metrics
-            if self.results:
-                initial_value = self.results[0]['portfolio_value']
-                final_value = self.results[-1]['portfolio_value']
-                total_return = (final_value - initial_value) / initial_value * 100 if initial_value > 0 else 0
-                
-                sharpe_ratio = port.calculate_sharpe_ratio()
-                volatility = port.calculate_volatility()
-                
-                self.final_metrics = {
-                    'total_return_pct': round(total_return, 2),
-                    'final_value': round(final_value, 2),
-                    'total_pnl': round(final_value - self.initial_cash, 2),
-                    'sharpe_ratio': round(sharpe_ratio, 3) if sharpe_ratio else None,
-                    'volatility_pct': round(volatility * 100, 2) if volatility else None,
-                    'total_trades': len(port.past_trades),
-                    'final_positions': port.positions
-                }
-            
-            self.is_complete = True
-            
-        except Exception as e:
-            self.error = str(e)
-            self.is_complete = True
+            scheduler.submit(simulation)
+        except SchedulerFull:
+            print(f"Simulation queue full; {record['id']} stays stored until a later restart")
+            break
+        store.save_simulation(simulation)
+
+def resolve_provider(name):
+    """Map the 'data_provider' request field to a provider.
+    Replay data is only read from the server-configured REPLAY_DATA_DIR."""
+    if not name:
+        return None
+    if name == 'replay':
+        replay_dir = os.environ.get('REPLAY_DATA_DIR')
+        if not replay_dir:
+            raise ValueError("Replay provider is not configured (set REPLAY_DATA_DIR)")
+        return get_provider(f"replay:{replay_dir}")
+    if name.partition(':')[0] not in ('yfinance', 'synthetic'):
+        raise ValueError(f"Unknown data provider '{name}'")
+    return get_provider(name)
 
 @app.route('/')
 def index():
@@ -182,6 +143,13 @@ def start_simulation():
         start_date = data.get('start_date', '2025-07-21')
         duration_days = int(data.get('duration_days', 30))
         trading_frequency = data.get('trading_frequency', 'daily')
+        provider = resolve_provider(data.get('data_provider'))
+        engine = data.get('engine', 'vectorized')
+        if engine not in ('vectorized', 'loop'):
+            raise ValueError(f"Unknown simulation engine '{engine}'")
+        # pacing: max_speed (default), realtime at 'speed' x, or stepped with 'step_delay' seconds per step
+        clock = SimulationClock(data.get('pacing', 'max_speed'), speed=float(data.get('speed', 1.0)),
+                                step_delay=float(data.get('step_delay', 0.1)))
         
         # Extract tickers and shares
         tickers = {}
@@ -196,33 +164,53 @@ def start_simulation():
             ticker = rule_data['ticker'].upper()
             if ticker not in trading_rules:
                 trading_rules[ticker] = []
-            trading_rules[ticker].append({
+            rule = {
                 'action': rule_data.get('action', 'sell'),  # Default to sell for backward compatibility
-                'condition': rule_data['condition'],
-                'threshold': float(rule_data['threshold']),
-                'shares': int(rule_data['shares'])
-            })
+                'condition': rule_data.get('condition'),
+                'threshold': rule_data.get('threshold'),
+                'shares': rule_data.get('shares')
+            }
+            for field in ('indicator', 'compare_to', 'lookback'):
+                if field in rule_data:
+                    rule[field] = rule_data[field]
+            trading_rules[ticker].append(rule)
+        
+        # reject malformed rules up front (400) instead of failing inside the simulation
+        RuleCompiler(tickers.keys(), trading_rules)
         
-        # Create and start simulation
+        # Create simulation and queue it for a worker
         simulation = SimulationManager(
             simulation_id, initial_cash, start_date, duration_days, 
-            trading_frequency, tickers, trading_rules
+            trading_frequency, tickers, trading_rules, provider, engine, clock,
+            store=store, checkpoint_every=checkpoint_every, profile=bool(data.get('profile', False))
         )
         
-        # Start simulation in background thread
-        simulation.thread = threading.Thread(target=simulation.run_simulation)
-        simulation.thread.daemon = True
-        simulation.thread.start()
-        
-        # Store simulation
-        active_simulations[simulation_id] = simulation
+        if executor == 'store':
+            simulation.status = 'queued'
+            if not store.enqueue(simulation, scheduler.max_queue):
+                raise SchedulerFull(f"Simulation queue is full ({scheduler.max_queue} waiting)")
+            position = store.queue_position(simulation_id)
+        else:
+            position = scheduler.submit(simulation)
+            if store is not None:
+                store.save_simulation(simulation)
         
         return jsonify({
             'success': True,
             'simulation_id': simulation_id,
+            'status': simulation.status,
+            'queue_position': position,
             'message': 'Simulation started successfully'
         })
         
+    except SchedulerFull as e:
+        response = jsonify({
+            'success': False,
+            'error': str(e)
+        })
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    
     except Exception as e:
         return jsonify({
             'success': False,
@@ -231,46 +219,146 @@ def start_simulation():
 
 @app.route('/simulation_status/<simulation_id>')
 def simulation_status(simulation_id):
-    """Get current status of a simulation"""
-    if simulation_id not in active_simulations:
+    """Get current status of a simulation.
+    Pass ?since=<cursor> to receive only the results after that offset; the response's
+    'cursor' is the value to send on the next poll."""
+    simulation = find_simulation(simulation_id)
+    if simulation is None:
+        return jsonify({'error': 'Simulation not found'}), 404
+    
+    since = request.args.get('since', default=0, type=int)
+    total_results = len(simulation.results)
+    
+    with Metrics.timer('http_simulation_status_serialize_seconds', 'Building and serializing /simulation_status responses'):
+        response = {
+            'is_running': simulation.is_running,
+            'is_complete': simulation.is_complete,
+            'status': simulation.status,
+            'queue_position': queue_position(simulation_id),
+            'results': simulation.results[max(since, 0):total_results],
+            'cursor': total_results,
+            'total_results': total_results,
+            'total_steps': simulation.total_steps,
+            'progress': total_results / simulation.total_steps if simulation.total_steps else 0
+        }
+    
+        if hasattr(simulation, 'final_metrics'):
+            response['final_metrics'] = simulation.final_metrics
+    
+        if hasattr(simulation, 'error'):
+            response['error'] = simulation.error
+    
+        response = jsonify(response)
+    return response
+
+@app.route('/simulation_stream/<simulation_id>')
+def simulation_stream(simulation_id):
+    """Server-Sent Events stream of step records as the simulation produces them.
+    Each record is sent as a 'result' event whose id is its offset, so a reconnecting
+    client (Last-Event-ID) or ?since=<cursor> resumes where it left off. A final
+    'complete' event carries the final metrics or error."""
+    simulation = find_simulation(simulation_id)
+    if simulation is None:
         return jsonify({'error': 'Simulation not found'}), 404
     
-    simulation = active_simulations[simulation_id]
+    last_event_id = request.headers.get('Last-Event-ID')
+    cursor = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else request.args.get('since', default=0, type=int)
     
-    response = {
-        'is_running': simulation.is_running,
-        'is_complete': simulation.is_complete,
-        'results': simulation.results,
-        'progress': len(simulation.results) / simulation.duration_days if simulation.duration_days > 0 else 0
-    }
+    def events(cursor):
+        while True:
+            records = simulation.wait_for_results(cursor, timeout=15)
+            if not records and not simulation.is_complete:
+                yield ': keep-alive\n\n'
+                continue
+            for record in records:
+                yield f"id: {cursor}\nevent: result\ndata: {json.dumps(record, default=str)}\n\n"
+                cursor += 1
+            if simulation.is_complete and cursor >= len(simulation.results):
+                final = {'final_metrics': getattr(simulation, 'final_metrics', None), 'error': getattr(simulation, 'error', None)}
+                yield f"event: complete\ndata: {json.dumps(final, default=str)}\n\n"
+                return
+    
+    return Response(stream_with_context(events(max(cursor, 0))), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/simulation_chart/<simulation_id>')
+def simulation_chart(simulation_id):
+    """Chart-ready equity, P&L and per-ticker price series, downsampled to a constant size.
+    Query parameters: points (default 500, at most 5000), start/end (window bounds),
+    method ('lttb' or 'minmax' for equity and P&L), prices ('ohlc', 'lttb' or 'minmax'),
+    tickers (comma-separated subset)."""
+    simulation = find_simulation(simulation_id)
+    if simulation is None:
+        return jsonify({'error': 'Simulation not found'}), 404
     
-    if hasattr(simulation, 'final_metrics'):
-        response['final_metrics'] = simulation.final_metrics
+    points = request.args.get('points', default=500, type=int)
+    method = request.args.get('method', 'lttb')
+    price_method = request.args.get('prices', 'ohlc')
+    tickers = request.args.get('tickers')
+    tickers = [t.strip().upper() for t in tickers.split(',') if t.strip()] if tickers else None
+    if not 3 <= points <= 5000:
+        return jsonify({'error': 'points must be between 3 and 5000'}), 400
+    if method not in Downsample.METHODS or price_method not in ('ohlc',) + Downsample.METHODS:
+        return jsonify({'error': f"method must be one of {', '.join(Downsample.METHODS)} and prices one of ohlc, {', '.join(Downsample.METHODS)}"}), 400
+    unknown = [t for t in tickers or [] if t not in simulation.tickers]
+    if unknown:
+        return jsonify({'error': f"Unknown tickers: {', '.join(unknown)}"}), 400
     
-    if hasattr(simulation, 'error'):
-        response['error'] = simulation.error
+    try:
+        chart = simulation.chart_data(points, request.args.get('start'), request.args.get('end'),
+                                      method, price_method, tickers)
+    except ValueError as e:
+        return jsonify({'error': f"Invalid window: {e}"}), 400
     
-    return jsonify(response)
+    chart.update({'status': simulation.status, 'is_complete': simulation.is_complete})
+    return jsonify(chart)
 
 @app.route('/stop_simulation/<simulation_id>', methods=['POST'])
 def stop_simulation(simulation_id):
-    """Stop a running simulation"""
-    if simulation_id not in active_simulations:
+    """Stop a running simulation (or take a queued one off the queue)"""
+    stopped = store.request_cancel(simulation_id) if executor == 'store' else scheduler.cancel(simulation_id)
+    if not stopped:
         return jsonify({'error': 'Simulation not found'}), 404
     
-    simulation = active_simulations[simulation_id]
-    simulation.is_running = False
-    
     return jsonify({'success': True, 'message': 'Simulation stopped'})
 
 @app.route('/cleanup_simulation/<simulation_id>', methods=['DELETE'])
 def cleanup_simulation(simulation_id):
-    """Clean up a completed simulation"""
-    if simulation_id in active_simulations:
-        del active_simulations[simulation_id]
+    """Clean up a simulation, stopping it first if it is still queued or running"""
+    if executor == 'store':
+        store.request_cancel(simulation_id)  # a worker still running it stops and drops it
+        removed = False
+    else:
+        removed = scheduler.remove(simulation_id)
+    if store is not None:
+        removed = store.delete(simulation_id) or removed
+    if removed:
         return jsonify({'success': True, 'message': 'Simulation cleaned up'})
     
     return jsonify({'error': 'Simulation not found'}), 404
 
+@app.route('/simulation_profile/<simulation_id>')
+def simulation_profile(simulation_id):
+    """Stage timings and step throughput of a simulation, plus its top functions by cumulative
+    time if it was started with "profile": true"""
+    simulation = find_simulation(simulation_id)
+    if simulation is None:
+        return jsonify({'error': 'Simulation not found'}), 404
+    return jsonify(simulation.profile_report(top=request.args.get('top', default=25, type=int)))
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of the hot-path histograms (METRICS_ENABLED=1) and queue/cache gauges"""
+    return Response(Metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/scheduler_status')
+def scheduler_status():
+    """Worker pool and queue occupancy"""
+    if executor == 'store':
+        return jsonify(dict(store.stats(), executor=executor, max_queue=scheduler.max_queue))
+    return jsonify(scheduler.stats())
+
+resume_simulations()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,248 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from DataProvider import SyntheticProvider
+from Portfolio import Portfolio
+from SimulationManager import SimulationManager
+
+'''Benchmarks for the data, valuation and simulation hot paths on synthetic (offline) prices
+
+    python benchmark.py                                  # small and medium scales, printed as a table
+    python benchmark.py --scales large --output after.json --baseline before.json
+'''
+
+# tickers x simulated days x rules; intraday runs step over 13 bars per session
+SCALES = {
+    'small': {'tickers': 3, 'days': 30, 'rules': 3, 'frequency': 'daily'},
+    'medium': {'tickers': 10, 'days': 30, 'rules': 20, 'frequency': 'intraday'},
+    'large': {'tickers': 50, 'days': 55, 'rules': 100, 'frequency': 'intraday'}
+}
+START_DATE = '2025-03-03'
+# metric suffixes where larger is better; everything else (latencies, seconds, memory) should shrink
+HIGHER_IS_BETTER = ('per_sec',)
+
+
+def _quiet():
+    # Portfolio prints a line per refused order / closed market; keep it out of the timings' output
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def _latency_stats(samples_ns):
+    samples = np.asarray(samples_ns, dtype=np.float64) / 1000.0
+    total = samples.sum()
+    return {
+        'calls': int(len(samples)),
+        'ops_per_sec': round(len(samples) / (total / 1e6), 1) if total > 0 else None,
+        'p50_us': round(float(np.percentile(samples, 50)), 3),
+        'p95_us': round(float(np.percentile(samples, 95)), 3),
+        'p99_us': round(float(np.percentile(samples, 99)), 3)
+    }
+
+
+def _timed_calls(fn, args_list):
+    samples = np.empty(len(args_list), dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i, args in enumerate(args_list):
+        start = clock()
+        fn(*args)
+        samples[i] = clock() - start
+    return samples
+
+
+def _peak_kb(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+class Benchmark:
+    def __init__(self, scale, seed=0, repeat=3, calls=2000):
+        """One benchmark scale.
+        Args:
+            scale: Name in SCALES
+            seed: Synthetic price seed (also drives the generated rules and lookups)
+            repeat: Timed simulation runs per engine (after one warm-up run)
+            calls: Calls per micro-benchmark"""
+
+        self.name = scale
+        self.config = SCALES[scale]
+        self.seed = seed
+        self.repeat = repeat
+        self.calls = calls
+        self.provider = SyntheticProvider(seed=seed)
+        self.rng = np.random.default_rng(seed)
+        self.tickers = [f"T{i:03d}" for i in range(self.config['tickers'])]
+
+    def simulation(self, engine):
+        cfg = self.config
+        rng = np.random.default_rng(self.seed)
+        rules = {}
+        for n in range(cfg['rules']):
+            ticker = self.tickers[n % len(self.tickers)]
+            rules.setdefault(ticker, []).append({
+                'action': 'sell' if n % 2 else 'buy',
+                'condition': 'greater_than' if rng.random() < 0.5 else 'less_than',
+                'threshold': float(rng.uniform(60, 160)),
+                'shares': int(rng.integers(1, 10))
+            })
+        holdings = {ticker: 50 for ticker in self.tickers}
+        return SimulationManager(f"bench-{self.name}-{engine}", 10_000_000, START_DATE, cfg['days'], cfg['frequency'],
+                                 holdings, rules, provider=self.provider, engine=engine)
+
+    def run(self):
+        results = {}
+        with _quiet():
+            sim = self.simulation('vectorized')
+            port, data, times = sim.setup()
+        if not times:
+            raise RuntimeError(f"No synthetic bars for scale '{self.name}'")
+        stock = data[self.tickers[0]]
+        lookups = [(times[i],) for i in self.rng.integers(0, len(times), self.calls)]
+
+        results['get_price'] = _latency_stats(_timed_calls(stock.get_price, lookups))
+        results['get_price']['peak_kb'] = _peak_kb(lambda: _timed_calls(stock.get_price, lookups))
+
+        # every call values the portfolio at a new step, so no cached mark is reused
+        step_times = [(times[i % len(times)],) for i in range(min(self.calls, len(times)))]
+        with _quiet():
+            results['get_value'] = _latency_stats(_timed_calls(port.get_value, step_times))
+
+        trader = Portfolio(1e12, port.var1, port.var2, provider=self.provider)
+        trader.add_price_data(port.price_data)  # reuse the loaded price history
+        orders = [(self.tickers[i % len(self.tickers)], 1e9, 1, times[i % len(times)]) for i in range(self.calls)]
+        with _quiet():
+            results['buy'] = _latency_stats(_timed_calls(trader.buy, orders))
+            results['sell'] = _latency_stats(_timed_calls(trader.sell, [(t, 0.0, s, ts) for t, _, s, ts in orders]))
+
+        curve = Portfolio(1e6, None)
+        values = 1e6 * np.cumprod(1 + self.rng.normal(0, 0.01, self.calls))
+        for ts, value in zip(pd.date_range(START_DATE, periods=self.calls, freq='30min'), values):
+            curve.record_value(ts.to_pydatetime(), float(value))
+        with _quiet():
+            for method in ('calculate_sharpe_ratio', 'calculate_volatility', 'calculate_returns_summary'):
+                results[method] = _latency_stats(_timed_calls(getattr(curve, method), [()] * self.calls))
+
+        for engine in ('loop', 'vectorized'):
+            results[f'simulation_{engine}'] = self._simulation_stats(engine)
+        return results
+
+    def _simulation_stats(self, engine):
+        durations = []
+        steps = 0
+        with _quiet():
+            for run in range(self.repeat + 1):  # run 0 warms the caches
+                sim = self.simulation(engine)
+                start = time.perf_counter()
+                sim.run_simulation()
+                elapsed = time.perf_counter() - start
+                if getattr(sim, 'error', None):
+                    raise RuntimeError(f"{engine} simulation failed: {sim.error}")
+                steps = sim.total_steps or 0
+                if run:
+                    durations.append(elapsed)
+            peak = _peak_kb(self.simulation(engine).run_simulation)
+        best = min(durations) if durations else float('nan')
+        return {
+            'steps': steps,
+            'seconds': round(best, 4),
+            'steps_per_sec': round(steps / best, 1) if best > 0 else None,
+            'peak_kb': peak
+        }
+
+
+def run_benchmarks(scales, seed=0, repeat=3, calls=2000):
+    """Run the given scales.
+    Returns:
+        dict: {'meta': environment info, 'results': {scale: {benchmark: metrics}}}"""
+    results = {}
+    for scale in scales:
+        results[scale] = Benchmark(scale, seed, repeat, calls).run()
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.platform(),
+            'seed': seed,
+            'scales': {scale: SCALES[scale] for scale in scales}
+        },
+        'results': results
+    }
+
+
+def compare(current, baseline, tolerance=0.10):
+    """Metrics that got worse than baseline by more than tolerance (a fraction).
+    Returns:
+        list: (scale, benchmark, metric, baseline value, current value, relative change)"""
+    regressions = []
+    for scale, benchmarks in current['results'].items():
+        for name, metrics in benchmarks.items():
+            old_metrics = baseline.get('results', {}).get(scale, {}).get(name, {})
+            for metric, value in metrics.items():
+                old = old_metrics.get(metric)
+                if metric in ('calls', 'steps') or not old or value is None:
+                    continue
+                change = (value - old) / old
+                worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+                if worse > tolerance:
+                    regressions.append((scale, name, metric, old, value, change))
+    return regressions
+
+
+def print_report(report):
+    for scale, benchmarks in report['results'].items():
+        print(f"\n== {scale} ({report['meta']['scales'][scale]}) ==")
+        for name, metrics in benchmarks.items():
+            shown = ', '.join(f"{k}={v}" for k, v in metrics.items())
+            print(f"  {name:28s} {shown}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the data, valuation and simulation hot paths on synthetic data")
+    parser.add_argument('--scales', default='small,medium', help=f"comma-separated subset of {', '.join(SCALES)}")
+    parser.add_argument('--repeat', type=int, default=3, help="timed simulation runs per engine")
+    parser.add_argument('--calls', type=int, default=2000, help="calls per micro-benchmark")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON results to compare against; exits with status 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed relative slowdown before flagging (default 0.10)")
+    args = parser.parse_args(argv)
+
+    scales = [s.strip() for s in args.scales.split(',') if s.strip()]
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown:
+        parser.error(f"unknown scale(s): {', '.join(unknown)}")
+
+    report = run_benchmarks(scales, args.seed, args.repeat, args.calls)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if not regressions:
+            print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}")
+            return 0
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%} against {args.baseline}:")
+        for scale, name, metric, old, value, change in regressions:
+            print(f"  {scale}.{name}.{metric}: {old} -> {value} ({change:+.1%})")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
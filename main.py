@@ -1,31 +1,30 @@
 from Portfolio import Portfolio
-from StockData import StockData
+from SimulationClock import SimulationClock
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import numpy as np
-import time
 
 # Initialize starting time and portfolio (use a weekday)
 currtime = datetime(2025, 7, 21)  # Monday
 start_date_str = currtime.strftime('%Y-%m-%d')
 end_date_str = (currtime + relativedelta(months=2)).strftime('%Y-%m-%d')
 port = Portfolio(100000, start_date_str, end_date_str)
+tickers = ["NVDA", "AMZN", "GOOG"]
+port.preload(tickers)
+
+# Pacing comes from SIMULATION_PACING (max_speed, realtime, stepped); runs flat out by default
+clock = SimulationClock.from_env()
 
 # Initial purchases
 print("Making initial purchases...")
-time.sleep(1)
 port.buy("NVDA", 400, 100, currtime)  # Buy 100 shares at market price (500 is max price)
 port.buy("AMZN", 300, 120, currtime)  # Buy 120 shares at market price (320 is max price)
 port.buy("GOOG", 200, 100, currtime)  # Buy 100 shares at market price (600 is max price)
 
-# Initialize stock data for all tickers
-data = dict()
-tickers = ["NVDA", "AMZN", "GOOG"]
-
-for ticker in tickers:
-    data[ticker] = StockData(ticker, start_date_str, end_date_str)
+# Stock data for all tickers: the histories port.preload() already loaded
+data = port.price_data
 
 print("Starting portfolio simulation...")
 print(f"Initial portfolio value: ${port.get_value(currtime):,.2f}")
@@ -34,10 +33,10 @@ print(f"Initial positions: {port.positions}")
 # Track daily results
 daily_results = []
 
-# Loop through 60 days of Yahoo data
-for i in range(60):
-    # Move to next day
-    currtime = currtime + timedelta(days=1)
+# Loop through the trading days in the next 60 days of Yahoo data (weekends and holidays have no bars)
+calendar = SimulationClock.calendar(data, currtime, currtime + timedelta(days=60))
+for i, currtime in enumerate(calendar):
+    clock.tick(currtime)
     
     # Update current time for all stock data objects
     for ticker in tickers:
@@ -76,17 +75,8 @@ for i in range(60):
         print(f"{ticker}=${price:.2f} ", end="")
     print()
     
-    
-    time.sleep(0.4)  # Small delay after each trade
-    
     print(f"  Portfolio Value: ${current_value:,.2f}")
     print(f"  Positions: {port.positions}")
-    
-    # Add a small delay between days
-    time.sleep(0.5)
-
-# Add delay before final summary
-time.sleep(1.0)
 
 # Final summary
 print(f"\n" + "="*60)
@@ -112,10 +102,6 @@ if len(daily_results) > 1:
     if sharpe_ratio is not None:
         print(f"Sharpe Ratio: {sharpe_ratio:.3f}")
 
-# Add delay before plotting
-time.sleep(1.0)
-time.sleep(0.5)
-
 # Plot portfolio performance
 port.plot_portfolio_value("Portfolio Performance Over 60 Days")
 port.plot_portfolio_value("Portfolio Performance (Percentage View)", show_percentage=True)
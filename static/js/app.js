@@ -1,5 +1,6 @@
 let currentSimulationId = null;
 let statusInterval = null;
+let resultsCursor = 0;
 
 // Initialize the application
 document.addEventListener('DOMContentLoaded', function() {
@@ -90,10 +91,13 @@ function stopSimulation() {
 }
 
 function startStatusPolling() {
+    resultsCursor = 0;
     statusInterval = setInterval(() => {
-        fetch(`/simulation_status/${currentSimulationId}`)
+        // Only ask for results we haven't seen yet
+        fetch(`/simulation_status/${currentSimulationId}?since=${resultsCursor}`)
         .then(response => response.json())
         .then(data => {
+            resultsCursor = data.cursor;
             updateProgress(data);
             updateResults(data);
             
@@ -119,8 +123,10 @@ function updateProgress(data) {
     
     if (data.is_complete) {
         progressText.textContent = 'Simulation Complete!';
+    } else if (data.status === 'queued') {
+        progressText.textContent = `Queued (position ${data.queue_position})...`;
     } else {
-        progressText.textContent = `Day ${data.results.length} of ${data.results.length / data.progress} - Running...`;
+        progressText.textContent = `Step ${data.total_results} of ${data.total_steps || '?'} - Running...`;
     }
 }
 
@@ -369,6 +375,10 @@ function addTradingRule() {
             <select class="form-select">
                 <option value="greater_than">Price ></option>
                 <option value="less_than">Price <</option>
+                <option value="crosses_above">Price crosses above</option>
+                <option value="crosses_below">Price crosses below</option>
+                <option value="pct_change_above">% change ></option>
+                <option value="pct_change_below">% change <</option>
             </select>
             <input type="number" class="form-control" placeholder="Threshold" step="0.01">
             <input type="number" class="form-control" placeholder="Shares" value="10" min="1">
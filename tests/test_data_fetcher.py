@@ -0,0 +1,40 @@
+import pytest
+from DataFetcher import DataFetcher, RateLimitError, is_rate_limited
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class HTTPError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.response = Response(status_code)
+
+
+def test_rate_limit_detection():
+    assert is_rate_limited(RateLimitError("slow down"))
+    assert is_rate_limited(HTTPError("client error", 429))
+    assert is_rate_limited(Exception("HTTP Error 429: Too Many Requests"))
+    assert is_rate_limited(Exception("status code 429"))
+
+
+def test_messages_that_merely_contain_429_are_not_rate_limits():
+    assert not is_rate_limited(ValueError("$4290: No data found for 2025-04-29"))
+    assert not is_rate_limited(ValueError("no price data for ticker 429"))
+    assert not is_rate_limited(HTTPError("404 for /history?ticker=429", 404))
+
+
+def test_non_rate_limit_error_is_not_retried():
+    fetcher = DataFetcher(max_retries=3, backoff=0.0)
+    attempts = []
+
+    def fail():
+        attempts.append(1)
+        raise ValueError("No data for ticker 4290")
+
+    with pytest.raises(ValueError):
+        fetcher.call('key', fail)
+    assert len(attempts) == 1
+    assert fetcher.retries == 0
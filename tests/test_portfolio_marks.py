@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+from Portfolio import Portfolio
+from StockData import StockData
+
+T0, T1, T2 = pd.Timestamp('2025-07-21 09:30'), pd.Timestamp('2025-07-21 09:31'), pd.Timestamp('2025-07-21 09:32')
+
+
+def stock(ticker, prices):
+    frame = pd.DataFrame({'Open': list(prices.values()), 'High': list(prices.values()),
+                          'Low': list(prices.values()), 'Close': list(prices.values())},
+                         index=pd.DatetimeIndex(list(prices.keys())))
+    return StockData.from_frame(ticker, frame)
+
+
+@pytest.fixture
+def portfolio():
+    data = {
+        'AAA': stock('AAA', {T0: 10.0, T1: 11.0, T2: 12.0}),
+        'BBB': stock('BBB', {T0: 20.0, T2: 22.0}),  # no bar at T1
+        'CCC': stock('CCC', {T0: 30.0, T1: 31.0, T2: 32.0}),  # loaded but never held
+    }
+    port = Portfolio(1000.0, '2025-07-21', '2025-07-22', positions={'AAA': 10, 'BBB': 5})
+    port.add_price_data(data)
+    lookups = []
+    for ticker, sd in data.items():
+        def get_price(time=None, mode='exact', ticker=ticker, original=sd.get_price):
+            lookups.append(ticker)
+            return original(time, mode)
+        sd.get_price = get_price
+    return port, lookups
+
+
+def test_new_timestamp_reprices_only_tickers_with_a_bar(portfolio):
+    port, lookups = portfolio
+    assert port.get_value(T0) == 1000.0 + 10 * 10.0 + 5 * 20.0
+    assert sorted(lookups) == ['AAA', 'BBB']
+
+    lookups.clear()
+    port.get_value(T1)  # BBB has no bar: keeps its mark, market closed
+    assert lookups == ['AAA']
+
+    lookups.clear()
+    assert port.get_value(T2) == 1000.0 + 10 * 12.0 + 5 * 22.0
+    assert sorted(lookups) == ['AAA', 'BBB']
+
+
+def test_fill_remarks_only_its_own_ticker(portfolio):
+    port, lookups = portfolio
+    port.get_value(T0)
+    lookups.clear()
+    port.buy('AAA', 10.0, 5, T0)
+    assert lookups == ['AAA']  # the fill's own price check
+
+    lookups.clear()
+    assert port.get_value(T0) == 1000.0 - 50.0 + 15 * 10.0 + 5 * 20.0
+    assert lookups == []
+
+
+def test_marks_match_full_repricing(portfolio):
+    port, lookups = portfolio
+    for timestamp in (T0, T1, T2):
+        port.get_value(timestamp)
+    port.sell('BBB', 22.0, 2, T2)
+    incremental = port.get_value(T2)
+    port.invalidate_marks()
+    assert port.get_value(T2) == incremental